@@ -5,7 +5,11 @@ from sudachipy import dictionary
 import os
 import csv
 import json
-import re
+
+from coding_rules import (
+    Paragraph, compile_rule, compile_rules, load_vocabulary, match_codes, read_rule_blocks,
+    vocabulary_cache_path,
+)
 
 # --- 設定 ---
 INPUT_JSON_PATH = '/home/ubuntu/cur/isep/clause-viewer/data-integrated.json'
@@ -17,234 +21,38 @@ SUDACHI_USER_DICT_PATH = '/home/ubuntu/cur/isep/sudachi_user.dic'
 OUTPUT_CSV_PATH = '/home/ubuntu/cur/isep/analysis_results_sudachi_paragraphs.csv'
 
 # --- コーディングルールの読み込み ---
-def load_coding_rules():
+def load_coding_rules(path=CODING_RULES_PATH):
     """
-    KH Coderのコーディングルールファイルを読み込み、辞書形式で返す
+    KH Coderのコーディングルールファイルを読み込み、{コード名: 構文木} の辞書で返す
+    条件式は読み込み時に1回だけコンパイルし、構文エラーのあるコードは表示して除外する
     """
-    rules = {}
-    current_code = None
-    
     try:
-        with open(CODING_RULES_PATH, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith('*'):
-                    current_code = line
-                    rules[current_code] = ''
-                elif current_code:
-                    rules[current_code] += ' ' + line
-        
-        # 各ルールをクリーンアップ
-        for code in rules:
-            rules[code] = rules[code].strip()
-        
-        print(f"コーディングルール {len(rules)} 件を読み込みました")
-        return rules
+        blocks = read_rule_blocks(path)
     except Exception as e:
         print(f"コーディングルール読み込みエラー: {e}")
         return {}
 
-# --- 簡易的なルール判定（キーワードベース） ---
-def check_coding_rules(text, morphemes, rules):
+    rules, errors = compile_rules(blocks)
+    for code, message in errors.items():
+        print(f"コーディングルールの構文エラー（このコードは判定しません）: {code}: {message}")
+    print(f"コーディングルール {len(rules)} 件を読み込みました")
+    return rules
+
+# --- ルール判定 ---
+def check_coding_rules(text, morphemes, rules, vocab=None):
     """
     テキストと形態素リストに対してコーディングルールを適用
-    該当するコードのリストを返す
+    該当するコードのリストを返す（vocab を渡すと形態素と語の一致の判定結果を使い回す）
     """
-    matched_codes = []
-    
-    # 形態素の表層形と原形のリストを作成
-    surfaces = [m.surface() for m in morphemes]
-    dict_forms = [m.dictionary_form() for m in morphemes]
-    
-    for code, rule in rules.items():
-        if evaluate_rule(text, surfaces, dict_forms, rule):
-            matched_codes.append(code)
-    
-    return matched_codes
+    return match_codes(rules, Paragraph.from_morphemes(text, morphemes, vocab))
 
 def evaluate_rule(text, surfaces, dict_forms, rule):
     """
-    KH Coderのルール構文を完全に評価
-    """
-    # ルールを評価可能な形に変換
-    try:
-        return parse_and_evaluate(rule, text, surfaces, dict_forms)
-    except Exception as e:
-        # エラーが発生した場合は該当なしとする
-        return False
-
-def parse_and_evaluate(expr, text, surfaces, dict_forms):
-    """
-    式を再帰的にパースして評価
-    """
-    expr = expr.strip()
-    
-    # 括弧の処理
-    if expr.startswith('(') and expr.endswith(')'):
-        # 最外の括弧を除去
-        expr = expr[1:-1].strip()
-    
-    # or演算子で分割（最も優先度が低い）
-    parts = split_by_operator(expr, 'or')
-    if len(parts) > 1:
-        return any(parse_and_evaluate(part, text, surfaces, dict_forms) for part in parts)
-    
-    # and演算子で分割
-    parts = split_by_operator(expr, 'and')
-    if len(parts) > 1:
-        return all(parse_and_evaluate(part, text, surfaces, dict_forms) for part in parts)
-    
-    # not演算子の処理
-    if expr.startswith('not '):
-        return not parse_and_evaluate(expr[4:].strip(), text, surfaces, dict_forms)
-    
-    # near構文の処理
-    near_match = re.match(r'near\(([^)]+)\)\[([b\d]+)\]', expr)
-    if near_match:
-        words = near_match.group(1).split('-')
-        distance_str = near_match.group(2)
-        # bが付いている場合は後方検索、数値のみは前方検索
-        backward = distance_str.startswith('b')
-        distance = int(distance_str.replace('b', ''))
-        return check_near(words, surfaces, dict_forms, distance, backward)
-    
-    # seq構文の処理
-    seq_match = re.match(r'seq\(([^)]+)\)\[([b\d]+)\]', expr)
-    if seq_match:
-        words = seq_match.group(1).split('-')
-        distance_str = seq_match.group(2)
-        backward = distance_str.startswith('b')
-        distance = int(distance_str.replace('b', ''))
-        return check_seq(words, surfaces, dict_forms, distance, backward)
-    
-    # 単純なキーワード検索
-    keyword = expr.strip()
-    return check_keyword(keyword, text, surfaces, dict_forms)
-
-def split_by_operator(expr, operator):
-    """
-    括弧のネストを考慮して演算子で式を分割
-    """
-    parts = []
-    current = []
-    depth = 0
-    i = 0
-    
-    while i < len(expr):
-        char = expr[i]
-        
-        if char == '(':
-            depth += 1
-            current.append(char)
-        elif char == ')':
-            depth -= 1
-            current.append(char)
-        elif depth == 0:
-            # 演算子の検出
-            if expr[i:i+len(operator)+2] == f' {operator} ':
-                parts.append(''.join(current).strip())
-                current = []
-                i += len(operator) + 1
-            else:
-                current.append(char)
-        else:
-            current.append(char)
-        
-        i += 1
-    
-    if current:
-        parts.append(''.join(current).strip())
-    
-    return parts if len(parts) > 1 else [expr]
-
-def check_near(words, surfaces, dict_forms, distance, backward=False):
-    """
-    near構文の判定: 複数の単語が指定距離内に出現するか
+    KH Coderのルール（条件式の文字列またはコンパイル済みの構文木）を評価
     """
-    all_terms = surfaces + dict_forms
-    
-    # 各単語の出現位置を取得
-    positions = {}
-    for word in words:
-        positions[word] = []
-        for i, term in enumerate(all_terms):
-            if word in term or term in word:
-                positions[word].append(i)
-    
-    # すべての単語が出現しているか確認
-    if not all(positions[word] for word in words):
-        return False
-    
-    # 任意の組み合わせで距離条件を満たすか確認
-    for i, word1 in enumerate(words[:-1]):
-        for pos1 in positions[word1]:
-            for word2 in words[i+1:]:
-                for pos2 in positions[word2]:
-                    if backward:
-                        # 後方検索: word2がword1より前にあり、距離以内
-                        if pos2 < pos1 and pos1 - pos2 <= distance:
-                            return True
-                    else:
-                        # 前方検索: word2がword1より後にあり、距離以内
-                        if pos2 > pos1 and pos2 - pos1 <= distance:
-                            return True
-    
-    return False
-
-def check_seq(words, surfaces, dict_forms, distance, backward=False):
-    """
-    seq構文の判定: 単語が指定された順序で距離内に出現するか
-    """
-    all_terms = surfaces + dict_forms
-    
-    # 最初の単語の位置を探す
-    first_word = words[0]
-    for i, term in enumerate(all_terms):
-        if first_word in term or term in first_word:
-            # この位置から順番に他の単語を探す
-            current_pos = i
-            found_all = True
-            
-            for next_word in words[1:]:
-                found = False
-                search_range = range(current_pos + 1, min(current_pos + distance + 1, len(all_terms)))
-                
-                if backward:
-                    search_range = range(max(0, current_pos - distance), current_pos)
-                
-                for j in search_range:
-                    if next_word in all_terms[j] or all_terms[j] in next_word:
-                        current_pos = j
-                        found = True
-                        break
-                
-                if not found:
-                    found_all = False
-                    break
-            
-            if found_all:
-                return True
-    
-    return False
-
-def check_keyword(keyword, text, surfaces, dict_forms):
-    """
-    単純なキーワード検索
-    """
-    all_terms = surfaces + dict_forms
-    
-    # テキスト中に直接含まれるか
-    if keyword in text:
-        return True
-    
-    # 形態素リストに含まれるか
-    for term in all_terms:
-        if keyword == term or keyword in term:
-            return True
-    
-    return False
+    if isinstance(rule, str):
+        rule = compile_rule(rule)
+    return rule.evaluate(Paragraph(text, surfaces, dict_forms))
 
 # --- 1. ユーザー辞書の準備 ---
 def prepare_user_dictionary():
@@ -426,6 +234,13 @@ def analyze_text():
     
     # コーディングルールを読み込み
     coding_rules = load_coding_rules()
+    # 形態素と語の一致の判定結果（語彙キャッシュ）を読み込み
+    try:
+        vocab = load_vocabulary(coding_rules, CODING_RULES_PATH)
+        print(f"語彙キャッシュ: {len(vocab)} 語")
+    except OSError as e:
+        print(f"語彙キャッシュを使わずに判定します: {e}")
+        vocab = None
     
     print("形態素解析を開始します...")
     # 各段落の本文を解析
@@ -447,7 +262,7 @@ def analyze_text():
             morphemes = tokenizer_obj.tokenize(text, mode)
             
             # コーディングルールを適用
-            matched_codes = check_coding_rules(text, morphemes, coding_rules)
+            matched_codes = check_coding_rules(text, morphemes, coding_rules, vocab)
             codes_str = ','.join(matched_codes) if matched_codes else ''
             
             for i, m in enumerate(morphemes):
@@ -473,6 +288,12 @@ def analyze_text():
 
 
     print("解析が完了しました。結果をファイルに出力します...")
+    if vocab is not None:
+        try:
+            vocab.save(vocabulary_cache_path(CODING_RULES_PATH))
+            print(f"語彙キャッシュ（{len(vocab)} 語）を保存しました。")
+        except OSError as e:
+            print(f"語彙キャッシュの保存中にエラーが発生しました: {e}")
     # 結果をDataFrameに変換してCSVに出力
     results_df = pd.DataFrame(analysis_results)
     try:
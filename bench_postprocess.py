@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+postprocess_text.remove_japanese_spaces() のマイクロベンチマーク
+
+以前の実装（行ごとに re.sub を変化しなくなるまで繰り返す）と現在の1パスの実装を
+同じテキストで実行し、所要時間を比較する。出力が一致することも確認する。
+
+縦書きのPDFから抽出したテキストは「第 １ 条 　 こ の 条 例 は …」のように
+1文字ごとに空白が入った長い行になり、以前の実装では1回の置換で隣り合う空白の半分程度しか
+消えないため、同じ行を何度も走査することになる。
+既定では out_txt_YYYY/ と out_YYYY/ の *_PDF.txt から、そのような行が多い（遅い）ものを選ぶ。
+コーパスが無い環境では --synthetic で同様の行を生成する。
+
+使用例:
+  python bench_postprocess.py                      # コーパスの最悪5ファイル
+  python bench_postprocess.py --top 20 --repeat 5
+  python bench_postprocess.py out_txt_2020/芳賀町_Ordinance_PDF.txt
+  python bench_postprocess.py --synthetic --line-chars 5000
+  python bench_postprocess.py --json bench_postprocess.json
+"""
+
+import re
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+from postprocess_text import remove_japanese_spaces
+
+DEFAULT_GLOBS = ["out_txt_*/*_PDF.txt", "out_*/*_PDF.txt"]
+JAPANESE_PATTERN = r'[぀-ゟ゠-ヿ一-鿿　-〿（）「」『』【】〔〕！-～]'
+_SPACE_RE = re.compile(r'[ 　\t]')
+
+
+def remove_japanese_spaces_fixpoint(text):
+    """以前の実装（比較用）"""
+    lines = text.split('\n')
+    processed_lines = []
+    for line in lines:
+        prev_line = None
+        while prev_line != line:
+            prev_line = line
+            line = re.sub(f'({JAPANESE_PATTERN})[ 　\t]+({JAPANESE_PATTERN})', r'\1\2', line)
+        processed_lines.append(line)
+    return '\n'.join(processed_lines)
+
+
+def cost_score(text):
+    """以前の実装のおおよその処理量（行の長さ x 行内の空白数 の合計）"""
+    return sum(len(line) * len(_SPACE_RE.findall(line)) for line in text.split('\n'))
+
+
+def synthetic_text(line_chars, lines, seed=0):
+    """縦書きPDF風の、1文字ごとに空白が入った行からなるテキスト"""
+    rnd = random.Random(seed)
+    source = "第一条この条例は太陽光発電設備の設置に関し必要な事項を定めるものとする。市長は、事業者に対し指導及び助言を行う（２）"
+    out = []
+    for _ in range(lines):
+        chars = [rnd.choice(source) for _ in range(line_chars)]
+        out.append("".join(c + rnd.choice([" ", " ", "  ", "　", " 　 "]) for c in chars))
+    return "\n".join(out)
+
+
+def find_inputs(paths, top):
+    """指定されたファイル・ディレクトリ（無ければ既定のglob）から、処理量の大きい順に top 件を選ぶ"""
+    files = []
+    for p in paths:
+        path = Path(p)
+        if path.is_dir():
+            files.extend(sorted(path.glob("*_PDF.txt")))
+        else:
+            files.append(path)
+    if not paths:
+        for pattern in DEFAULT_GLOBS:
+            files.extend(Path(f) for f in sorted(glob.glob(pattern)))
+    seen = set()
+    scored = []
+    for f in files:
+        if f in seen or not f.is_file():
+            continue
+        seen.add(f)
+        text = f.read_text(encoding="utf-8", errors="replace")
+        scored.append((cost_score(text), str(f), text))
+    scored.sort(key=lambda x: -x[0])
+    return scored[:top]
+
+
+def best_time(func, text, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="remove_japanese_spaces() の以前の実装と現在の実装を比較するベンチマーク",
+    )
+    parser.add_argument("paths", nargs="*", help="対象の *_PDF.txt またはそれを含むディレクトリ（省略時は out_txt_*/ と out_*/）")
+    parser.add_argument("--top", type=int, default=5, help="処理量の大きい順に比較するファイル数（デフォルト: 5）")
+    parser.add_argument("--repeat", type=int, default=3, help="各実装の実行回数（最速値を報告、デフォルト: 3）")
+    parser.add_argument("--synthetic", action="store_true", help="コーパスの代わりに縦書きPDF風のテキストを生成する")
+    parser.add_argument("--line-chars", type=int, default=2000, help="--synthetic: 1行の文字数（デフォルト: 2000）")
+    parser.add_argument("--lines", type=int, default=20, help="--synthetic: 行数（デフォルト: 20）")
+    parser.add_argument("--json", type=str, default=None, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        text = synthetic_text(args.line_chars, args.lines)
+        inputs = [(cost_score(text), f"synthetic({args.lines}行 x {args.line_chars}文字)", text)]
+    else:
+        inputs = find_inputs(args.paths, args.top)
+        if not inputs:
+            print("エラー: 対象の *_PDF.txt が見つかりません（--synthetic で生成したテキストを使えます）")
+            sys.exit(1)
+
+    rows = []
+    print(f"{'以前 [秒]':>10} {'現在 [秒]':>10} {'倍率':>8}  ファイル")
+    for score, name, text in inputs:
+        old_time, old_out = best_time(remove_japanese_spaces_fixpoint, text, args.repeat)
+        new_time, new_out = best_time(remove_japanese_spaces, text, args.repeat)
+        if old_out != new_out:
+            print(f"エラー: 出力が一致しません: {name}")
+            sys.exit(1)
+        speedup = old_time / new_time if new_time > 0 else float("inf")
+        print(f"{old_time:>10.4f} {new_time:>10.4f} {speedup:>7.1f}x  {name}")
+        rows.append({
+            "file": name,
+            "chars": len(text),
+            "cost_score": score,
+            "fixpoint_sec": round(old_time, 6),
+            "single_pass_sec": round(new_time, 6),
+            "speedup": round(speedup, 2),
+        })
+
+    total_old = sum(r["fixpoint_sec"] for r in rows)
+    total_new = sum(r["single_pass_sec"] for r in rows)
+    print("-" * 50)
+    print(f"{total_old:>10.4f} {total_new:>10.4f} {total_old / total_new if total_new else float('inf'):>7.1f}x  合計（出力はすべて一致）")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows, "fixpoint_sec": total_old, "single_pass_sec": total_new}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_fetch.py のクローラー性能をローカルのモックサーバーで測るベンチマーク
+
+例規集のHTML/PDFのフィクスチャを localhost のHTTPサーバー（別プロセス）から配信し、
+生成した urls_YYYY.csv で web_fetch.process_single_file() を実行する。
+実サーバーにアクセスせずに、取得層の変更前後のスループットを比較できる。
+
+サーバーは遅延・帯域制限・エラー率・HEAD非対応・常に503を返すホスト（--down-hosts）を設定できる。
+127.0.0.1, 127.0.0.2, ... を別ホストとして使うので、ホストごとの同時接続数制限も効く。
+
+報告する値:
+  - URL/秒、バイト/秒
+  - 段階別（index.jsonl の timings: host_wait, headers, download, parse, trafilatura, ..., total）の
+    レイテンシのパーセンタイル
+  - クローラープロセスのピークRSS
+
+使用例:
+  python bench_web_fetch.py                              # 生成したフィクスチャで200自治体
+  python bench_web_fetch.py -n 500 -w 16 --hosts 8       # 16並行、8ホスト
+  python bench_web_fetch.py --latency-ms 200 --bandwidth-kbps 512 --error-rate 0.05
+  python bench_web_fetch.py --fixtures recorded/         # 保存済みのHTML/PDFを配信
+  python bench_web_fetch.py --json bench.json            # 結果をJSONでも保存
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_PATH = Path(__file__).resolve()
+URL_COLUMNS = ["Ordinance_HTML", "Regulation_HTML", "Ordinance_PDF", "Regulation_PDF"]
+CONTENT_TYPES = {".html": "text/html", ".htm": "text/html", ".pdf": "application/pdf"}
+SEND_CHUNK_SIZE = 16 * 1024
+
+
+# --- フィクスチャ ---
+
+ARTICLE = "第{n}条　この条例は、太陽光発電設備の設置に関し必要な事項を定めるものとする。市長は、事業者に対し必要な指導及び助言を行うことができる。"
+
+
+def _article_lines(count):
+    return [ARTICLE.format(n=n) for n in range(1, count + 1)]
+
+
+def gyosei_html(articles):
+    """ぎょうせい（reiki_honbun）テンプレート風のページ（Shift_JIS）"""
+    rows = "".join(f'<div class="eline"><p>{line}</p></div>' for line in _article_lines(articles))
+    html = (
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">'
+        '<title>太陽光発電設備の設置に関する条例</title><script>var x = 1;</script></head>'
+        '<body><div id="header">ヘッダー</div><div id="primaryInner2">'
+        '<p class="title">○太陽光発電設備の設置に関する条例</p>'
+        f'{rows}</div><div id="footer">フッター</div></body></html>'
+    )
+    return html.encode("cp932")
+
+
+def generic_html(articles):
+    """テンプレート不明の自治体サイト風のページ（UTF-8、汎用抽出を通る）"""
+    paragraphs = "".join(f"<p>{line}</p>" for line in _article_lines(articles))
+    html = (
+        '<html><head><meta charset="utf-8"><title>条例</title></head>'
+        '<body><nav><ul><li>トップ</li><li>くらし</li><li>まちづくり</li></ul></nav>'
+        f'<main><h1>太陽光発電設備の設置に関する条例</h1>{paragraphs}</main>'
+        '<footer>○○市役所</footer></body></html>'
+    )
+    return html.encode("utf-8")
+
+
+def text_pdf(pages, articles_per_page):
+    """テキストレイヤーのあるPDF（PyMuPDF で生成）"""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    lines = _article_lines(articles_per_page)
+    for _ in range(pages):
+        page = doc.new_page()
+        y = 60
+        for line in lines:
+            page.insert_text((40, y), line[:40], fontname="japan", fontsize=9)
+            y += 14
+    body = doc.tobytes()
+    doc.close()
+    return body
+
+
+def generate_fixtures(fixtures_dir, pdf_pages):
+    """ベンチマーク用のHTML/PDFを fixtures_dir に書き出す"""
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    (fixtures_dir / "gyosei_short.html").write_bytes(gyosei_html(10))
+    (fixtures_dir / "gyosei_long.html").write_bytes(gyosei_html(200))
+    (fixtures_dir / "generic_short.html").write_bytes(generic_html(10))
+    (fixtures_dir / "generic_long.html").write_bytes(generic_html(200))
+    try:
+        (fixtures_dir / "small.pdf").write_bytes(text_pdf(1, 40))
+        (fixtures_dir / "large.pdf").write_bytes(text_pdf(pdf_pages, 40))
+    except ImportError:
+        print("警告: PyMuPDF が無いためPDFのフィクスチャを生成しません。")
+
+
+def load_fixtures(fixtures_dir):
+    """配信可能なフィクスチャを HTML/PDF に分けて返す"""
+    html, pdf = [], []
+    for path in sorted(Path(fixtures_dir).iterdir()):
+        suffix = path.suffix.lower()
+        if suffix in (".html", ".htm"):
+            html.append(path.name)
+        elif suffix == ".pdf":
+            pdf.append(path.name)
+    return html, pdf
+
+
+# --- モックサーバー（別プロセスで実行） ---
+
+def make_handler(fixtures_dir, latency_ms, jitter_ms, bandwidth_kbps, error_rate, no_head, seed,
+                 down_addresses=()):
+    bodies = {}
+    for path in Path(fixtures_dir).iterdir():
+        if path.suffix.lower() in CONTENT_TYPES:
+            bodies[path.name] = (path.read_bytes(), CONTENT_TYPES[path.suffix.lower()])
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    down_addresses = set(down_addresses)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _delay(self):
+            with rng_lock:
+                jitter = rng.uniform(0, jitter_ms) if jitter_ms else 0
+                fail = rng.random() < error_rate
+            if latency_ms or jitter:
+                time.sleep((latency_ms + jitter) / 1000)
+            return fail
+
+        def _lookup(self):
+            # /<自治体>/<フィクスチャ名> のフィクスチャ名部分だけを見る
+            return bodies.get(self.path.split("?")[0].rsplit("/", 1)[-1])
+
+        def _send_headers(self, status, length, content_type="text/plain"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+
+        def do_HEAD(self):
+            if no_head:
+                self._send_headers(405, 0)
+                return
+            found = self._lookup()
+            if found is None:
+                self._send_headers(404, 0)
+                return
+            body, content_type = found
+            self._send_headers(200, len(body), content_type)
+
+        def do_GET(self):
+            fail = self._delay()
+            found = self._lookup()
+            if found is None:
+                self._send_headers(404, 0)
+                return
+            if fail or self.connection.getsockname()[0] in down_addresses:
+                self._send_headers(503, 0)
+                return
+            body, content_type = found
+            self._send_headers(200, len(body), content_type)
+            if not bandwidth_kbps:
+                self.wfile.write(body)
+                return
+            # 接続ごとの帯域制限
+            bytes_per_sec = bandwidth_kbps * 1024 / 8
+            for start in range(0, len(body), SEND_CHUNK_SIZE):
+                chunk = body[start:start + SEND_CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / bytes_per_sec)
+
+    return Handler
+
+
+def serve(args):
+    """--serve: フィクスチャを配信し、待ち受けポートを標準出力に書く"""
+    handler = make_handler(
+        args.fixtures, args.latency_ms, args.jitter_ms, args.bandwidth_kbps,
+        args.error_rate, args.no_head, args.seed,
+        down_host_addresses(args.hosts, args.down_hosts),
+    )
+    # 127.0.0.2 などを別ホストとして使うため、127.0.0.1 だけでなく全アドレスで待ち受ける
+    server = ThreadingHTTPServer(("", 0), handler)
+    server.daemon_threads = True
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def down_host_addresses(hosts, down_hosts):
+    """--down-hosts: 127.0.0.1〜 のうち末尾の down_hosts 個を落ちているホストにする"""
+    return [f"127.0.0.{i + 1}" for i in range(max(0, hosts - down_hosts), hosts)]
+
+
+def start_server(fixtures_dir, args):
+    cmd = [
+        sys.executable, str(SCRIPT_PATH), "--serve",
+        "--fixtures", str(fixtures_dir),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--bandwidth-kbps", str(args.bandwidth_kbps),
+        "--error-rate", str(args.error_rate),
+        "--seed", str(args.seed),
+        "--hosts", str(args.hosts),
+        "--down-hosts", str(args.down_hosts),
+    ]
+    if args.no_head:
+        cmd.append("--no-head")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    port = int(proc.stdout.readline())
+    return proc, port
+
+
+# --- URLリスト ---
+
+def write_urls_csv(path, municipalities, hosts, port, html_fixtures, pdf_fixtures, pdf_ratio, seed):
+    """
+    urls_YYYY.csv を生成する。
+    自治体ごとにHTMLかPDFのどちらかを割り当てる（web_fetch はHTMLのある自治体のPDFを取得しないため）。
+    """
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Prefecture", "Municipality"] + URL_COLUMNS)
+        for i in range(municipalities):
+            base = f"http://127.0.0.{i % hosts + 1}:{port}/m{i}"
+            use_pdf = pdf_fixtures and (not html_fixtures or rng.random() < pdf_ratio)
+            row = {col: "" for col in URL_COLUMNS}
+            if use_pdf:
+                row["Ordinance_PDF"] = f"{base}/{rng.choice(pdf_fixtures)}"
+                row["Regulation_PDF"] = f"{base}/{rng.choice(pdf_fixtures)}"
+            else:
+                row["Ordinance_HTML"] = f"{base}/{rng.choice(html_fixtures)}"
+                row["Regulation_HTML"] = f"{base}/{rng.choice(html_fixtures)}"
+            writer.writerow(["ベンチ県", f"ベンチ市{i}"] + [row[col] for col in URL_COLUMNS])
+
+
+# --- 計測 ---
+
+def percentile(sorted_values, q):
+    """最近傍順位法によるパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def stage_samples(records):
+    """レコードの timings を段階別の所要時間のリストにまとめる"""
+    samples = {}
+    for rec in records:
+        for stage, sec in rec.get("timings", {}).items():
+            samples.setdefault(stage, []).append(sec)
+    return samples
+
+
+def summarize_stages(samples):
+    summary = {}
+    for stage, values in samples.items():
+        values = sorted(values)
+        summary[stage] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return summary
+
+
+def read_index(index_path):
+    records = []
+    if index_path.exists():
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+
+def run_benchmark(args):
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_web_fetch_"))
+    fixtures_dir = Path(args.fixtures) if args.fixtures else work_dir / "fixtures"
+    if not args.fixtures:
+        generate_fixtures(fixtures_dir, args.pdf_pages)
+    html_fixtures, pdf_fixtures = load_fixtures(fixtures_dir)
+    if not html_fixtures and not pdf_fixtures:
+        print(f"エラー: フィクスチャがありません: {fixtures_dir}")
+        sys.exit(1)
+
+    proc, port = start_server(fixtures_dir.resolve(), args)
+    cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        urls_path = work_dir / f"urls_{args.year}.csv"
+        write_urls_csv(urls_path, args.municipalities, args.hosts, port,
+                       html_fixtures, pdf_fixtures, args.pdf_ratio, args.seed)
+
+        sys.path.insert(0, str(SCRIPT_PATH.parent))
+        import web_fetch
+
+        web_fetch.HOST_SCHEDULER = web_fetch.HostScheduler(
+            max_per_host=args.per_host, delay=args.host_delay if args.workers > 1 else 0.0,
+        )
+        web_fetch.RETRY_BACKOFF = args.retry_backoff
+        if args.blob_store:
+            web_fetch.BLOB_STORE = web_fetch.BlobStore(work_dir / "blobs")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        log = io.StringIO()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+                success, skip, error, total = web_fetch.process_single_file(
+                    str(urls_path), workers=args.workers,
+                )
+        finally:
+            web_fetch.close_sessions()
+        elapsed = time.perf_counter() - start
+        rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        records = read_index(work_dir / f"out_{args.year}" / "index.jsonl")
+        total_bytes = sum(rec.get("bytes") or 0 for rec in records)
+    finally:
+        os.chdir(cwd)
+        proc.terminate()
+        proc.wait()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "config": {
+            "municipalities": args.municipalities,
+            "workers": args.workers,
+            "per_host": args.per_host,
+            "host_delay": args.host_delay,
+            "hosts": args.hosts,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "bandwidth_kbps": args.bandwidth_kbps,
+            "error_rate": args.error_rate,
+            "no_head": args.no_head,
+            "down_hosts": args.down_hosts,
+            "blob_store": args.blob_store,
+            "fixtures": str(args.fixtures) if args.fixtures else "generated",
+        },
+        "urls": total,
+        "success": success,
+        "skip": skip,
+        "error": error,
+        "retried": sum(1 for rec in records if (rec.get("attempts") or 1) > 1),
+        "elapsed_s": elapsed,
+        "urls_per_s": total / elapsed if elapsed else 0.0,
+        "bytes": total_bytes,
+        "bytes_per_s": total_bytes / elapsed if elapsed else 0.0,
+        # Linux の ru_maxrss はKB単位
+        "peak_rss_mb": rss_peak / 1024,
+        "rss_before_mb": rss_before / 1024,
+        "stages": summarize_stages(stage_samples(records)),
+        "work_dir": str(work_dir) if args.keep else None,
+    }
+
+
+def print_report(result):
+    print(f"\n{'='*60}")
+    print("ベンチマーク結果")
+    print(f"  URL数:        {result['urls']} (成功 {result['success']} / スキップ {result['skip']} / エラー {result['error']})")
+    print(f"  再試行したURL: {result['retried']}")
+    print(f"  所要時間:     {result['elapsed_s']:.2f} 秒")
+    print(f"  スループット: {result['urls_per_s']:.1f} URL/秒, {result['bytes_per_s'] / 1024 / 1024:.2f} MB/秒")
+    print(f"  ピークRSS:    {result['peak_rss_mb']:.1f} MB (開始時 {result['rss_before_mb']:.1f} MB)")
+    print(f"\n  {'段階':<14}{'件数':>7}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for stage, s in result["stages"].items():
+        print(f"  {stage:<14}{s['count']:>7}{s['p50_ms']:>10.1f}{s['p90_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    if result["work_dir"]:
+        print(f"\n  作業ディレクトリ: {result['work_dir']}")
+    print(f"{'='*60}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="web_fetch.py のクロール性能をローカルのモックサーバーで測定する",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用例:
+  python bench_web_fetch.py                              # 生成したフィクスチャで200自治体
+  python bench_web_fetch.py -n 500 -w 16 --hosts 8       # 16並行、8ホスト
+  python bench_web_fetch.py --latency-ms 200 --bandwidth-kbps 512 --error-rate 0.05
+  python bench_web_fetch.py --fixtures recorded/         # 保存済みのHTML/PDFを配信
+  python bench_web_fetch.py --json bench.json            # 結果をJSONでも保存
+        """
+    )
+    parser.add_argument("--municipalities", "-n", type=int, default=200, help="生成する自治体数（1自治体あたり2URL、デフォルト: 200）")
+    parser.add_argument("--workers", "-w", type=int, default=8, help="web_fetch の並行数（デフォルト: 8）")
+    parser.add_argument("--per-host", type=int, default=4, help="ホストあたりの同時接続数の上限（デフォルト: 4）")
+    parser.add_argument("--retry-backoff", type=float, default=0.1, help="web_fetch の再試行の待ち時間の基準（秒、デフォルト: 0.1）")
+    parser.add_argument("--host-delay", type=float, default=0.0, help="同一ホストへのリクエスト間隔（秒、デフォルト: 0）")
+    parser.add_argument("--hosts", type=int, default=4, help="URLを分散させるホスト数（127.0.0.1〜、デフォルト: 4）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="サーバーの応答遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="応答遅延に加える一様乱数の最大値（ミリ秒）")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0.0, help="接続ごとの帯域（kbit/秒、0で無制限）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す割合（0〜1）")
+    parser.add_argument("--no-head", action="store_true", help="HEADリクエストに405を返す")
+    parser.add_argument("--down-hosts", type=int, default=0, help="常に503を返すホスト数（サーキットブレーカーの確認用）")
+    parser.add_argument("--fixtures", type=str, help="配信するHTML/PDFのディレクトリ（省略時は生成する）")
+    parser.add_argument("--pdf-ratio", type=float, default=0.3, help="PDFを割り当てる自治体の割合（デフォルト: 0.3）")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="生成する大きいPDFのページ数（デフォルト: 20）")
+    parser.add_argument("--blob-store", action="store_true", help="ブロブストアを有効にして測定する")
+    parser.add_argument("--year", type=str, default="2020", help="生成する urls_YYYY.csv の年（デフォルト: 2020）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード（デフォルト: 0）")
+    parser.add_argument("--json", type=str, help="結果をJSONで保存するパス")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリを削除しない")
+    parser.add_argument("--verbose", "-v", action="store_true", help="web_fetch の進捗表示をそのまま出力する")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
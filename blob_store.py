@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sha256をキーとしたコンテンツアドレス型のブロブストア
+
+同じ条例のPDF/HTMLが複数年の urls_YYYY.csv に現れても、本文は blobs/objects/ に
+1つだけ保存する。年別ディレクトリ（out_pdf_YYYY/ など）のPDFはブロブへの
+ハードリンク、HTMLは index.jsonl の bytes_sha256 がブロブへの参照になる。
+抽出結果などの派生データは blobs/derived/ に同じハッシュで保存し、
+同一文書のテキスト抽出は1回で済ませる。
+
+使用例:
+  python blob_store.py stats             # ブロブ数と容量を表示
+  python blob_store.py verify            # 全ブロブのハッシュを検証
+  python blob_store.py gc --dry-run      # 参照されていないブロブを表示
+  python blob_store.py gc                # 参照されていないブロブを削除
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+DEFAULT_ROOT = Path("blobs")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# mkstemp は 0600 で作成するため、通常のファイルと同じ umask 由来の権限に揃える
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+class BlobStore:
+    """sha256 をキーにした本文・派生データの保存先"""
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.derived = self.root / "derived"
+        self.tmp = self.root / "tmp"
+        for d in (self.objects, self.derived, self.tmp):
+            d.mkdir(parents=True, exist_ok=True)
+
+    # --- 本文 ---
+    def blob_path(self, sha256):
+        return self.objects / sha256[:2] / sha256
+
+    def has(self, sha256):
+        return self.blob_path(sha256).exists()
+
+    def put_bytes(self, body, sha256=None):
+        """本文を保存してsha256を返す（保存済みなら何もしない）"""
+        sha256 = sha256 or hashlib.sha256(body).hexdigest()
+        if not self.has(sha256):
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp)
+            os.fchmod(fd, FILE_MODE)
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            self.put_file(tmp_path, sha256)
+        return sha256
+
+    def put_file(self, tmp_path, sha256):
+        """
+        書き終えた一時ファイルをブロブとして取り込む（ストア内での rename なのでアトミック）。
+        既に同じブロブがあれば一時ファイルは削除する。
+        """
+        dest = self.blob_path(sha256)
+        if dest.exists():
+            os.unlink(tmp_path)
+            return sha256
+        dest.parent.mkdir(exist_ok=True)
+        os.replace(tmp_path, dest)
+        return sha256
+
+    def link(self, sha256, dest):
+        """
+        年別ディレクトリの dest をブロブへのハードリンクにする。
+        別ファイルシステムなどでハードリンクできない場合はコピーする。
+        """
+        dest = Path(dest)
+        tmp_dest = dest.with_name(dest.name + ".part")
+        if tmp_dest.exists():
+            tmp_dest.unlink()
+        try:
+            os.link(self.blob_path(sha256), tmp_dest)
+        except OSError:
+            shutil.copyfile(self.blob_path(sha256), tmp_dest)
+        os.replace(tmp_dest, dest)
+
+    # --- 派生データ（抽出テキストなど） ---
+    def derived_path(self, sha256, kind):
+        return self.derived / sha256[:2] / f"{sha256}.{kind}"
+
+    def read_derived(self, sha256, kind):
+        """派生データをテキストで返す（無ければNone）"""
+        path = self.derived_path(sha256, kind)
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8")
+
+    def write_derived(self, sha256, kind, text):
+        path = self.derived_path(sha256, kind)
+        path.parent.mkdir(exist_ok=True)
+        # 同じ本文を複数のスレッドが同時に抽出することがあるので、一時ファイル名は書き手ごとに分ける
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".part")
+        os.fchmod(fd, FILE_MODE)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    # --- 保守 ---
+    def iter_blobs(self):
+        for path in sorted(self.objects.glob("*/*")):
+            if SHA256_RE.match(path.name):
+                yield path.name, path
+
+    def verify(self):
+        """全ブロブのハッシュを再計算し、内容が壊れているブロブのsha256のリストを返す"""
+        corrupt = []
+        for sha256, path in self.iter_blobs():
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            if h.hexdigest() != sha256:
+                corrupt.append(sha256)
+        return corrupt
+
+    def gc(self, live, dry_run=False):
+        """
+        参照されていないブロブと派生データを削除し、(削除件数, 解放バイト数) を返す。
+
+        ブロブは live（index.jsonl から集めたsha256）に含まれるか、
+        年別ディレクトリからハードリンクされていれば参照されているとみなす。
+        クロール中に実行すると書き込み途中のブロブを消す可能性があるため、
+        クロールしていない時に実行すること。
+        """
+        removed = 0
+        freed = 0
+        for sha256, path in self.iter_blobs():
+            st = path.stat()
+            if sha256 in live or st.st_nlink > 1:
+                continue
+            removed += 1
+            freed += st.st_size
+            if not dry_run:
+                path.unlink()
+        for path in sorted(self.derived.glob("*/*")):
+            sha256 = path.name.split(".", 1)[0]
+            # 書き込み途中で中断された一時ファイルは常に削除対象
+            if not path.name.endswith(".part") and (sha256 in live or self.has(sha256)):
+                continue
+            removed += 1
+            freed += path.stat().st_size
+            if not dry_run:
+                path.unlink()
+        # 中断されたダウンロードの一時ファイル
+        for path in self.tmp.iterdir():
+            removed += 1
+            freed += path.stat().st_size
+            if not dry_run:
+                path.unlink()
+        return removed, freed
+
+
+def collect_live_hashes(index_glob="out*/index.jsonl"):
+    """年別の index.jsonl から参照されている bytes_sha256 を集める"""
+    live = set()
+    for index_path in glob.glob(index_glob):
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                sha256 = rec.get("bytes_sha256")
+                if sha256:
+                    live.add(sha256)
+    return live
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ブロブストアの保守ツール（検証・ガベージコレクション）",
+    )
+    parser.add_argument("command", choices=["stats", "verify", "gc"], help="実行するコマンド")
+    parser.add_argument("--root", type=str, default=str(DEFAULT_ROOT), help="ブロブストアのディレクトリ（デフォルト: blobs）")
+    parser.add_argument("--dry-run", action="store_true", help="gc: 削除せずに対象件数だけ表示する")
+    parser.add_argument("--delete-corrupt", action="store_true", help="verify: 壊れたブロブを削除する（次回のクロールで再取得される）")
+    args = parser.parse_args()
+
+    store = BlobStore(args.root)
+
+    if args.command == "stats":
+        count = 0
+        size = 0
+        for _, path in store.iter_blobs():
+            count += 1
+            size += path.stat().st_size
+        print(f"ブロブ数: {count}")
+        print(f"合計サイズ: {size / 1024 / 1024:.1f} MB")
+
+    elif args.command == "verify":
+        corrupt = store.verify()
+        if not corrupt:
+            print("すべてのブロブのハッシュが一致しました。")
+            return
+        print(f"ハッシュが一致しないブロブ: {len(corrupt)} 件")
+        for sha256 in corrupt:
+            print(f"  {sha256}")
+            if args.delete_corrupt:
+                store.blob_path(sha256).unlink()
+        sys.exit(1)
+
+    elif args.command == "gc":
+        live = collect_live_hashes()
+        removed, freed = store.gc(live, dry_run=args.dry_run)
+        action = "削除対象" if args.dry_run else "削除"
+        print(f"参照中のハッシュ: {len(live)} 件")
+        print(f"{action}: {removed} 件 ({freed / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,680 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KH Coder 形式のコーディングルール（khcoder_coding_rules_PV_*.txt）のコンパイラーと評価器
+
+ルールファイルを読み込んだ時点で各コードの条件式を構文木にコンパイルし、
+段落ごとの評価では構文木だけをたどる。構文エラーのあるコードは読み込み時に報告して除外する。
+
+対応する構文（KH Coder の記法のうち、ルールファイルで使っているもの）:
+  語                     形態素（表層形・原形）との部分一致、または本文中の文字列
+  near(語1-語2-...)[N]   語1 の後 N 語以内に他の語（[bN] は前）。[N] を省略すると10
+  seq(語1-語2-...)[N]    語1, 語2, ... がこの順に、それぞれ直前の語から N 語以内に続く（[bN] は逆順）
+  not X / X and Y / X or Y / ( X )
+                         優先順位は not > and > or。演算子・括弧の前後には半角スペースを入れる
+
+語の一致の判定（check_keyword / check_near / check_seq）の結果は以前の実装と同じ。
+near/seq は段落ごとに1回作る出現位置の索引（Paragraph.positions）を全ルールで共有し、
+位置のリストを先頭から1回ずつ走査して距離を判定する。
+キーワードはルール全体で1つの Aho–Corasick オートマトン（KeywordMatcher）にまとめ、
+段落ごとに本文と形態素を1回ずつ走査して見つかったキーワードの集合を全ルールで共有する。
+形態素と語の一致の判定はコーパスの語彙（Vocabulary）ごとに1回だけ行い、
+ルールファイルの横の語彙キャッシュ（<ルールファイル>.vocab.json）に保存して次回も使う。
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import chain
+
+# near/seq の距離を省略した場合（KH Coder の既定値）
+DEFAULT_DISTANCE = 10
+# 語彙キャッシュ（*.vocab.json）の形式のバージョン
+VOCABULARY_VERSION = 1
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<func>(?:near|seq)\([^()]*\)(?:\[[^\]\s]*\])?)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<word>[^\s()]+)
+""", re.VERBOSE)
+_FUNC_RE = re.compile(r"(near|seq)\(([^()]+)\)(?:\[(b?)(\d+)\])?")
+_OPERATORS = {"or", "and", "not"}
+
+
+class RuleSyntaxError(ValueError):
+    """コーディングルールの構文エラー（pos は条件式の中の文字位置）"""
+
+    def __init__(self, message, pos):
+        super().__init__(f"{message}（{pos} 文字目）")
+        self.pos = pos
+
+
+# --- 語の一致の判定（段落内の形態素に対する評価） ---
+#
+# 形態素の位置は「表層形のリスト + 原形のリスト」を連結したリスト上の番号で数える（以前の実装と同じ）。
+# 語が形態素に一致するのは「語が形態素に含まれる」か「形態素が語に含まれる」場合。
+
+def _near_pair(positions1, positions2, distance, backward):
+    """
+    positions1 のどれかの位置から distance 語以内の後（backward なら前）に
+    positions2 の位置があるか（どちらも昇順。2本のリストを1回ずつ走査する）
+    """
+    j = 0
+    n = len(positions2)
+    if backward:
+        # pos1 - distance <= pos2 < pos1 となる pos2 があるか
+        for pos1 in positions1:
+            while j < n and positions2[j] < pos1 - distance:
+                j += 1
+            if j == n:
+                return False
+            if positions2[j] < pos1:
+                return True
+    else:
+        # pos1 < pos2 <= pos1 + distance となる pos2 があるか
+        for pos1 in positions1:
+            while j < n and positions2[j] <= pos1:
+                j += 1
+            if j == n:
+                return False
+            if positions2[j] <= pos1 + distance:
+                return True
+    return False
+
+
+def near_positions(positions, distance, backward=False):
+    """
+    near構文の判定（positions は語ごとの出現位置の昇順リスト）
+    前の語の出現位置から distance 語以内の後（backward なら前）に、それより後ろの語のどれかが出現するか
+    """
+    if not all(positions):
+        return False
+    for i, positions1 in enumerate(positions[:-1]):
+        for positions2 in positions[i+1:]:
+            if _near_pair(positions1, positions2, distance, backward):
+                return True
+    return False
+
+
+def seq_positions(positions, distance, backward=False):
+    """
+    seq構文の判定（positions は語ごとの出現位置の昇順リスト）
+    最初の語の各出現位置から、次の語を distance 語以内の後（backward なら前）で
+    最も手前（backward なら範囲の先頭）の位置に順にたどれるか
+    """
+    if not all(positions):
+        return False
+    first, rest = positions[0], positions[1:]
+    for current_pos in first:
+        for next_positions in rest:
+            if backward:
+                k = bisect_left(next_positions, max(0, current_pos - distance))
+                if k == len(next_positions) or next_positions[k] >= current_pos:
+                    break
+            else:
+                k = bisect_right(next_positions, current_pos)
+                if k == len(next_positions) or next_positions[k] > current_pos + distance:
+                    break
+            current_pos = next_positions[k]
+        else:
+            return True
+    return False
+
+
+def check_near(words, surfaces, dict_forms, distance, backward=False):
+    """
+    near構文の判定: 複数の単語が指定距離内に出現するか
+    """
+    para = Paragraph("", surfaces, dict_forms)
+    return near_positions([para.positions(word) for word in words], distance, backward)
+
+
+def check_seq(words, surfaces, dict_forms, distance, backward=False):
+    """
+    seq構文の判定: 単語が指定された順序で距離内に出現するか
+    """
+    para = Paragraph("", surfaces, dict_forms)
+    return seq_positions([para.positions(word) for word in words], distance, backward)
+
+
+def check_keyword(keyword, text, surfaces, dict_forms):
+    """
+    単純なキーワード検索
+    """
+    all_terms = surfaces + dict_forms
+
+    # テキスト中に直接含まれるか
+    if keyword in text:
+        return True
+
+    # 形態素リストに含まれるか
+    for term in all_terms:
+        if keyword == term or keyword in term:
+            return True
+
+    return False
+
+
+class KeywordMatcher:
+    """
+    複数のキーワードを1回の走査で探す Aho–Corasick オートマトン
+
+    find(text) は text に部分文字列として含まれるキーワードの集合を返す。
+    キーワードの数によらず、処理量は text の長さ（と見つかったキーワードの数）に比例する。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted(set(k for k in keywords if k))
+        # 状態ごとの遷移 {文字: 次の状態}・失敗時の遷移先・その状態で見つかるキーワード
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] = (keyword,)
+
+        # 幅優先で失敗時の遷移先を決め、遷移先で見つかるキーワードを引き継ぐ
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target
+                if self._out[target]:
+                    self._out[nxt] = self._out[nxt] + self._out[target]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find(self, text, hits=None):
+        """text に含まれるキーワードを hits（省略時は新しい集合）に加えて返す"""
+        if hits is None:
+            hits = set()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                hits.update(out[state])
+        return hits
+
+
+class Vocabulary:
+    """
+    コーパスの形態素（表層形・原形）の語彙と、各形態素に一致するルールの語の対応表
+
+    near/seq の語との一致（語が形態素に含まれるか、形態素が語に含まれる）と、
+    キーワードとの一致（キーワードが形態素に含まれる）は形態素の種類ごとに1回だけ判定し、
+    形態素の番号（語彙ID）に対する結果として覚えておく。段落の評価ではこの結果を引くだけで済む。
+    初めて出てきた形態素はその場で判定して語彙に加える。
+    """
+
+    def __init__(self, words, matcher, rules_sha256=None):
+        self.words = frozenset(words)
+        self.matcher = matcher
+        self.rules_sha256 = rules_sha256
+        self.terms = []
+        self._ids = {}
+        # 語彙IDごとの、一致する near/seq の語とキーワード
+        self._term_words = []
+        self._term_keywords = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def term_id(self, term):
+        """形態素の語彙ID（初めての形態素は一致する語を判定して追加する）"""
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = self._add(
+                term,
+                tuple(word for word in self.words if word in term or term in word),
+                tuple(self.matcher.find(term)),
+            )
+        return term_id
+
+    def _add(self, term, words, keywords):
+        term_id = len(self.terms)
+        self._ids[term] = term_id
+        self.terms.append(term)
+        self._term_words.append(words)
+        self._term_keywords.append(keywords)
+        return term_id
+
+    def words_for(self, term):
+        """形態素に一致する near/seq の語"""
+        return self._term_words[self.term_id(term)]
+
+    def keywords_for(self, term):
+        """形態素に含まれるキーワード"""
+        return self._term_keywords[self.term_id(term)]
+
+    def save(self, path):
+        """
+        語彙と {語: 一致する語彙IDのリスト} を JSON に保存する（一時ファイルに書いてから置き換える）
+        """
+        words = {word: [] for word in sorted(self.words)}
+        keywords = {keyword: [] for keyword in self.matcher.keywords}
+        for term_id in range(len(self.terms)):
+            for word in self._term_words[term_id]:
+                words[word].append(term_id)
+            for keyword in self._term_keywords[term_id]:
+                keywords[keyword].append(term_id)
+        data = {
+            "version": VOCABULARY_VERSION,
+            "rules_sha256": self.rules_sha256,
+            "terms": self.terms,
+            "words": words,
+            "keywords": keywords,
+        }
+        # 同時に実行した別のプロセスと一時ファイルが衝突しないよう、一時ファイル名は書き手ごとに分ける
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=name, suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, words, matcher, rules_sha256):
+        """
+        save() した語彙を読み込む。ファイルが無い・壊れている、または
+        ルールファイル（rules_sha256）が変わっている場合は空の語彙を返す
+        """
+        vocab = cls(words, matcher, rules_sha256)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            entries = _vocabulary_entries(data, vocab.words, matcher.keywords, rules_sha256)
+        except (OSError, ValueError):
+            return vocab
+        for term, found_words, found_keywords in entries:
+            vocab._add(term, found_words, found_keywords)
+        return vocab
+
+
+def _vocabulary_entries(data, words, keywords, rules_sha256):
+    """
+    語彙キャッシュの JSON を検証し、(形態素, 一致する語, 含まれるキーワード) のリストにする。
+    形式が違う（手で編集した・壊れた）、またはルールファイルが変わっている場合は ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError("語彙キャッシュの形式が違います")
+    if data.get("version") != VOCABULARY_VERSION or data.get("rules_sha256") != rules_sha256:
+        raise ValueError("語彙キャッシュのバージョンまたはルールファイルが違います")
+    terms = data.get("terms")
+    word_ids = data.get("words")
+    keyword_ids = data.get("keywords")
+    if (not isinstance(terms, list) or not all(isinstance(term, str) for term in terms)
+            or len(set(terms)) != len(terms)):
+        raise ValueError("語彙キャッシュの terms が不正です")
+    if (not isinstance(word_ids, dict) or set(word_ids) != words
+            or not isinstance(keyword_ids, dict) or sorted(keyword_ids) != keywords):
+        raise ValueError("語彙キャッシュの語・キーワードがルールと一致しません")
+
+    term_words = [[] for _ in terms]
+    term_keywords = [[] for _ in terms]
+    for mapping, found in ((word_ids, term_words), (keyword_ids, term_keywords)):
+        for name, ids in mapping.items():
+            if not isinstance(ids, list):
+                raise ValueError(f"語彙キャッシュの {name} の語彙IDが不正です")
+            for term_id in ids:
+                if type(term_id) is not int or not 0 <= term_id < len(terms):
+                    raise ValueError(f"語彙キャッシュの {name} の語彙ID {term_id!r} が範囲外です")
+                found[term_id].append(name)
+    return [(term, tuple(w), tuple(k)) for term, w, k in zip(terms, term_words, term_keywords)]
+
+
+def _merge_positions(lists):
+    """形態素ごとの出現位置のリストを1本の昇順リストにする"""
+    if len(lists) == 1:
+        return lists[0]
+    # 形態素の種類が違えば位置は重ならないので、連結して並べ替えればよい
+    return sorted(chain.from_iterable(lists))
+
+
+class Paragraph:
+    """
+    評価対象の段落（本文と、形態素の表層形・原形のリスト）
+
+    形態素の種類ごとの出現位置の索引は最初に使った時に1回だけ作り、
+    語ごとの出現位置（positions）とあわせて、同じ段落を評価するすべてのルールで共有する。
+    vocab（Vocabulary）を渡すと、形態素と語・キーワードの一致は語彙の判定結果を使う。
+    """
+
+    def __init__(self, text, surfaces, dict_forms, vocab=None):
+        self.text = text
+        self.surfaces = surfaces
+        self.dict_forms = dict_forms
+        self.vocab = vocab
+        self._term_positions = None
+        self._vocab_positions = None
+        self._word_positions = {}
+        self._keyword_hits = {}
+
+    @classmethod
+    def from_morphemes(cls, text, morphemes, vocab=None):
+        return cls(text, [m.surface() for m in morphemes], [m.dictionary_form() for m in morphemes], vocab)
+
+    @property
+    def term_positions(self):
+        """{形態素: 出現位置の昇順リスト}（位置は 表層形 + 原形 を連結したリスト上の番号）"""
+        if self._term_positions is None:
+            index = {}
+            for i, term in enumerate(self.surfaces + self.dict_forms):
+                index.setdefault(term, []).append(i)
+            self._term_positions = index
+        return self._term_positions
+
+    def positions(self, word):
+        """語に一致する形態素の出現位置の昇順リスト"""
+        found = self._word_positions.get(word)
+        if found is None:
+            if self.vocab is not None and word in self.vocab.words:
+                found = self.vocab_positions().get(word, [])
+            else:
+                found = _merge_positions([positions for term, positions in self.term_positions.items()
+                                          if word in term or term in word])
+            self._word_positions[word] = found
+        return found
+
+    def vocab_positions(self):
+        """{語彙の near/seq の語: 出現位置の昇順リスト}（段落の形態素の種類ごとに語彙の判定結果を引いて作る）"""
+        if self._vocab_positions is None:
+            lists = {}
+            for term, positions in self.term_positions.items():
+                for word in self.vocab.words_for(term):
+                    lists.setdefault(word, []).append(positions)
+            self._vocab_positions = {word: _merge_positions(l) for word, l in lists.items()}
+        return self._vocab_positions
+
+    def keyword_hits(self, matcher):
+        """
+        matcher のキーワードのうち、本文またはいずれかの形態素（表層形・原形）に含まれるものの集合
+        本文と形態素の種類ごとに1回ずつ走査し、同じ matcher については結果を使い回す
+        """
+        hits = self._keyword_hits.get(matcher)
+        if hits is None:
+            hits = matcher.find(self.text)
+            if self.vocab is not None and self.vocab.matcher is matcher:
+                for term in self.term_positions:
+                    hits.update(self.vocab.keywords_for(term))
+            else:
+                for term in self.term_positions:
+                    matcher.find(term, hits)
+            self._keyword_hits[matcher] = hits
+        return hits
+
+
+# --- 構文木 ---
+
+class Keyword:
+    def __init__(self, word, matcher=None):
+        self.word = word
+        # compile_rules() がルール全体のキーワードをまとめた KeywordMatcher を設定する
+        self.matcher = matcher
+
+    def evaluate(self, para):
+        if self.matcher is None:
+            return check_keyword(self.word, para.text, para.surfaces, para.dict_forms)
+        return self.word in para.keyword_hits(self.matcher)
+
+    def __repr__(self):
+        return self.word
+
+
+class Near:
+    def __init__(self, words, distance, backward):
+        self.words = words
+        self.distance = distance
+        self.backward = backward
+
+    def evaluate(self, para):
+        return near_positions([para.positions(word) for word in self.words], self.distance, self.backward)
+
+    def __repr__(self):
+        return f"near({'-'.join(self.words)})[{'b' if self.backward else ''}{self.distance}]"
+
+
+class Seq(Near):
+    def evaluate(self, para):
+        return seq_positions([para.positions(word) for word in self.words], self.distance, self.backward)
+
+    def __repr__(self):
+        return "seq" + super().__repr__()[4:]
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, para):
+        return not self.child.evaluate(para)
+
+    def __repr__(self):
+        return f"not {self.child!r}"
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def evaluate(self, para):
+        return all(child.evaluate(para) for child in self.children)
+
+    def __repr__(self):
+        return "( " + " and ".join(map(repr, self.children)) + " )"
+
+
+class Or(And):
+    def evaluate(self, para):
+        return any(child.evaluate(para) for child in self.children)
+
+    def __repr__(self):
+        return "( " + " or ".join(map(repr, self.children)) + " )"
+
+
+# --- コンパイラー ---
+
+def tokenize(expr):
+    """条件式を (種類, 値, 位置) のリストにする。種類は func / lparen / rparen / op / word"""
+    tokens = []
+    for m in _TOKEN_RE.finditer(expr):
+        kind = m.lastgroup
+        if kind == "space":
+            continue
+        value = m.group()
+        if kind == "word" and value in _OPERATORS:
+            kind = "op"
+        tokens.append((kind, value, m.start()))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None, len(self.expr))
+
+    def take(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise RuleSyntaxError("条件式が空です", 0)
+        node = self.parse_or()
+        kind, value, pos = self.peek()
+        if kind == "rparen":
+            raise RuleSyntaxError("対応する「(」がありません", pos)
+        if kind is not None:
+            raise RuleSyntaxError(f"「{value}」の前に演算子（and / or）がありません", pos)
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek()[:2] == ("op", "or"):
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek()[:2] == ("op", "and"):
+            self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.peek()[:2] == ("op", "not"):
+            self.take()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value, pos = self.take()
+        if kind == "lparen":
+            node = self.parse_or()
+            if self.take()[0] != "rparen":
+                raise RuleSyntaxError("「(」が閉じられていません", pos)
+            return node
+        if kind == "func":
+            return compile_function(value, pos)
+        if kind == "word":
+            return Keyword(value)
+        if kind is None:
+            raise RuleSyntaxError("条件式が途中で終わっています", pos)
+        raise RuleSyntaxError(f"「{value}」の位置に語・near・seq・( がありません", pos)
+
+
+def compile_function(value, pos=0):
+    """near(...)[N] / seq(...)[N] を構文木の葉にする"""
+    m = _FUNC_RE.fullmatch(value)
+    if not m:
+        raise RuleSyntaxError(f"{value}: 距離は [N] または [bN]（N は語数）で指定してください", pos)
+    name, body, backward, distance = m.groups()
+    words = body.split("-")
+    if not all(words):
+        raise RuleSyntaxError(f"{value}: 空の語があります", pos)
+    distance = int(distance) if distance else DEFAULT_DISTANCE
+    cls = Near if name == "near" else Seq
+    return cls(words, distance, bool(backward))
+
+
+def compile_rule(expr):
+    """条件式を構文木にコンパイルする（構文エラーは RuleSyntaxError）"""
+    return _Parser(expr).parse()
+
+
+def read_rule_blocks(path):
+    """
+    ルールファイルを読み、{コード名: 条件式} を返す
+    「*」で始まる行がコード名、続く行（複数行可）が条件式。BOM付きのファイルも読める。
+    """
+    rules = {}
+    current_code = None
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("*"):
+                current_code = line
+                rules[current_code] = ""
+            elif current_code:
+                rules[current_code] += " " + line
+    return {code: expr.strip() for code, expr in rules.items()}
+
+
+def iter_nodes(node):
+    """構文木のすべてのノードをたどる"""
+    yield node
+    if isinstance(node, Not):
+        yield from iter_nodes(node.child)
+    elif isinstance(node, And):
+        for child in node.children:
+            yield from iter_nodes(child)
+
+
+def compile_rules(blocks):
+    """
+    {コード名: 条件式} をコンパイルし、({コード名: 構文木}, {コード名: エラーメッセージ}) を返す
+    すべてのルールのキーワードは1つの KeywordMatcher にまとめ、段落ごとに1回の走査で判定する
+    """
+    compiled = {}
+    errors = {}
+    for code, expr in blocks.items():
+        try:
+            compiled[code] = compile_rule(expr)
+        except RuleSyntaxError as e:
+            errors[code] = str(e)
+
+    keywords = [node for rule in compiled.values() for node in iter_nodes(rule) if isinstance(node, Keyword)]
+    matcher = KeywordMatcher(node.word for node in keywords)
+    for node in keywords:
+        node.matcher = matcher
+    return compiled, errors
+
+
+def rule_vocabulary(rules, rules_sha256=None):
+    """コンパイル済みのルールの near/seq の語とキーワードに対する、空の Vocabulary"""
+    words = set()
+    matcher = None
+    for rule in rules.values():
+        for node in iter_nodes(rule):
+            if isinstance(node, Near):
+                words.update(node.words)
+            elif isinstance(node, Keyword) and node.matcher is not None:
+                matcher = node.matcher
+    return Vocabulary(words, matcher or KeywordMatcher(()), rules_sha256)
+
+
+def vocabulary_cache_path(rules_path):
+    """ルールファイルの語彙キャッシュのパス（ルールファイルと同じディレクトリ）"""
+    return f"{rules_path}.vocab.json"
+
+
+def load_vocabulary(rules, rules_path):
+    """
+    ルールファイルの語彙キャッシュを読み込む。
+    キャッシュはルールファイルの sha256 と対応付けて保存し、ルールファイルが変わっていれば作り直す。
+    """
+    with open(rules_path, "rb") as f:
+        rules_sha256 = hashlib.sha256(f.read()).hexdigest()
+    empty = rule_vocabulary(rules, rules_sha256)
+    return Vocabulary.load(vocabulary_cache_path(rules_path), empty.words, empty.matcher, rules_sha256)
+
+
+def match_codes(rules, para):
+    """段落に該当するコードのリスト（ルールファイルの順）"""
+    return [code for code, rule in rules.items() if rule.evaluate(para)]
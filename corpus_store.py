@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+text_forming.py 用のコーパスストア（SQLite）
+
+整形済みの本文を (自治体, 制定年, 区分) をキーに1行ずつ保存する。
+行ごとに元のテキストファイルのパスとsha256・整形ルールのバージョンを記録し、
+
+  - 新しいキーは追加する
+  - 同じファイルの内容（または整形ルール）が変わっていれば行を置き換える
+  - 変わっていなければ整形せずにスキップする
+  - 別のファイルが同じキーに当たる場合は重複として最初のファイルの行を残す
+
+ことで、CSV全体を読み直して書き直さずに、追加・変更されたファイルだけを反映する。
+CSV（本文, 制定年, 自治体, 区分）はストアから書き出す派生データとして扱う。
+"""
+
+import csv
+import os
+import sqlite3
+import time
+
+CSV_COLUMNS = ["本文", "制定年", "自治体", "区分"]
+
+
+class CorpusStore:
+    """(自治体, 制定年, 区分) をキーにした整形済み本文の保存先"""
+
+    def __init__(self, path="corpus.sqlite"):
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS corpus (
+                jichitai TEXT NOT NULL,
+                seiteinen TEXT NOT NULL,
+                kubun TEXT NOT NULL,
+                body TEXT NOT NULL,
+                source_path TEXT,
+                source_sha256 TEXT,
+                rule_version INTEGER,
+                updated_at TEXT,
+                PRIMARY KEY (jichitai, seiteinen, kubun)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM corpus").fetchone()[0]
+
+    def get(self, jichitai, seiteinen, kubun):
+        """キーの行の記録を辞書で返す（無ければNone）"""
+        row = self._conn.execute(
+            "SELECT source_path, source_sha256, rule_version FROM corpus "
+            "WHERE jichitai = ? AND seiteinen = ? AND kubun = ?",
+            (jichitai, str(seiteinen), kubun),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"source_path": row[0], "source_sha256": row[1], "rule_version": row[2]}
+
+    def check(self, jichitai, seiteinen, kubun, source_path, source_sha256, rule_version):
+        """
+        ファイルをストアに反映する必要があるかを判定する。
+
+        Returns:
+            str: "new"（未登録）、"changed"（同じファイルの内容・整形ルールが変わった、
+                 または取り込んだCSVの行・消えたファイルの行を引き継ぐ）、
+                 "unchanged"（変更なし）、"duplicate"（別のファイルの行がある）
+        """
+        entry = self.get(jichitai, seiteinen, kubun)
+        if entry is None:
+            return "new"
+        owner = entry["source_path"]
+        if owner == str(source_path):
+            if entry["source_sha256"] == source_sha256 and entry["rule_version"] == rule_version:
+                return "unchanged"
+            return "changed"
+        # 既存のCSVから取り込んだ行（source_path が無い）は、最初に同じキーに当たったファイルが引き継ぐ
+        if owner is None or not os.path.exists(owner):
+            return "changed"
+        return "duplicate"
+
+    def upsert(self, jichitai, seiteinen, kubun, body, source_path, source_sha256, rule_version):
+        """行を追加・置き換える（commit() するまで確定しない）"""
+        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self._conn.execute(
+            "INSERT INTO corpus "
+            "(jichitai, seiteinen, kubun, body, source_path, source_sha256, rule_version, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(jichitai, seiteinen, kubun) DO UPDATE SET "
+            "body = excluded.body, source_path = excluded.source_path, "
+            "source_sha256 = excluded.source_sha256, rule_version = excluded.rule_version, "
+            "updated_at = excluded.updated_at",
+            (jichitai, str(seiteinen), kubun, body, str(source_path), source_sha256, rule_version, now),
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def import_csv(self, csv_path):
+        """
+        text_forming.py が以前に書き出したCSVの行を取り込む（ストアごとに1回だけ）。
+        既にストアにあるキーは上書きしない。取り込んだ件数を返す（取り込み済みなら None）。
+        """
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported_csv'").fetchone():
+            return None
+        count = 0
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO corpus (jichitai, seiteinen, kubun, body) VALUES (?, ?, ?, ?)",
+                    (row["自治体"], row["制定年"], row["区分"], row["本文"] or ""),
+                )
+                count += cur.rowcount
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('imported_csv', ?)", (str(csv_path),)
+        )
+        self._conn.commit()
+        return count
+
+    def export_csv(self, csv_path):
+        """
+        全行を CSV（本文, 制定年, 自治体, 区分）に書き出す。行の順序は追加順。
+        一時ファイルに書いてから置き換え、行はカーソルから1行ずつ書くのでメモリを使わない。
+        """
+        tmp_path = f"{csv_path}.part"
+        count = 0
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(CSV_COLUMNS)
+            for row in self._conn.execute(
+                "SELECT body, seiteinen, jichitai, kubun FROM corpus ORDER BY rowid"
+            ):
+                writer.writerow(row)
+                count += 1
+        os.replace(tmp_path, csv_path)
+        return count
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDFテキスト抽出ステージ
+
+out_pdf_YYYY/*.pdf を複数プロセスで並列にテキスト化し、out_txt_YYYY/*.txt に書き出す。
+1文書ごとに別プロセスで抽出するため、タイムアウトやメモリ上限を超えた文書だけを
+打ち切ってクロール全体や他の文書の抽出を止めない。
+結果は out_txt_YYYY/extract_report.jsonl に1文書1行で記録する
+（使用した抽出方法、文字数、所要時間）。
+
+同じ内容のPDFはブロブストア（blob_store.py）にページごとの抽出結果を保存し、
+年や自治体をまたいで抽出を1回で済ませる。
+
+--ocr を指定すると、抽出結果からページ単位でテキスト密度を判定し、
+スキャンページだけをOCRキューに送る。OCR結果はPDFのsha256をキーに
+ocr_cache/ に保存し、同じPDFを二度OCRしない。
+テキストごとのOCRの状態は out_txt_YYYY/ocr_state.json に記録し、--ocr なしで抽出済みの年や
+中断した --ocr の実行のテキストも、次の --ocr でスキャンページを確認してOCRする。
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from make_txt_file import get_available_years, parse_year_range
+# 子プロセスはfork時にインポート済みのモジュールを引き継ぐ
+from web_fetch import (
+    normalize_text, pdf_extract_pages, scanned_pages, ocrmypdf_available, run_ocrmypdf,
+    write_text_atomic, StageTimer,
+)
+from blob_store import BlobStore
+import fitz  # PyMuPDF
+
+REPORT_NAME = "extract_report.jsonl"
+# テキストごとのOCRの状態（{"files": {テキストのファイル名: {"sha256", "ocr"}}}）
+OCR_STATE_NAME = "ocr_state.json"
+OCR_CACHE_DIR = Path("ocr_cache")
+# スキャンページとみなす1ページあたりの文字数
+SCAN_CHAR_THRESHOLD = 50
+# 抽出ロジックを変えたら上げる（ブロブストアの抽出結果キャッシュのキー）
+PDF_EXTRACTOR_VERSION = 1
+PAGES_KIND = f"pdf.v{PDF_EXTRACTOR_VERSION}.pages.json"
+
+
+def _limit_memory(max_memory_mb):
+    """子プロセスのアドレス空間の上限を設定する（Unixのみ）"""
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def sha256_of_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _extract_worker(pdf_path, txt_path, max_memory_mb, conn, scan_threshold=None, blob_root=None,
+                    write_txt=True):
+    """
+    子プロセス側: 1つのPDFを抽出してテキストを書き出し、結果を conn に送る
+
+    scan_threshold を指定した場合は同じ抽出結果からスキャンページを判定し、
+    スキャンページがあればOCR後の結合用にページごとのテキストも返す。
+    blob_root を指定した場合は同じ内容のPDFの抽出結果をブロブストアから再利用する。
+    write_txt=False の場合はテキストを書き出さない（既存のテキストのスキャンページの確認だけ）。
+    """
+    _limit_memory(max_memory_mb)
+    timer = StageTimer()
+    try:
+        with timer.stage("hash"):
+            sha256 = sha256_of_file(pdf_path)
+        store = BlobStore(blob_root) if blob_root else None
+        cached = store.read_derived(sha256, PAGES_KIND) if store else None
+        if cached is not None:
+            cached = json.loads(cached)
+            raw, pages, method = cached["raw"], cached["pages"], cached["method"]
+        else:
+            raw, pages, method = pdf_extract_pages(Path(pdf_path), timer)
+            if store:
+                store.write_derived(sha256, PAGES_KIND, json.dumps(
+                    {"method": method, "raw": raw, "pages": pages}, ensure_ascii=False
+                ))
+        text = normalize_text(raw)
+        if write_txt:
+            with timer.stage("write"):
+                write_text_atomic(txt_path, text)
+        result = {"status": "ok", "method": method, "chars": len(text),
+                  "sha256": sha256, "extract_cached": cached is not None, "txt_written": write_txt,
+                  **timer.as_record()}
+        if scan_threshold is not None:
+            scanned = scanned_pages(pages, scan_threshold)
+            result["pages"] = len(pages)
+            result["scanned_pages"] = scanned
+            if scanned:
+                result["page_texts"] = pages
+        conn.send(result)
+    except MemoryError:
+        conn.send({"status": "error", "error": "MemoryError (メモリ上限を超えました)"})
+    except Exception as e:
+        conn.send({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def extract_pdfs(jobs, workers=None, timeout=120, max_memory_mb=2048, scan_threshold=None,
+                 blob_root=None):
+    """
+    (pdf_path, txt_path, write_txt) のリストを並列に抽出し、完了した順に結果の辞書を返すジェネレーター
+
+    Parameters:
+    - jobs: (pdf_path, txt_path, write_txt) のリスト（write_txt は _extract_worker 参照）
+    - workers: 同時に実行するプロセス数（Noneの場合はCPU数）
+    - timeout: 1文書あたりの制限時間（秒）
+    - max_memory_mb: 1プロセスあたりのメモリ上限（MB、0で無制限）
+    - scan_threshold: 指定した場合はページ単位のスキャン判定も行う（_extract_worker 参照）
+    - blob_root: 指定した場合は抽出結果をブロブストアで共有する
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = list(reversed(jobs))
+    running = {}  # conn -> (process, pdf_path, txt_path, started_at)
+
+    while pending or running:
+        # 空きがあれば次の文書を開始
+        while pending and len(running) < workers:
+            pdf_path, txt_path, write_txt = pending.pop()
+            recv_conn, send_conn = mp.Pipe(duplex=False)
+            proc = mp.Process(
+                target=_extract_worker,
+                args=(str(pdf_path), str(txt_path), max_memory_mb, send_conn, scan_threshold, blob_root,
+                      write_txt),
+                daemon=True,
+            )
+            proc.start()
+            send_conn.close()
+            running[recv_conn] = (proc, pdf_path, txt_path, time.monotonic())
+
+        # 最も早く期限が来る文書までの時間だけ待つ
+        now = time.monotonic()
+        next_deadline = min(started + timeout for _, _, _, started in running.values())
+        ready = wait(list(running), timeout=max(0.0, next_deadline - now))
+
+        for conn in ready:
+            proc, pdf_path, txt_path, started = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                # 結果を送る前にプロセスが落ちた（メモリ上限によるクラッシュなど）
+                result = {"status": "error", "error": "worker exited without result"}
+            conn.close()
+            proc.join()
+            result.update(
+                pdf=str(pdf_path),
+                output_txt=str(txt_path) if result["status"] == "ok" else None,
+                elapsed_sec=round(time.monotonic() - started, 3),
+            )
+            yield result
+
+        # 期限を過ぎた文書は打ち切る
+        now = time.monotonic()
+        for conn, (proc, pdf_path, txt_path, started) in list(running.items()):
+            if now - started >= timeout:
+                proc.kill()
+                proc.join()
+                conn.close()
+                del running[conn]
+                Path(f"{txt_path}.part").unlink(missing_ok=True)
+                yield {
+                    "status": "timeout",
+                    "error": f"{timeout}秒以内に抽出が終わりませんでした",
+                    "pdf": str(pdf_path),
+                    "output_txt": None,
+                    "elapsed_sec": round(now - started, 3),
+                }
+
+
+def ocr_queue_size():
+    """
+    マシンのコア数からOCRの同時実行数と1ファイルあたりの --jobs を決める
+    """
+    cores = os.cpu_count() or 1
+    jobs_per_file = min(4, cores)
+    return max(1, cores // jobs_per_file), jobs_per_file
+
+
+_OCR_LOCKS = {}
+_OCR_LOCKS_GUARD = threading.Lock()
+
+
+def ocr_scanned_pages(pdf_path, sha256, pages, lang="jpn+eng", jobs=2, cache_dir=OCR_CACHE_DIR):
+    """
+    スキャンページだけをOCRし、{ページ番号: テキスト} を返す
+
+    結果は cache_dir/<sha256>.json に保存し、同じ内容のPDF（再実行や別URLでの再掲載）は
+    キャッシュから返す。戻り値の2つ目はキャッシュを使ったかどうか。
+    """
+    # 同じ内容のPDFが同時にキューに入った場合は、先のOCRの完了を待ってキャッシュを使う
+    with _OCR_LOCKS_GUARD:
+        lock = _OCR_LOCKS.setdefault(sha256, threading.Lock())
+    with lock:
+        return _ocr_scanned_pages_locked(pdf_path, sha256, pages, lang, jobs, cache_dir)
+
+
+def _ocr_scanned_pages_locked(pdf_path, sha256, pages, lang, jobs, cache_dir):
+    cache_path = Path(cache_dir) / f"{sha256}.json"
+    if cache_path.exists():
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("lang") == lang and all(str(p) in cached["pages"] for p in pages):
+            return {p: cached["pages"][str(p)] for p in pages}, True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_pdf = Path(tmp) / "ocr.pdf"
+        run_ocrmypdf(Path(pdf_path), out_pdf, lang=lang, jobs=jobs, pages=pages)
+        doc = fitz.open(out_pdf)
+        texts = {p: doc[p - 1].get_text("text", sort=True) for p in pages}
+        doc.close()
+
+    Path(cache_dir).mkdir(exist_ok=True)
+    tmp_path = cache_path.with_suffix(".json.part")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"lang": lang, "pages": {str(p): t for p, t in texts.items()}}, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    return texts, False
+
+
+def _ocr_task(result, lang, jobs, cache_dir):
+    """OCRキューの1タスク: スキャンページをOCRし、抽出済みのページと結合して書き直す"""
+    started = time.monotonic()
+    report = {"stage": "ocr", "pdf": result["pdf"], "ocr_pages": result["scanned_pages"]}
+    try:
+        texts, cached = ocr_scanned_pages(
+            result["pdf"], result["sha256"], result["scanned_pages"], lang, jobs, cache_dir
+        )
+        pages = list(result["page_texts"])
+        for p, t in texts.items():
+            pages[p - 1] = t
+        text = normalize_text("\n".join(pages))
+        write_text_atomic(result["output_txt"], text)
+        report.update(status="ok", method=f"{result['method']}+ocr", chars=len(text),
+                      ocr_cached=cached, output_txt=result["output_txt"])
+    except Exception as e:
+        report.update(status="error", error=f"{type(e).__name__}: {e}")
+    report["elapsed_sec"] = round(time.monotonic() - started, 3)
+    return report
+
+
+def load_ocr_state(path):
+    """ocr_state.json を読み込む（無い・壊れている場合は空）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        files = state["files"]
+        return files if isinstance(files, dict) else {}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def save_ocr_state(path, files):
+    write_text_atomic(path, json.dumps({"files": files}, ensure_ascii=False, indent=1))
+
+
+def process_single_year(year, workers=None, timeout=120, max_memory_mb=2048, force=False,
+                        ocr=False, ocr_lang="jpn+eng", ocr_cache_dir=OCR_CACHE_DIR,
+                        scan_threshold=SCAN_CHAR_THRESHOLD, blob_root=None):
+    """
+    単一年の out_pdf_YYYY を抽出して out_txt_YYYY に書き出す
+
+    内容のある既存のテキストは上書きしないが、ocr=True の場合は ocr_state.json で
+    スキャンページのOCRが済んでいないテキストを確認対象にする（抽出結果はブロブストア、
+    OCR結果は ocr_cache から再利用する）。スキャンページが無ければテキストはそのまま残す。
+    """
+    pdf_dir = Path(f"out_pdf_{year}")
+    txt_dir = Path(f"out_txt_{year}")
+
+    if not pdf_dir.exists():
+        print(f"エラー: ディレクトリが見つかりません: {pdf_dir}")
+        return 0, 0, 0
+
+    print(f"\n{'='*50}")
+    print(f"Processing year: {year}")
+    print(f"Input directory: {pdf_dir}")
+    print(f"Output directory: {txt_dir}")
+    print(f"{'='*50}")
+
+    txt_dir.mkdir(exist_ok=True)
+
+    state_path = txt_dir / OCR_STATE_NAME
+    ocr_state = load_ocr_state(state_path)
+
+    jobs = []
+    skipped = 0
+    rechecks = 0
+    for pdf_file in sorted(pdf_dir.glob("*.pdf")):
+        txt_filepath = txt_dir / (pdf_file.stem + ".txt")
+        # 内容のあるテキストは手作業の修正を含む可能性があるので上書きしない
+        # （make_txt_file.py が作る空のテキストファイルは抽出結果で埋める）
+        if not force and txt_filepath.exists() and txt_filepath.stat().st_size > 0:
+            if ocr and not ocr_state.get(txt_filepath.name, {}).get("ocr"):
+                # --ocr なしで抽出した、またはOCRの途中で中断したテキスト
+                jobs.append((pdf_file, txt_filepath, False))
+                rechecks += 1
+            else:
+                skipped += 1
+            continue
+        jobs.append((pdf_file, txt_filepath, True))
+
+    print(f"抽出対象: {len(jobs)} 件 (うちOCRの確認: {rechecks} 件, 既存のためスキップ: {skipped} 件)")
+
+    ok_count = 0
+    fail_count = 0
+    report_path = txt_dir / REPORT_NAME
+    started = time.monotonic()
+
+    # スキャンページを含む文書は抽出と並行してOCRキューで処理する
+    ocr_pool = None
+    ocr_futures = []
+    if ocr:
+        ocr_workers, ocr_jobs = ocr_queue_size()
+        ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers)
+        print(f"OCRキュー: {ocr_workers} 並列 x --jobs {ocr_jobs}")
+
+    with open(report_path, "a", encoding="utf-8") as report:
+        def write_report(result):
+            result["year"] = year
+            result["extracted_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+            report.write(json.dumps(result, ensure_ascii=False) + "\n")
+            report.flush()
+
+        try:
+            results = extract_pdfs(jobs, workers, timeout, max_memory_mb,
+                                   scan_threshold if ocr else None, blob_root)
+            for done, result in enumerate(results, 1):
+                name = Path(result["pdf"]).name
+                page_texts = result.pop("page_texts", None)
+                if result["status"] == "ok":
+                    ok_count += 1
+                    scanned = result.get("scanned_pages") or []
+                    # スキャンページのOCRが終わるまで（--ocr なしの場合は判定していないので）未完了
+                    ocr_state[Path(result["output_txt"]).name] = {
+                        "sha256": result["sha256"], "ocr": ocr and not scanned,
+                    }
+                    note = f", スキャンページ {len(scanned)}/{result['pages']} → OCR" if scanned else ""
+                    if result.get("extract_cached"):
+                        note += ", 抽出結果を再利用"
+                    if not result["txt_written"]:
+                        note += ", 既存のテキストのOCRの確認"
+                    print(f"[{done}/{len(jobs)}] [OK] {name} ({result['method']}, {result['chars']}文字, {result['elapsed_sec']}s{note})")
+                    if scanned:
+                        ocr_futures.append(ocr_pool.submit(
+                            _ocr_task, dict(result, page_texts=page_texts), ocr_lang, ocr_jobs, ocr_cache_dir
+                        ))
+                else:
+                    fail_count += 1
+                    print(f"[{done}/{len(jobs)}] [{result['status'].upper()}] {name} -> {result['error']}")
+                write_report(result)
+
+            for future in ocr_futures:
+                result = future.result()
+                name = Path(result["pdf"]).name
+                if result["status"] == "ok":
+                    ocr_state[Path(result["output_txt"]).name]["ocr"] = True
+                    save_ocr_state(state_path, ocr_state)
+                    source = "キャッシュ" if result["ocr_cached"] else "OCR"
+                    print(f"[OCR] {name} ({len(result['ocr_pages'])}ページ, {source}, {result['chars']}文字, {result['elapsed_sec']}s)")
+                else:
+                    print(f"[OCR ERR] {name} -> {result['error']}")
+                write_report(result)
+        finally:
+            if ocr_pool is not None:
+                ocr_pool.shutdown(wait=True, cancel_futures=True)
+            # 中断した場合も、抽出済み・OCR済みの状態は次回に引き継ぐ
+            save_ocr_state(state_path, ocr_state)
+
+    elapsed = time.monotonic() - started
+    print(f"\n年 {year} の処理完了: 成功 {ok_count} 件, 失敗 {fail_count} 件, スキップ {skipped} 件 ({elapsed:.1f}s)")
+    print(f"レポート: {report_path}")
+    return ok_count, fail_count, skipped
+
+
+def main(year_input=None, workers=None, timeout=120, max_memory_mb=2048, force=False,
+         ocr=False, ocr_lang="jpn+eng", ocr_cache_dir=OCR_CACHE_DIR, scan_threshold=SCAN_CHAR_THRESHOLD,
+         blob_root="blobs"):
+    """メイン処理関数"""
+    print(f"Starting extract_pdf_text.py...")
+
+    if ocr and not ocrmypdf_available():
+        print("エラー: ocrmypdf が見つかりません。--ocr を使うにはインストールしてください。")
+        sys.exit(1)
+
+    if year_input:
+        years = parse_year_range(year_input)
+    else:
+        available_years = get_available_years()
+        if available_years:
+            latest_year = available_years[-1]
+            print(f"年が指定されていません。最新の年 {latest_year} を使用します。")
+            years = [latest_year]
+        else:
+            print("エラー: PDFディレクトリが見つかりません。")
+            print("利用可能なディレクトリ形式: out_pdf_YYYY")
+            sys.exit(1)
+
+    print(f"Processing {len(years)} year(s): {', '.join(years)}")
+    print(f"workers={workers or os.cpu_count()}, timeout={timeout}s, max-memory={max_memory_mb}MB")
+
+    total_ok = 0
+    total_fail = 0
+    total_skip = 0
+    for year in years:
+        ok, fail, skip = process_single_year(year, workers, timeout, max_memory_mb, force,
+                                             ocr, ocr_lang, ocr_cache_dir, scan_threshold, blob_root)
+        total_ok += ok
+        total_fail += fail
+        total_skip += skip
+
+    print(f"\n{'='*50}")
+    print(f"全体の処理結果:")
+    print(f"  成功: {total_ok}")
+    print(f"  失敗（タイムアウト含む）: {total_fail}")
+    print(f"  スキップ: {total_skip}")
+    print(f"{'='*50}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="PDFテキスト抽出ツール（プロセスプールで並列抽出）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用例:
+  python extract_pdf_text.py                      # デフォルト（最新年）
+  python extract_pdf_text.py --year 2014-2018     # 2014年から2018年まで処理
+  python extract_pdf_text.py -y 2020 -w 16        # 16プロセスで抽出
+  python extract_pdf_text.py -y 2020 --timeout 60 --max-memory-mb 1024
+  python extract_pdf_text.py -y 2020 --force      # 既存のテキストも再抽出
+  python extract_pdf_text.py -y 2020 --ocr        # スキャンページだけOCRする
+        """
+    )
+    parser.add_argument("--year", "-y", type=str, help="処理対象の年（例: 2014, 2015, 2014-2018）")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="同時に実行する抽出プロセス数（デフォルト: CPU数）")
+    parser.add_argument("--timeout", type=float, default=120, help="1文書あたりの制限時間（秒、デフォルト: 120）")
+    parser.add_argument("--max-memory-mb", type=int, default=2048, help="1プロセスあたりのメモリ上限（MB、0で無制限、デフォルト: 2048）")
+    parser.add_argument("--force", action="store_true", help="内容のある既存テキストファイルも上書きする")
+    parser.add_argument("--ocr", action="store_true", help="スキャンページを検出してOCRする（ocrmypdfが必要）")
+    parser.add_argument("--ocr-lang", type=str, default="jpn+eng", help="OCRの言語（デフォルト: jpn+eng）")
+    parser.add_argument("--ocr-cache", type=str, default=str(OCR_CACHE_DIR), help="OCR結果のキャッシュディレクトリ（デフォルト: ocr_cache）")
+    parser.add_argument("--scan-threshold", type=int, default=SCAN_CHAR_THRESHOLD, help=f"スキャンページとみなす1ページあたりの文字数（デフォルト: {SCAN_CHAR_THRESHOLD}）")
+    parser.add_argument("--blob-store", type=str, default="blobs", help="抽出結果を共有するブロブストアのディレクトリ（デフォルト: blobs）")
+    parser.add_argument("--no-blob-store", action="store_true", help="ブロブストアを使用しない")
+    parser.add_argument("--list-years", "-l", action="store_true", help="利用可能な年のリストを表示")
+
+    args = parser.parse_args()
+
+    if args.list_years:
+        available_years = get_available_years()
+        if available_years:
+            print("利用可能な年:")
+            for year in available_years:
+                print(f"  {year} (out_pdf_{year}/)")
+        else:
+            print("年別PDFディレクトリが見つかりません。")
+        sys.exit(0)
+
+    main(year_input=args.year, workers=args.workers, timeout=args.timeout,
+         max_memory_mb=args.max_memory_mb, force=args.force, ocr=args.ocr,
+         ocr_lang=args.ocr_lang, ocr_cache_dir=Path(args.ocr_cache), scan_threshold=args.scan_threshold,
+         blob_root=None if args.no_blob_store else args.blob_store)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_fetch.py 用のホスト別スケジューラー（適応的な同時接続数・再試行・サーキットブレーカー）
+
+自治体の例規集サーバーは応答が遅い・一時的に落ちているものが少なくない。
+ホストごとに応答時間とエラー率を追跡し、
+
+  - 同時接続数を AIMD（成功で加算的に増やし、失敗・極端な遅延で半分にする）で調整する
+  - 失敗したリクエストはジッター付きの指数バックオフで再試行する（再試行は web_fetch 側）
+  - 連続して失敗したホストはサーキットブレーカーを開き、一定時間そのホスト宛ての
+    リクエストを即座に失敗させる（他のホストのURLの処理は止まらない）
+
+ことで、クロール全体の所要時間が最も遅いホストに引きずられないようにする。
+"""
+
+import time
+import random
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+# 再試行する HTTP ステータス（一時的な過負荷・障害）
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostUnavailable(Exception):
+    """サーキットブレーカーが開いているホストへのリクエスト"""
+
+
+class HttpStatusError(Exception):
+    """HTTPのエラーステータス（4xx/5xx と、条件付きGETでないのに返された 304）"""
+
+    def __init__(self, status, url, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.url = url
+        self.retry_after = retry_after
+
+
+def is_retryable(exc):
+    """再試行すれば成功する可能性がある失敗か（接続エラー・タイムアウト・一時的なステータス）"""
+    if isinstance(exc, HttpStatusError):
+        return exc.status in RETRYABLE_STATUS
+    return isinstance(exc, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    ))
+
+
+def parse_retry_after(value):
+    """Retry-After ヘッダーの秒数（日付形式や不正な値は None）"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0, retry_after=None):
+    """
+    attempt 回目の失敗後の待ち時間（秒）。
+    フルジッター（0 〜 base * 2^(attempt-1) の一様乱数）で、同じホストへの再試行が揃わないようにする。
+    サーバーが Retry-After を返した場合はそれより短くしない。
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, min(cap, retry_after))
+    return delay
+
+
+class _HostState:
+    def __init__(self):
+        self.limit = 1.0            # 現在の同時接続数の上限（AIMD で調整）
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.latency_ewma = None    # ヘッダー受信までの時間の指数移動平均
+        self.min_latency = None
+        self.error_ewma = 0.0       # エラー率の指数移動平均
+        self.consecutive_failures = 0
+        self.state = "closed"       # closed / open / half_open
+        self.open_until = 0.0
+        self.opens = 0
+        self.requests = 0
+        self.failures = 0
+
+
+class _Lease:
+    """slot() の利用者がヘッダー受信までの時間を latency に設定する"""
+
+    def __init__(self):
+        self.latency = None
+
+
+class HostScheduler:
+    """
+    ホストごとの同時接続数・リクエスト間隔・サーキットブレーカーを管理する。
+
+    - max_per_host: 同時接続数の上限（AIMD で 1 〜 max_per_host の間を動く）
+    - delay: 同一ホストへのリクエスト開始の間隔（秒）
+    - failure_threshold: 連続してこの回数失敗したらブレーカーを開く
+    - cooldown: ブレーカーを開いておく時間（秒）。開くたびに倍にする（最大8倍）
+    - slow_factor / slow_floor: 応答時間が最速時の slow_factor 倍かつ slow_floor 秒を
+      超えたら混雑とみなして同時接続数を減らす
+    """
+
+    def __init__(self, max_per_host=4, delay=0.5, failure_threshold=5, cooldown=60.0,
+                 slow_factor=4.0, slow_floor=2.0):
+        self.max_per_host = max(1, max_per_host)
+        self.delay = delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.slow_floor = slow_floor
+        self._cond = threading.Condition()
+        self._hosts = {}
+
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+
+    def _state(self, host):
+        st = self._hosts.get(host)
+        if st is None:
+            st = self._hosts[host] = _HostState()
+        return st
+
+    @contextmanager
+    def slot(self, url):
+        """
+        ホストの空きを待ってからリクエストを1件実行する。
+        ブレーカーが開いている場合は待たずに HostUnavailable を送出する。
+        ブロック内で送出された例外の種類で、そのホストの成功・失敗を記録する。
+        """
+        host = self.host_of(url)
+        with self._cond:
+            st = self._state(host)
+            while True:
+                now = time.monotonic()
+                if st.state == "open":
+                    if now < st.open_until:
+                        raise HostUnavailable(
+                            f"{host}: サーキットブレーカー作動中（あと {st.open_until - now:.0f} 秒）"
+                        )
+                    # 待機時間が過ぎたら1件だけ試す（half-open）
+                    st.state = "half_open"
+                if st.state == "half_open":
+                    if st.in_flight == 0:
+                        break
+                elif st.in_flight < int(st.limit):
+                    break
+                self._cond.wait(timeout=1.0)
+            st.in_flight += 1
+            # 直前のリクエスト開始から delay 秒空けて開始する
+            start = max(now, st.next_start)
+            st.next_start = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+        lease = _Lease()
+        try:
+            yield lease
+        except BaseException as e:
+            if is_retryable(e):
+                self._finish(host, "failure")
+            elif isinstance(e, HttpStatusError):
+                # 404 などはホスト自体は応答している
+                self._finish(host, "success")
+            else:
+                self._finish(host, "neutral")
+            raise
+        else:
+            self._finish(host, "success", lease.latency)
+
+    def _finish(self, host, outcome, latency=None):
+        with self._cond:
+            st = self._hosts[host]
+            st.in_flight -= 1
+            if outcome == "neutral":
+                if st.state == "half_open":
+                    st.state = "open"
+                    st.open_until = time.monotonic()
+                self._cond.notify_all()
+                return
+            st.requests += 1
+            if outcome == "failure":
+                st.failures += 1
+                st.consecutive_failures += 1
+                st.error_ewma = 0.8 * st.error_ewma + 0.2
+                st.limit = max(1.0, st.limit / 2)
+                if st.state == "half_open" or st.consecutive_failures >= self.failure_threshold:
+                    st.state = "open"
+                    st.open_until = time.monotonic() + self.cooldown * 2 ** min(st.opens, 3)
+                    st.opens += 1
+            else:
+                st.consecutive_failures = 0
+                st.error_ewma *= 0.8
+                if st.state == "half_open":
+                    st.state = "closed"
+                    st.limit = 1.0
+                if latency is not None:
+                    st.latency_ewma = latency if st.latency_ewma is None else 0.8 * st.latency_ewma + 0.2 * latency
+                    st.min_latency = latency if st.min_latency is None else min(st.min_latency, latency)
+                if latency is not None and latency > max(self.slow_floor, self.slow_factor * st.min_latency):
+                    st.limit = max(1.0, st.limit / 2)
+                else:
+                    # 同時接続数ぶんの成功でおよそ1増える
+                    st.limit = min(float(self.max_per_host), st.limit + 1.0 / st.limit)
+            self._cond.notify_all()
+
+    def summary(self):
+        """ホスト別の統計（失敗の多い順）"""
+        with self._cond:
+            rows = [
+                {
+                    "host": host,
+                    "requests": st.requests,
+                    "failures": st.failures,
+                    "error_rate": round(st.error_ewma, 3),
+                    "limit": round(st.limit, 2),
+                    "latency_ewma": round(st.latency_ewma, 3) if st.latency_ewma is not None else None,
+                    "breaker_opens": st.opens,
+                    "state": st.state,
+                }
+                for host, st in self._hosts.items()
+            ]
+        return sorted(rows, key=lambda r: (-r["failures"], -r["requests"]))
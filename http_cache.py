@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_fetch.py 用の永続HTTPキャッシュ（条件付きGET）
+
+URLごとに ETag / Last-Modified / 本文のsha256 / 出力ファイルのパスを
+SQLiteに保存する。年次の再クロールではこの情報を使って
+If-None-Match / If-Modified-Since を送り、304 またはハッシュ一致の場合は
+ダウンロード後の保存・テキスト抽出を省略する。
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class HttpCache:
+    """URLをキーとした条件付きGET用キャッシュ"""
+
+    def __init__(self, path="http_cache.sqlite"):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                bytes_sha256 TEXT,
+                output_path TEXT,
+                content_type TEXT,
+                updated_at TEXT
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, url):
+        """URLのキャッシュエントリーを辞書で返す（無ければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, bytes_sha256, output_path, content_type "
+                "FROM http_cache WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "bytes_sha256": row[2],
+            "output_path": row[3],
+            "content_type": row[4],
+        }
+
+    def put(self, url, etag=None, last_modified=None, bytes_sha256=None,
+            output_path=None, content_type=None):
+        """URLのキャッシュエントリーを追加・更新する"""
+        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO http_cache "
+                "(url, etag, last_modified, bytes_sha256, output_path, content_type, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET "
+                "etag = excluded.etag, last_modified = excluded.last_modified, "
+                "bytes_sha256 = excluded.bytes_sha256, output_path = excluded.output_path, "
+                "content_type = excluded.content_type, updated_at = excluded.updated_at",
+                (url, etag, last_modified, bytes_sha256,
+                 str(output_path) if output_path else None, content_type, now),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def conditional_headers(entry):
+    """キャッシュエントリーから条件付きGET用のヘッダーを作成する"""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
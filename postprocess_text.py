@@ -5,90 +5,41 @@ HTMLファイルとPDFファイルから抽出されたテキストを統一的
 主な処理:
 1. HTMLファイル: 号（(1)、ア など）を直前の文と同段落にし、句点を挿入
 2. PDFファイル: 不要な改行・スペースを削除し、HTMLと同様の形式に整形
+整形の各段は text_pipeline.py にあり、text_forming.py と共通。
+
+年を指定すると out_YYYY/*_HTML.txt と out_txt_YYYY/*_PDF.txt を複数プロセスで処理し、
+out_processed_YYYY/ に書き出す。出力ディレクトリの manifest.json に
+入力のsha256・整形ルールのバージョン・出力のsha256を記録し、
+次回からは追加・変更された入力だけを処理する。
+
+使用例:
+  python postprocess_text.py                  # out/ → out_processed/
+  python postprocess_text.py -y 2014-2021     # 年別に処理（変更のあったファイルのみ）
+  python postprocess_text.py -y 2020 -w 8     # 8プロセスで処理
+  python postprocess_text.py -y 2020 --force  # 全ファイルを処理し直す
 """
 
+import io
 import re
 import os
+import sys
+import json
+import glob
+import hashlib
+import argparse
+import tempfile
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from make_txt_file import parse_year_range
+# 行の判定・スペース削除は以前からこのモジュールの関数として使われているので、ここからも参照できるようにする
+from text_pipeline import (
+    RULE_VERSION, GOU, TITLE, GOU_RE, TITLE_RE, line_kind, is_gou_marker, is_title_or_section,
+    remove_japanese_spaces, split_lines, stream_lines, html_pipeline, pdf_pipeline, pipeline_for,
+    emit_text,
+)
 
-def is_gou_marker(line):
-    """
-    行が「号」（(1)、(2)、ア、イ など）で始まるかどうかを判定
-    
-    Args:
-        line: 判定対象の行
-    
-    Returns:
-        bool: 号で始まる場合True
-    """
-    line = line.strip()
-    if not line:
-        return False
-    
-    # (1), (2), (3) などの数字の号
-    if re.match(r'^[(（]\d+[)）]', line):
-        return True
-    
-    # ア、イ、ウ などのカタカナの号
-    if re.match(r'^[ア-ン]', line):
-        return True
-    
-    return False
-
-
-def is_title_or_section(line):
-    """
-    行がタイトルや条・項番号かどうかを判定
-    
-    Args:
-        line: 判定対象の行
-    
-    Returns:
-        bool: タイトル・条・項番号の場合True
-    """
-    line = line.strip()
-    if not line:
-        return False
-    
-    # ページ番号（-1-、-2-など）
-    if re.match(r'^[-－―ー]\s*\d+\s*[-－―ー]$', line):
-        return True
-    
-    # 単純なページ番号（全角数字のみの行はページ番号とみなす）
-    if re.match(r'^[０-９]+$', line):
-        return True
-    
-    # 条例・規則名（○で始まる）
-    if line.startswith('○'):
-        return True
-    
-    # 日付（令和、平成など）- 単独で日付のみの行
-    if re.match(r'^(令和|平成|昭和)[\d０-９]+年.{0,10}$', line):
-        return True
-    
-    # 条例・規則番号 - 単独で番号のみの行
-    if re.match(r'^(条例|規則|告示)第[\d０-９]+号\s*$', line):
-        return True
-    
-    # 条番号（第1条、第2条など）- 単独で条番号のみの行
-    # 条番号の後にスペースや本文が続く場合は除外
-    if re.match(r'^第[\d０-９]+条\s*$', line):
-        return True
-    
-    # 項番号（単独の半角数字）- ただし、段落中の数字と区別するため2以上のみ
-    if re.match(r'^[2-9]$', line):
-        return True
-    
-    # 括弧付き見出し（(趣旨)、(定義)など）- 全角半角両方対応、単独で見出しのみの行
-    if re.match(r'^[（(][^)）]+[）)]\s*$', line):
-        return True
-    
-    # 附則
-    if line.startswith('附則') or line.startswith('附　則'):
-        return True
-    
-    return False
+MANIFEST_NAME = "manifest.json"
 
 
 def process_html_text(text):
@@ -104,66 +55,7 @@ def process_html_text(text):
     Returns:
         str: 処理後のテキスト
     """
-    lines = text.split('\n')
-    result = []
-    
-    i = 0
-    while i < len(lines):
-        stripped = lines[i].strip()
-        
-        # 空行の場合
-        if not stripped:
-            # 次の行が号で始まる場合は空行をスキップ
-            if i + 1 < len(lines) and is_gou_marker(lines[i + 1].strip()):
-                i += 1
-                continue
-            # それ以外は空行を保持
-            result.append('')
-            i += 1
-            continue
-        
-        # タイトル・条・項番号の場合
-        if is_title_or_section(stripped):
-            result.append(stripped)
-            i += 1
-            continue
-        
-        # 通常の行または号で始まる行
-        # この行から始まる段落全体を結合する
-        paragraph = stripped
-        
-        # 次の行を確認し、タイトルが来るまで結合（空行も含めて）
-        i += 1
-        while i < len(lines):
-            next_stripped = lines[i].strip()
-            
-            # タイトルが来たら終了
-            if next_stripped and is_title_or_section(next_stripped):
-                break
-            
-            # 空行の場合、その次が号かどうか確認
-            if not next_stripped:
-                # 次の次の行を確認
-                if i + 1 < len(lines) and is_gou_marker(lines[i + 1].strip()):
-                    # 空行をスキップして次へ
-                    i += 1
-                    continue
-                else:
-                    # 段落の終わり
-                    break
-            
-            # 号で始まる行の場合、句点がなければ追加
-            if is_gou_marker(next_stripped):
-                if not paragraph.endswith('。') and not paragraph.endswith('。）') and not paragraph.endswith('。」'):
-                    paragraph += '。'
-            
-            # 次の行を結合
-            paragraph += next_stripped
-            i += 1
-        
-        result.append(paragraph)
-    
-    return '\n'.join(result)
+    return emit_text(html_pipeline(split_lines(text)))
 
 
 def process_pdf_text(text):
@@ -178,167 +70,70 @@ def process_pdf_text(text):
     Returns:
         str: 処理後のテキスト
     """
-    # 日本語文字間の不要なスペースを削除（行内のみ、改行は保持）
-    def remove_japanese_spaces(text):
-        # 全角文字のパターン（ひらがな、カタカナ、漢字、全角記号など）
-        japanese_pattern = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF\u3000-\u303F（）「」『』【】〔〕\uff01-\uff5e]'
-        
-        lines = text.split('\n')
-        processed_lines = []
-        
-        for line in lines:
-            # 各行内のスペースのみを削除（改行は保持）
-            prev_line = None
-            while prev_line != line:
-                prev_line = line
-                # 日本語文字 + スペース（改行以外） + 日本語文字 のパターンを置換
-                line = re.sub(f'({japanese_pattern})[ 　\t]+({japanese_pattern})', r'\1\2', line)
-            processed_lines.append(line)
-        
-        return '\n'.join(processed_lines)
-    
-    # テキスト全体から不要なスペースを削除（行内のみ）
-    text = remove_japanese_spaces(text)
-    
-    lines = text.split('\n')
-    
-    # 前処理: 文の途中にある単一の空行を削除
-    # 例: 「...安曇野市」\n\n「条例第3号...」 → 「...安曇野市」\n「条例第3号...」
-    preprocessed_lines = []
-    i = 0
-    while i < len(lines):
-        current = lines[i].strip()
-        
-        # 空行の場合
-        if not current:
-            # 前の行（preprocessed_linesの最後の行）を確認
-            has_prev = len(preprocessed_lines) > 0 and preprocessed_lines[-1].strip()
-            has_next = i + 1 < len(lines) and lines[i+1].strip()
-            
-            if has_prev and has_next:
-                prev_line = preprocessed_lines[-1].strip()
-                next_line = lines[i+1].strip()
-                
-                # 前の行が文の途中で終わっている（句点で終わらない）
-                # かつ、次の行がタイトルや号で始まっていない場合は、空行をスキップ
-                if (not prev_line.endswith('。') and 
-                    not prev_line.endswith('。）') and 
-                    not prev_line.endswith('。」') and
-                    not is_title_or_section(next_line) and
-                    not is_gou_marker(next_line)):
-                    # 空行をスキップ（前の行と次の行を結合する）
-                    i += 1
-                    continue
-        
-        preprocessed_lines.append(lines[i])
-        i += 1
-    
-    # メイン処理
-    lines = preprocessed_lines
-    result = []
-    
-    i = 0
-    while i < len(lines):
-        stripped = lines[i].strip()
-        
-        # 空行の場合
-        if not stripped:
-            # 次の行が号で始まる場合は空行をスキップ
-            if i + 1 < len(lines) and is_gou_marker(lines[i + 1].strip()):
-                i += 1
-                continue
-            # それ以外は空行を保持
-            result.append('')
-            i += 1
-            continue
-        
-        # タイトル・条・項番号の場合
-        if is_title_or_section(stripped):
-            result.append(stripped)
-            i += 1
-            continue
-        
-        # 号で始まる場合
-        if is_gou_marker(stripped):
-            # 直前の行が存在し、タイトルや空行でない場合は結合
-            if result and result[-1] and not is_title_or_section(result[-1]):
-                # 句点がない場合は追加
-                if not result[-1].endswith('。') and not result[-1].endswith('。）') and not result[-1].endswith('。」'):
-                    result[-1] += '。'
-                result[-1] += stripped
-            else:
-                # 新しい行として開始
-                result.append(stripped)
-            
-            # 号の後に続く行を結合
-            i += 1
-            while i < len(lines):
-                next_stripped = lines[i].strip()
-                
-                # タイトルが来たら終了
-                if next_stripped and is_title_or_section(next_stripped):
-                    break
-                
-                # 空行の場合、その次が号かどうか確認
-                if not next_stripped:
-                    # 次の次の行を確認
-                    if i + 1 < len(lines) and is_gou_marker(lines[i + 1].strip()):
-                        # 空行をスキップして次へ
-                        i += 1
-                        continue
-                    else:
-                        # 段落の終わり
-                        break
-                
-                # 別の号が来たら終了
-                if is_gou_marker(next_stripped):
-                    break
-                
-                # 続きの文を結合
-                result[-1] += next_stripped
-                i += 1
-            continue
-        
-        # 通常の行（段落）
-        # 新しい段落として開始
-        paragraph = stripped
-        
-        # 次の行が続きかどうかを確認
-        i += 1
-        while i < len(lines):
-            next_stripped = lines[i].strip()
-            
-            # タイトルが来たら終了
-            if next_stripped and is_title_or_section(next_stripped):
-                break
-            
-            # 空行の場合、その次が号かどうか確認
-            if not next_stripped:
-                # 次の次の行を確認
-                if i + 1 < len(lines) and is_gou_marker(lines[i + 1].strip()):
-                    # 空行をスキップして次へ
-                    i += 1
-                    continue
-                else:
-                    # 段落の終わり
-                    break
-            
-            # 号が来た場合
-            if is_gou_marker(next_stripped):
-                # 句点を追加してから号を結合
-                if not paragraph.endswith('。') and not paragraph.endswith('。）') and not paragraph.endswith('。」'):
-                    paragraph += '。'
-                paragraph += next_stripped
-                i += 1
-                continue
-            
-            # 続きの文を結合
-            paragraph += next_stripped
-            i += 1
-        
-        result.append(paragraph)
-    
-    return '\n'.join(result)
+    return emit_text(pdf_pipeline(split_lines(text)))
+
+
+def process_text(filename, text):
+    """
+    ファイル名（_HTML.txt / _PDF.txt）に応じてテキストを整形する
+
+    Args:
+        filename: 入力ファイル名
+        text: 入力テキスト
+
+    Returns:
+        tuple: (整形後のテキスト, 'HTML' または 'PDF')。対象外のファイルは (None, None)
+    """
+    file_type, pipeline = pipeline_for(filename)
+    if pipeline is None:
+        return None, None
+    return emit_text(pipeline(split_lines(text))), file_type
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_atomic(path, data):
+    """一時ファイルに書いてから置き換える（中断しても書きかけのファイルを残さない）"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def process_job(input_path, output_path):
+    """
+    1ファイルを整形して書き出す（プロセスプールのワーカー）
+
+    Returns:
+        dict: 入力・出力のsha256とファイル種別
+    """
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    file_type, pipeline = pipeline_for(os.path.basename(input_path))
+    # ハッシュを取ったバイト列を、open() のテキストモードと同じ改行の扱いで1行ずつ流す
+    lines = stream_lines(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'))
+    out = emit_text(pipeline(lines)).encode('utf-8')
+    write_atomic(output_path, out)
+    return {
+        'source': str(input_path),
+        'type': file_type,
+        'input_sha256': hashlib.sha256(data).hexdigest(),
+        'output_sha256': hashlib.sha256(out).hexdigest(),
+        'rule_version': RULE_VERSION,
+    }
 
 
 def process_file(input_path, output_dir):
@@ -349,59 +144,178 @@ def process_file(input_path, output_dir):
         input_path: 入力ファイルのパス
         output_dir: 出力ディレクトリのパス
     """
-    # ファイルを読み込み
-    with open(input_path, 'r', encoding='utf-8') as f:
-        text = f.read()
-    
-    # ファイル名を取得
     filename = os.path.basename(input_path)
-    
-    # HTMLかPDFかを判定
-    if filename.endswith('_HTML.txt'):
-        processed = process_html_text(text)
-        file_type = 'HTML'
-    elif filename.endswith('_PDF.txt'):
-        processed = process_pdf_text(text)
-        file_type = 'PDF'
-    else:
+    if not (filename.endswith('_HTML.txt') or filename.endswith('_PDF.txt')):
         print(f"スキップ: {filename} (HTML/PDFファイルではありません)")
         return
-    
-    # 出力ファイルパスを作成
-    output_path = os.path.join(output_dir, filename)
-    
-    # 結果を出力
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(processed)
-    
-    print(f"処理完了 ({file_type}): {filename}")
+    result = process_job(input_path, os.path.join(output_dir, filename))
+    print(f"処理完了 ({result['type']}): {filename}")
 
 
-def main():
+def load_manifest(output_dir):
+    """出力ディレクトリの manifest.json を読む（無い・壊れている場合は空）"""
+    path = Path(output_dir) / MANIFEST_NAME
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(output_dir, files):
+    data = {'rule_version': RULE_VERSION, 'files': dict(sorted(files.items()))}
+    write_atomic(Path(output_dir) / MANIFEST_NAME,
+                 json.dumps(data, ensure_ascii=False, indent=1).encode('utf-8'))
+
+
+def year_inputs(year):
+    """年の入力ファイル（out_YYYY/*_HTML.txt と out_txt_YYYY/*_PDF.txt）"""
+    return sorted(Path(f'out_{year}').glob('*_HTML.txt')) + sorted(Path(f'out_txt_{year}').glob('*_PDF.txt'))
+
+
+def is_up_to_date(entry, input_sha256, output_path):
+    """manifest の記録から、入力・ルール・出力がいずれも変わっていないか判定する"""
+    return (
+        entry is not None
+        and entry.get('input_sha256') == input_sha256
+        and entry.get('rule_version') == RULE_VERSION
+        and output_path.exists()
+        and sha256_file(output_path) == entry.get('output_sha256')
+    )
+
+
+def process_directory(input_paths, output_dir, workers=None, force=False):
+    """
+    入力ファイルを並列に整形して output_dir に書き出す（変更の無いファイルはスキップ）
+
+    Args:
+        input_paths: 入力ファイルのパスのリスト
+        output_dir: 出力ディレクトリ
+        workers: プロセス数（Noneの場合はCPU数）
+        force: manifest に関係なく全ファイルを処理する
+
+    Returns:
+        tuple: (処理件数, スキップ件数, 失敗件数)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = load_manifest(output_dir)
+
+    jobs = []
+    skipped = 0
+    names = set()
+    for input_path in input_paths:
+        name = input_path.name
+        if not (name.endswith('_HTML.txt') or name.endswith('_PDF.txt')):
+            print(f"スキップ: {name} (HTML/PDFファイルではありません)")
+            continue
+        names.add(name)
+        output_path = output_dir / name
+        if not force and is_up_to_date(files.get(name), sha256_file(input_path), output_path):
+            skipped += 1
+            continue
+        jobs.append((input_path, output_path))
+
+    # 入力が無くなったファイルの出力と記録を削除する
+    for name in sorted(set(files) - names):
+        (output_dir / name).unlink(missing_ok=True)
+        del files[name]
+        print(f"削除: {name} (入力が見つかりません)")
+
+    print(f"処理対象: {len(jobs)} 件 (変更なしのためスキップ: {skipped} 件)")
+
+    done = 0
+    failed = 0
+    try:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(jobs))) as pool:
+                futures = {pool.submit(process_job, str(i), str(o)): i for i, o in jobs}
+                for future in as_completed(futures):
+                    name = futures[future].name
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed += 1
+                        files.pop(name, None)
+                        print(f"[ERR] {name} -> {type(e).__name__}: {e}")
+                        continue
+                    done += 1
+                    files[name] = result
+                    print(f"[{done + failed}/{len(jobs)}] 処理完了 ({result['type']}): {name}")
+    finally:
+        # 中断した場合も完了した分は記録する
+        save_manifest(output_dir, files)
+
+    return done, skipped, failed
+
+
+def get_available_years():
+    """利用可能な年（out_YYYY または out_txt_YYYY があるもの）のリストを取得"""
+    years = set()
+    for d in glob.glob('out_*'):
+        match = re.fullmatch(r'out_(?:txt_)?(\d{4})', os.path.basename(d))
+        if match and os.path.isdir(d):
+            years.add(match.group(1))
+    return sorted(years)
+
+
+def main(year_input=None, input_dir='out', output_dir='out_processed', workers=None, force=False):
     """
     メイン処理
+
+    年を指定した場合は年ごとに out_YYYY/ と out_txt_YYYY/ を out_processed_YYYY/ に、
+    指定しない場合は input_dir 内のすべてのテキストファイルを output_dir に書き出す。
     """
-    # 入力・出力ディレクトリの設定
-    input_dir = 'out'
-    output_dir = 'out_processed'
-    
-    # 出力ディレクトリを作成
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # outディレクトリ内のすべてのテキストファイルを処理
-    input_path = Path(input_dir)
-    txt_files = list(input_path.glob('*.txt'))
-    
-    print(f"処理対象ファイル数: {len(txt_files)}")
-    print("-" * 50)
-    
-    for txt_file in sorted(txt_files):
-        process_file(str(txt_file), output_dir)
-    
+    if year_input:
+        targets = [(year, year_inputs(year), Path(f'out_processed_{year}')) for year in parse_year_range(year_input)]
+    else:
+        targets = [(None, sorted(Path(input_dir).glob('*.txt')), Path(output_dir))]
+
+    total_done = 0
+    total_skipped = 0
+    total_failed = 0
+    for year, input_paths, out_dir in targets:
+        print("-" * 50)
+        if year:
+            print(f"年 {year}: 入力 out_{year}/, out_txt_{year}/ → 出力 {out_dir}/")
+        print(f"入力ファイル数: {len(input_paths)}")
+        if year and not input_paths:
+            print(f"警告: 年 {year} の入力ファイルが見つかりません。")
+            continue
+        done, skipped, failed = process_directory(input_paths, out_dir, workers, force)
+        total_done += done
+        total_skipped += skipped
+        total_failed += failed
+
     print("-" * 50)
-    print(f"すべての処理が完了しました。")
-    print(f"結果は {output_dir} ディレクトリに保存されています。")
+    print(f"すべての処理が完了しました。処理 {total_done} 件, スキップ {total_skipped} 件, 失敗 {total_failed} 件")
+    if total_failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description="条例・規則テキストの後処理（号の結合・不要な改行とスペースの削除）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--year", "-y", type=str, help="処理対象の年（例: 2014, 2015, 2014-2018）。省略時は --input-dir を処理")
+    parser.add_argument("--input-dir", type=str, default="out", help="年を指定しない場合の入力ディレクトリ（デフォルト: out）")
+    parser.add_argument("--output-dir", type=str, default="out_processed", help="年を指定しない場合の出力ディレクトリ（デフォルト: out_processed）")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="同時に実行するプロセス数（デフォルト: CPU数）")
+    parser.add_argument("--force", action="store_true", help="変更の無いファイルも処理し直す")
+    parser.add_argument("--list-years", "-l", action="store_true", help="利用可能な年のリストを表示")
+    args = parser.parse_args()
+
+    if args.list_years:
+        available_years = get_available_years()
+        if available_years:
+            print("利用可能な年:")
+            for year in available_years:
+                print(f"  {year}")
+        else:
+            print("年別ディレクトリが見つかりません。")
+        sys.exit(0)
+
+    main(year_input=args.year, input_dir=args.input_dir, output_dir=args.output_dir,
+         workers=args.workers, force=args.force)
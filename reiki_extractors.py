@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+例規集ホスティングサービス別の本文抽出器
+
+多くの自治体の例規集は少数のサービス（ぎょうせい、第一法規など）の
+共通テンプレートで公開されている。テンプレートが分かっているページは
+lxml で1回パースしたツリーから条・項・号の行を直接取り出し、
+trafilatura による汎用抽出を省略する。
+
+抽出器は URL（ホスト・パス）または DOM の特徴で選ばれる。
+テンプレートが想定と異なり本文を取り出せない場合は None を返し、
+呼び出し側（web_fetch.extract_html_text）の汎用抽出にフォールバックする。
+"""
+
+import re
+from urllib.parse import urlparse
+
+import lxml.html
+
+# 抽出結果がこれより短い場合はテンプレート不一致とみなす
+MIN_TEXT_LENGTH = 200
+
+BLOCK_TAGS = {"p", "div", "li", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6", "td", "th", "tr"}
+# 本文ではない要素（ツリーは書き換えず、これらの中のテキストを無視する）
+NOISE_TAGS = {"script", "style", "noscript", "header", "footer", "nav"}
+_TEXT_XPATH = ".//text()[not(ancestor::script or ancestor::style or ancestor::noscript)]"
+
+_WS_RE = re.compile(r"\s+")
+
+
+class VendorExtractor:
+    """
+    例規集テンプレート1種類分の抽出器
+
+    - hosts: URLのホスト名の末尾がこれらに一致すれば選ぶ
+    - path_patterns: URLのパスがこれらの正規表現に一致すれば選ぶ
+    - signature: DOMがこのXPathに一致すれば選ぶ（自治体ドメインで自前運用している場合）
+    - extract: ツリーから行のリストを返す関数（テンプレート不一致ならNone）
+    """
+
+    def __init__(self, name, extract, hosts=(), path_patterns=(), signature=None):
+        self.name = name
+        self.extract = extract
+        self.hosts = tuple(hosts)
+        self.path_patterns = tuple(re.compile(p) for p in path_patterns)
+        self.signature = signature
+
+    def matches_url(self, url):
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if any(host == h or host.endswith("." + h) for h in self.hosts):
+            return True
+        return any(p.search(parsed.path) for p in self.path_patterns)
+
+    def matches_dom(self, tree):
+        return bool(self.signature) and bool(tree.xpath(self.signature))
+
+
+EXTRACTORS = []
+
+
+def register(name, hosts=(), path_patterns=(), signature=None):
+    """抽出器を登録するデコレーター"""
+    def decorator(func):
+        EXTRACTORS.append(VendorExtractor(name, func, hosts, path_patterns, signature))
+        return func
+    return decorator
+
+
+def parse_html(html):
+    """
+    デコード済みのHTML文字列をlxmlでパースする。
+    XML宣言の encoding と衝突しないよう、UTF-8のバイト列として渡す。
+    """
+    parser = lxml.html.HTMLParser(encoding="utf-8")
+    return lxml.html.document_fromstring(html.encode("utf-8", errors="replace"), parser=parser)
+
+
+def element_text(el):
+    """要素内のテキストを1行にまとめる（インライン要素の間に空白を入れない）"""
+    return _WS_RE.sub(" ", "".join(el.xpath(_TEXT_XPATH))).strip()
+
+
+def _in_noise(el):
+    return any(anc.tag in NOISE_TAGS for anc in el.iterancestors())
+
+
+def block_lines(root):
+    """
+    ブロック要素を持たない末端のブロック要素ごとに1行として取り出す。
+    テンプレートの1行（条・項・号）は通常1つの末端ブロックに対応する。
+    """
+    lines = []
+    for el in root.iter(*BLOCK_TAGS):
+        if any(child.tag in BLOCK_TAGS for child in el.iterchildren()) or _in_noise(el):
+            continue
+        text = element_text(el)
+        if text:
+            lines.append(text)
+    return lines
+
+
+def _first(tree, xpaths):
+    for xpath in xpaths:
+        found = tree.xpath(xpath)
+        if found:
+            return found[0]
+    return None
+
+
+@register(
+    "gyosei",
+    hosts=("g-reiki.net",),
+    path_patterns=(r"/reiki_honbun/",),
+    signature='//div[@id="primaryInner2"]//div[contains(concat(" ", normalize-space(@class), " "), " eline ")]',
+)
+def extract_gyosei(tree):
+    """
+    ぎょうせい（g-reiki.net、各自治体の reiki_honbun/ 配下）のテンプレート
+
+    本文は div#primaryInner2 の中にあり、題名・条・項・号がそれぞれ
+    div.eline（題名は p.title / p.title-irregular）の1行として並ぶ。
+    """
+    root = _first(tree, ['//div[@id="primaryInner2"]', '//div[@id="primaryInner"]'])
+    if root is None:
+        return None
+    lines = []
+    seen = set()
+    for el in root.xpath(
+        './/div[contains(concat(" ", normalize-space(@class), " "), " eline ")]'
+        ' | .//p[starts-with(normalize-space(@class), "title")]'
+    ):
+        # 入れ子の eline を二重に数えない
+        if any(anc in seen for anc in el.iterancestors()):
+            continue
+        seen.add(el)
+        text = element_text(el)
+        if text:
+            lines.append(text)
+    return lines or None
+
+
+@register(
+    "d1-law",
+    hosts=("d1-law.com", "h-chosonkai.gr.jp"),
+    path_patterns=(r"/d1w_reiki/",),
+)
+def extract_d1_law(tree):
+    """
+    第一法規（D1-Law 例規、北海道町村会 例規データベースなど）のテンプレート
+
+    本文の入れ物は版によって異なるため、既知の候補から最初に見つかったものを使い、
+    末端のブロック要素を1行ずつ取り出す。
+    「_j.html」のパスや div#main は一般の自治体サイトにもあるので、抽出器の選択にも本文の入れ物にも使わない。
+    """
+    root = _first(tree, [
+        '//div[@id="honbun"]',
+        '//div[contains(@class, "honbun")]',
+    ])
+    if root is None:
+        return None
+    return block_lines(root) or None
+
+
+def select_extractor(url, tree):
+    """URLまたはDOMの特徴から抽出器を選ぶ（該当が無ければNone）"""
+    for extractor in EXTRACTORS:
+        if extractor.matches_url(url):
+            return extractor
+    for extractor in EXTRACTORS:
+        if extractor.matches_dom(tree):
+            return extractor
+    return None
+
+
+def extract_vendor_text(tree, url):
+    """
+    テンプレート別の抽出を試み、(テキスト, 抽出器名) を返す。
+    該当する抽出器が無い、または本文を取り出せなかった場合は (None, None)。
+    ツリーは書き換えないので、フォールバックの汎用抽出で再利用できる。
+    """
+    extractor = select_extractor(url, tree)
+    if extractor is None:
+        return None, None
+    try:
+        lines = extractor.extract(tree)
+    except Exception:
+        return None, None
+    if not lines:
+        return None, None
+    text = "\n".join(lines)
+    if len(text) < MIN_TEXT_LENGTH:
+        return None, None
+    return text, extractor.name
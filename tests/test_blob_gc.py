@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+web_fetch.py の再実行後に blob_store.py gc が使用中のブロブを削除しないことの確認
+（と、スキップのレコードが次回の計画に使う Content-Type を引き継ぐことの確認）
+
+ローカルのHTTPサーバーからHTMLとPDFを取得し、同じURLファイルで再実行（既存の出力はスキップ）
+してから gc を実行する。index.jsonl は再実行で書き直されるので、スキップのレコードにも
+bytes_sha256 が引き継がれていないと、HTMLの本文・抽出結果とコピーで配置したPDFが削除される。
+
+使用例:
+  python -m unittest discover tests
+"""
+
+import os
+import csv
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import web_fetch
+from blob_store import BlobStore, collect_live_hashes
+from bench_web_fetch import generic_html, text_pdf
+
+
+def make_handler(pages):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body, content_type = pages[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+class BlobGcAfterRerunTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        pages = {
+            "/reiki/jorei.html": (generic_html(20), "text/html; charset=utf-8"),
+            "/reiki/kisoku.pdf": (text_pdf(1, 10), "application/pdf"),
+        }
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(pages))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        with open("urls_2020.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["Municipality", "Prefecture", "Ordinance_HTML",
+                                                   "Regulation_HTML", "Ordinance_PDF", "Regulation_PDF"])
+            writer.writeheader()
+            writer.writerow({"Municipality": "テスト市", "Prefecture": "テスト県",
+                             "Ordinance_HTML": f"{base}/reiki/jorei.html",
+                             "Regulation_PDF": f"{base}/reiki/kisoku.pdf"})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def crawl(self):
+        web_fetch.main(urls_path="urls_2020.csv", http_cache_path="http_cache.sqlite", blob_root="blobs")
+
+    def test_rerun_keeps_blobs_referenced(self):
+        self.crawl()
+        store = BlobStore("blobs")
+        blobs = sorted(sha256 for sha256, _ in store.iter_blobs())
+        derived = sorted(store.derived.glob("*/*"))
+        self.assertEqual(len(blobs), 2)
+        self.assertEqual(len(derived), 1)
+
+        # ハードリンクできずにコピーで配置したPDF（ブロブのリンク数は1）
+        pdf = Path("out_pdf_2020/テスト市_Regulation_PDF.pdf")
+        shutil.copyfile(pdf, "copy.pdf")
+        os.replace("copy.pdf", pdf)
+
+        # 2回目は出力が揃っているので全件スキップし、index.jsonl を書き直す
+        self.crawl()
+        removed, _ = store.gc(collect_live_hashes())
+        self.assertEqual(removed, 0)
+        self.assertEqual(sorted(sha256 for sha256, _ in store.iter_blobs()), blobs)
+        self.assertEqual(sorted(store.derived.glob("*/*")), derived)
+
+    def test_skip_records_keep_content_type(self):
+        self.crawl()
+        # HTTPキャッシュが無くても、前回のスキップのレコードから Content-Type を引き継ぐ
+        for _ in range(2):
+            os.remove("http_cache.sqlite")
+            self.crawl()
+        with open("out_2020/index.jsonl", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r["status"] for r in records], ["skipped", "skipped"])
+        self.assertEqual(sorted(r["content_type"] for r in records), ["application/pdf", "text/html"])
+        self.assertTrue(all(r["bytes_sha256"] for r in records))
+
+
+if __name__ == "__main__":
+    unittest.main()
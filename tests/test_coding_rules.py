@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+coding_rules.py の語彙キャッシュ（<ルールファイル>.vocab.json）の読み書きの確認
+
+使用例:
+  python -m unittest discover tests
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from coding_rules import (
+    Paragraph, compile_rules, load_vocabulary, match_codes, read_rule_blocks, vocabulary_cache_path,
+)
+
+RULES = """﻿*CLAUSE_PERMISSION
+near(市長-許可)[10] or 許可制
+*MODAL_DUTY
+seq(しなければ-ならない)
+"""
+
+
+class VocabularyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.rules_path = os.path.join(self.tmp, "rules.txt")
+        with open(self.rules_path, "w", encoding="utf-8") as f:
+            f.write(RULES)
+        self.rules, errors = compile_rules(read_rule_blocks(self.rules_path))
+        self.assertEqual(errors, {})
+        self.cache_path = vocabulary_cache_path(self.rules_path)
+
+        vocab = load_vocabulary(self.rules, self.rules_path)
+        para = Paragraph("市長の許可を受けなければならない",
+                         ["市長", "の", "許可", "を", "受け", "なけれ", "ば", "なら", "ない"],
+                         ["市長", "の", "許可", "を", "受ける", "ない", "ば", "なる", "ない"], vocab)
+        self.assertEqual(match_codes(self.rules, para), ["*CLAUSE_PERMISSION", "*MODAL_DUTY"])
+        vocab.save(self.cache_path)
+        with open(self.cache_path, encoding="utf-8") as f:
+            self.saved = json.load(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        vocab = load_vocabulary(self.rules, self.rules_path)
+        self.assertEqual(vocab.terms, self.saved["terms"])
+        self.assertEqual(vocab.words_for("市長"), ("市長",))
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["rules.txt", "rules.txt.vocab.json"])
+
+    def test_corrupt_cache_is_ignored(self):
+        out_of_range = json.loads(json.dumps(self.saved))
+        out_of_range["words"]["市長"] = [len(self.saved["terms"])]
+        negative = json.loads(json.dumps(self.saved))
+        negative["keywords"]["許可制"] = [-1]
+        bad_words = dict(self.saved, words=list(self.saved["words"]))
+        bad_terms = dict(self.saved, terms={"市長": 0})
+        bad_ids = json.loads(json.dumps(self.saved))
+        bad_ids["words"]["市長"] = "0"
+        for data in ([], "vocab", out_of_range, negative, bad_words, bad_terms, bad_ids):
+            with open(self.cache_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            self.assertEqual(len(load_vocabulary(self.rules, self.rules_path)), 0, data)
+
+
+if __name__ == "__main__":
+    unittest.main()
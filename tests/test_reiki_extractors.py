@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+reiki_extractors.py の抽出器の選択の確認
+
+使用例:
+  python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reiki_extractors import parse_html, select_extractor, extract_vendor_text
+
+ARTICLE = "第{n}条　この条例は、太陽光発電設備の設置に関し必要な事項を定めるものとする。"
+
+
+def page(container):
+    paragraphs = "".join(f"<p>{ARTICLE.format(n=n)}</p>" for n in range(1, 11))
+    return parse_html(
+        '<html><head><meta charset="utf-8"><title>条例</title></head>'
+        f'<body><nav><ul><li>トップ</li></ul></nav>{container.format(paragraphs)}</body></html>'
+    )
+
+
+class D1LawSelectionTest(unittest.TestCase):
+    def test_municipal_page_with_j_html_and_div_main_is_not_d1_law(self):
+        tree = page('<div id="main"><h1>太陽光発電設備の設置に関する条例</h1>{}</div>')
+        url = "https://www.city.example.lg.jp/soshiki/kankyo/solar_j.html"
+        self.assertIsNone(select_extractor(url, tree))
+        self.assertEqual(extract_vendor_text(tree, url), (None, None))
+
+    def test_d1_law_host(self):
+        tree = page('<div id="honbun">{}</div>')
+        url = "https://en3.d1-law.com/d1w_reiki/123456789012345678_j.html"
+        text, name = extract_vendor_text(tree, url)
+        self.assertEqual(name, "d1-law")
+        self.assertTrue(text.startswith("第1条"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,56 +2,61 @@
 # -*- coding: utf-8 -*-
 
 import re
-import pandas as pd
 import os
+import csv
 import glob
 import sys
+import time
+import hashlib
 import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
-def format_text(text):
+from text_pipeline import RULE_VERSION, read_lines, split_lines, pipeline_for, html_pipeline
+from corpus_store import CorpusStore
+
+# 並列整形で同時に実行中にしておくジョブ数（プロセスあたり）
+JOB_WINDOW_PER_WORKER = 4
+# この件数ごとにストアへコミットする
+COMMIT_EVERY = 200
+# 進捗（スループット）を表示する間隔（秒）
+PROGRESS_INTERVAL = 5.0
+
+def format_lines(lines, filename):
     """
-    テキストを整形する。「号」レベル（(1), (2), （1）など）と
-    カタカナ（ア、イ、ウなど）で始まる行の前の改行を削除する。
+    テキストの行を整形し、空行を除いた段落を改行で連結する。
+    ファイル名（_HTML.txt / _PDF.txt）に応じて postprocess_text.py と同じ
+    text_pipeline の段（号・タイトルの判定、号の結合、PDFの不要なスペース・改行の削除）を使う。
+    種別の分からないファイルは HTML と同じ段で整形する。
+    
+    以前は独自の正規表現で「号」（括弧+数字）とカタカナで始まる行だけを直前の行に連結していたが、
+    号の判定は postprocess_text.py と同じ（数字の号と、ア〜ン で始まる行）になり、
+    号以外の続きの行もタイトル・条・項番号が来るまで同じ段落にまとめる。
     
     Parameters:
-    - text: 入力テキスト
+    - lines: 入力テキストの行（イテレーター）
+    - filename: 入力ファイル名
     
     Returns:
     - formatted_text: 整形されたテキスト
     """
-    # 行ごとに分割
-    lines = text.split('\n')
-    
-    # 整形後のテキストを格納y
-    formatted_lines = []
-    
-    for i, line in enumerate(lines):
-        line_stripped = line.strip()
-        
-        # 空行はスキップ
-        if not line_stripped:
-            continue
-        
-        # 「号」パターン: (1), (2), （1）, （2） など（括弧+数字）で始まる行
-        is_gou = re.match(r'^[（\(]\d+[）\)]', line_stripped)
-        
-        # カタカナパターン: ア、イ、ウ、エ、オ などで始まる行
-        is_katakana = re.match(r'^[ァ-ヶー]+[\s　]', line_stripped) or re.match(r'^[ァ-ヶー]+$', line_stripped) or re.match(r'^[ァ-ヶー]+[^ァ-ヶー]', line_stripped)
-        
-        if (is_gou or is_katakana) and formatted_lines:
-            # 号またはカタカナの場合は改行せず、直前の行に連結
-            # 前の行の末尾に「。」がない場合は追加
-            if not formatted_lines[-1].endswith('。'):
-                formatted_lines[-1] += '。'
-            formatted_lines[-1] += line_stripped
-        else:
-            # それ以外（条、項など）は改行を保持
-            formatted_lines.append(line_stripped)
+    _, pipeline = pipeline_for(filename)
+    if pipeline is None:
+        pipeline = html_pipeline
+    return '\n'.join(paragraph for paragraph in pipeline(lines) if paragraph)
+
+def format_text(text, filename=''):
+    """
+    テキストを整形する（format_lines() の文字列版）
     
-    # 整形されたテキストを結合
-    formatted_text = '\n'.join(formatted_lines)
+    Parameters:
+    - text: 入力テキスト
+    - filename: 入力ファイル名（_HTML.txt / _PDF.txt で整形の段を選ぶ）
     
-    return formatted_text
+    Returns:
+    - formatted_text: 整形されたテキスト
+    """
+    return format_lines(split_lines(text), filename)
 
 def extract_metadata_from_filename(filename):
     """
@@ -216,48 +221,23 @@ def get_target_directories(years=None):
     
     return directories
 
-def process_multiple_files(directories, output_csv):
-    """
-    複数のディレクトリからテキストファイルを読み込み、整形してCSVにまとめる
-    ディレクトリ名から制定年を自動判定する
-    
-    Parameters:
-    - directories: テキストファイルが格納されているディレクトリのリスト
-    - output_csv: 出力CSVファイルのパス
-    
-    Returns:
-    - success_count: 成功した件数
-    - error_count: エラーが発生した件数
-    - duplicate_count: 重複した件数
-    """
-    all_data = []
-    success_count = 0
-    error_count = 0
-    duplicate_count = 0
-    
-    # 処理済みファイルを記録するセット（ファイル名 + 制定年 + 区分の組み合わせ）
-    processed_files = set()
-    
-    # 既存のCSVを読み込み（存在する場合）
-    existing_df = None
-    if os.path.exists(output_csv):
-        try:
-            existing_df = pd.read_csv(output_csv)
-            if len(existing_df) > 0:
-                print(f"既存のCSVファイルを読み込みました: {len(existing_df)} 行")
-                # 既存のエントリーを処理済みセットに追加
-                for _, row in existing_df.iterrows():
-                    key = f"{row['自治体']}_{row['制定年']}_{row['区分']}"
-                    processed_files.add(key)
-            else:
-                print("既存のCSVファイルは空です。新規作成します。")
-                existing_df = None
-        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
-            print(f"既存のCSVファイルの読み込みに失敗しました: {str(e)}")
-            print("新しいCSVファイルを作成します。")
-            existing_df = None
-    
-    # 各ディレクトリからテキストファイルを取得
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def default_store_path(output_csv):
+    """出力CSVに対応するコーパスストアのパス（例: main2.6.csv -> main2.6.sqlite）"""
+    return os.path.splitext(output_csv)[0] + '.sqlite'
+
+def format_file(txt_file):
+    """ファイルを1行ずつ読みながら整形する（プロセスプールのワーカー、中間ファイルは作らない）"""
+    return format_lines(read_lines(txt_file), os.path.basename(txt_file))
+
+def iter_source_files(directories):
+    """ディレクトリ順・ファイル名順に (テキストファイル, 制定年) を返す"""
     for directory in directories:
         if not os.path.exists(directory):
             print(f"⚠️  ディレクトリが見つかりません: {directory}")
@@ -269,80 +249,182 @@ def process_multiple_files(directories, output_csv):
             print(f"⚠️  ディレクトリ名から制定年を抽出できません: {directory}")
             continue
         
-        print(f"\n📁 処理中: {directory} (制定年: {seiteinen})")
-        
         # ディレクトリ内のすべてのテキストファイルを取得
-        txt_files = glob.glob(os.path.join(directory, '*.txt'))
-        print(f"   {len(txt_files)} 個のテキストファイルが見つかりました")
-        
+        txt_files = sorted(glob.glob(os.path.join(directory, '*.txt')))
+        print(f"\n📁 {directory} (制定年: {seiteinen}): {len(txt_files)} 個のテキストファイル")
         for txt_file in txt_files:
+            yield txt_file, seiteinen
+
+def plan_jobs(store, directories, counts, claimed):
+    """
+    ストアの記録と比べて、整形が必要なファイル（追加・更新）のジョブを返す
+    変更なし・重複・エラーは counts に数えてその場で読み飛ばす
+    
+    claimed は、このrunで整形待ちのキーとファイル（まだストアに書き込まれていない）。
+    同じキーに当たる後続のファイルは、ストアの判定より先にこれで重複とみなす。
+    """
+    for txt_file, seiteinen in iter_source_files(directories):
+        filename = os.path.basename(txt_file)
+        try:
+            # ファイル名からメタデータを抽出
+            jichitai, kubun = extract_metadata_from_filename(filename)
+            key = (jichitai, seiteinen, kubun)
+            source_sha256 = sha256_file(txt_file)
+            if key in claimed and claimed[key] != txt_file:
+                status = 'duplicate'
+            else:
+                status = store.check(jichitai, seiteinen, kubun, txt_file, source_sha256, RULE_VERSION)
+        except Exception as e:
+            print(f"   ✗ エラー: {filename} - {str(e)}")
+            counts['error'] += 1
+            continue
+        if status == 'unchanged':
+            counts['unchanged'] += 1
+            continue
+        if status == 'duplicate':
+            print(f"   ⚠️  重複スキップ: {filename} ({jichitai}, {seiteinen}, {kubun})")
+            counts['duplicate'] += 1
+            continue
+        claimed[key] = txt_file
+        yield {
+            'path': txt_file,
+            'key': key,
+            'sha256': source_sha256,
+            'status': status,
+            'bytes': os.path.getsize(txt_file),
+        }
+
+def iter_formatted(jobs, workers=1):
+    """
+    ジョブを整形し、(ジョブ, 整形結果, 例外) をジョブと同じ順序で返す
+    
+    workers > 1 の場合はプロセスプールで整形する。実行中のジョブは workers * JOB_WINDOW_PER_WORKER 件までとし、
+    先頭のジョブの完了を待ってから次を投入するので、ファイル数によらずメモリ使用量は一定で、
+    結果の順序も workers に関係なく同じになる。
+    """
+    if workers <= 1:
+        for job in jobs:
             try:
-                # ファイルを読み込み
-                with open(txt_file, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                
-                # テキストを整形
-                formatted_text = format_text(text)
-                
-                # ファイル名からメタデータを抽出
-                filename = os.path.basename(txt_file)
-                jichitai, kubun = extract_metadata_from_filename(filename)
-                
-                # 重複チェック用のキーを作成
-                key = f"{jichitai}_{seiteinen}_{kubun}"
-                
-                # 重複チェック
-                if key in processed_files:
-                    print(f"   ⚠️  重複スキップ: {filename} ({jichitai}, {seiteinen}, {kubun})")
-                    duplicate_count += 1
-                    continue  # 重複の場合はスキップ
-                
-                # 処理済みセットに追加
-                processed_files.add(key)
-                
-                # データを追加
-                row_data = {
-                    '本文': formatted_text,
-                    '制定年': seiteinen,
-                    '自治体': jichitai,
-                    '区分': kubun
-                }
-                all_data.append(row_data)
-                
-                print(f"   ✓ 処理完了: {filename} ({jichitai}, {seiteinen}, {kubun})")
-                success_count += 1
-            
+                yield job, format_file(job['path']), None
             except Exception as e:
-                print(f"   ✗ エラー: {filename} - {str(e)}")
-                error_count += 1
+                yield job, None, e
+        return
+    
+    def result(job, future):
+        try:
+            return job, future.result(), None
+        except Exception as e:
+            return job, None, e
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for job in jobs:
+            window.append((job, pool.submit(format_file, job['path'])))
+            if len(window) >= workers * JOB_WINDOW_PER_WORKER:
+                yield result(*window.popleft())
+        while window:
+            yield result(*window.popleft())
+
+def process_multiple_files(directories, output_csv, store_path=None, workers=1):
+    """
+    複数のディレクトリからテキストファイルを読み込み、整形してコーパスストアに反映し、CSVに書き出す
+    ディレクトリ名から制定年を自動判定する
+    
+    整形結果は (自治体, 制定年, 区分) をキーにコーパスストア（SQLite）へ upsert する。
+    変更の無いファイルは整形せずにスキップし、内容が変わったファイルは行を置き換える。
+    別のファイルが同じキーに当たる場合は重複として最初のファイルの行を残す。
+    CSVはストアの全行から書き出す（以前のCSVは最初の実行時に1回だけストアに取り込む）。
+    
+    workers > 1 の場合は整形をプロセスプールで並列に行い、完了した行をファイル順に
+    ストアへ書き込んでいく（行を溜め込まないのでメモリ使用量は年数によらない）。
+    
+    Parameters:
+    - directories: テキストファイルが格納されているディレクトリのリスト
+    - output_csv: 出力CSVファイルのパス
+    - store_path: コーパスストアのパス（Noneの場合は出力CSVの拡張子を .sqlite にしたもの）
+    - workers: 整形を行うプロセス数
     
-    # データフレームを作成
-    if all_data:
-        new_df = pd.DataFrame(all_data)
+    Returns:
+    - success_count: 追加・更新した件数
+    - error_count: エラーが発生した件数
+    - duplicate_count: 重複した件数
+    """
+    counts = Counter()
+    
+    store = CorpusStore(store_path or default_store_path(output_csv))
+    print(f"コーパスストア: {store.path} ({len(store)} 行)")
+    
+    # 以前のCSVを取り込む（ストアごとに1回だけ）
+    if os.path.exists(output_csv):
+        try:
+            imported = store.import_csv(output_csv)
+            if imported is not None:
+                print(f"既存のCSVファイルを取り込みました: {imported} 行")
+        except (csv.Error, KeyError, UnicodeDecodeError) as e:
+            print(f"既存のCSVファイルの取り込みに失敗しました: {str(e)}")
+    
+    started = time.monotonic()
+    last_report = started
+    formatted_count = 0
+    formatted_bytes = 0
+    claimed = {}
+    jobs = plan_jobs(store, directories, counts, claimed)
+    
+    for job, formatted_text, error in iter_formatted(jobs, workers):
+        filename = os.path.basename(job['path'])
+        jichitai, seiteinen, kubun = job['key']
+        claimed.pop(job['key'], None)
+        if error is not None:
+            print(f"   ✗ エラー: {filename} - {str(error)}")
+            counts['error'] += 1
+            continue
         
-        # 既存のデータと結合
-        if existing_df is not None:
-            final_df = pd.concat([existing_df, new_df], ignore_index=True)
+        store.upsert(jichitai, seiteinen, kubun, formatted_text, job['path'], job['sha256'], RULE_VERSION)
+        if job['status'] == 'new':
+            print(f"   ✓ 追加: {filename} ({jichitai}, {seiteinen}, {kubun})")
+            counts['added'] += 1
         else:
-            final_df = new_df
+            print(f"   ✓ 更新: {filename} ({jichitai}, {seiteinen}, {kubun})")
+            counts['updated'] += 1
         
-        # CSVに保存
-        final_df.to_csv(output_csv, index=False, encoding='utf-8')
-        print(f"\n{'='*60}")
-        print(f"📊 処理完了")
-        print(f"{'='*60}")
-        print(f"✓ 成功: {success_count} 件")
-        print(f"✗ エラー: {error_count} 件")
-        print(f"⚠️  重複: {duplicate_count} 件")
-        print(f"📄 出力ファイル: {output_csv}")
-        print(f"📈 CSVの総行数: {len(final_df)} 行")
-        print(f"{'='*60}")
+        formatted_count += 1
+        formatted_bytes += job['bytes']
+        if formatted_count % COMMIT_EVERY == 0:
+            store.commit()
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            elapsed = now - started
+            print(f"   [進捗] 整形 {formatted_count} 件 ({formatted_count / elapsed:.1f} 件/秒, "
+                  f"{formatted_bytes / 1024 / 1024 / elapsed:.2f} MB/秒)")
+    store.commit()
+    elapsed = time.monotonic() - started
+    
+    success_count = counts['added'] + counts['updated']
+    if success_count or not os.path.exists(output_csv):
+        total_rows = store.export_csv(output_csv)
     else:
-        print("\n⚠️  処理するファイルが見つかりませんでした")
-    
-    return success_count, error_count, duplicate_count
+        total_rows = len(store)
+    store.close()
+    
+    print(f"\n{'='*60}")
+    print(f"📊 処理完了")
+    print(f"{'='*60}")
+    print(f"✓ 追加: {counts['added']} 件")
+    print(f"✓ 更新: {counts['updated']} 件")
+    print(f"- 変更なし: {counts['unchanged']} 件")
+    print(f"✗ エラー: {counts['error']} 件")
+    print(f"⚠️  重複: {counts['duplicate']} 件")
+    print(f"⏱  所要時間: {elapsed:.1f} 秒 (整形 {formatted_count} 件, "
+          f"{formatted_count / elapsed if elapsed > 0 else 0:.1f} 件/秒, "
+          f"{formatted_bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0:.2f} MB/秒, workers={workers})")
+    print(f"📄 出力ファイル: {output_csv}")
+    print(f"📈 CSVの総行数: {total_rows} 行")
+    print(f"{'='*60}")
+    
+    return success_count, counts['error'], counts['duplicate']
 
-def main(year_input=None, output_csv=None):
+def main(year_input=None, output_csv=None, store_path=None, workers=1):
     """メイン処理"""
     print("="*60)
     print("複数テキストファイル整形ツール")
@@ -384,12 +466,13 @@ def main(year_input=None, output_csv=None):
     
     # 確認
     print(f"\n出力先: {output_csv}")
+    print(f"コーパスストア: {store_path or default_store_path(output_csv)}")
     print(f"処理対象年: {', '.join(years)}")
     print(f"処理ディレクトリ数: {len(target_dirs)}")
     
     # 処理を実行
     print("\n処理を開始します...\n")
-    success_count, error_count, duplicate_count = process_multiple_files(target_dirs, output_csv)
+    success_count, error_count, duplicate_count = process_multiple_files(target_dirs, output_csv, store_path, workers)
     
     # 終了
     if error_count > 0:
@@ -409,11 +492,14 @@ if __name__ == '__main__':
   python text_forming.py --year 2014-2018      # 2014年から2018年まで順次処理
   python text_forming.py -y 2016-2017          # 2016年と2017年を処理
   python text_forming.py --list-years          # 利用可能な年のリストを表示
-  python text_forming.py --output custom.csv   # 出力ファイル名を指定
+  python text_forming.py -y 2014-2021 -w 8     # 8プロセスで並列に整形
+  python text_forming.py --output custom.csv   # 出力ファイル名を指定（ストアは custom.sqlite）
         """
     )
     parser.add_argument("--year", "-y", type=str, help="処理対象の年（例: 2014, 2015, 2014-2018）")
     parser.add_argument("--output", "-o", type=str, default="main2.6.csv", help="出力CSVファイル名（デフォルト: main2.6.csv）")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="整形を並列に行うプロセス数（デフォルト: 1）")
+    parser.add_argument("--store", type=str, default=None, help="コーパスストア（SQLite）のパス（デフォルト: 出力CSVの拡張子を .sqlite にしたもの）")
     parser.add_argument("--list-years", "-l", action="store_true", help="利用可能な年のリストを表示")
     
     args = parser.parse_args()
@@ -436,7 +522,7 @@ if __name__ == '__main__':
         sys.exit(0)
     
     try:
-        main(year_input=args.year, output_csv=args.output)
+        main(year_input=args.year, output_csv=args.output, store_path=args.store, workers=args.workers)
     except KeyboardInterrupt:
         print("\n\n処理が中断されました")
         sys.exit(1)
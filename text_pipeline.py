@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条例・規則テキストの整形パイプライン（ジェネレーターの段の組み合わせ）
+
+postprocess_text.py（out_processed_YYYY/ への書き出し）と text_forming.py（CSVの作成）は
+どちらもこのモジュールの段をつないで、抽出済みのテキストを1行ずつ流して整形する。
+号・タイトルの判定と結合のルールはここにだけ置く。
+
+段:
+  read_lines / stream_lines / split_lines
+                          ファイル・文字列を行に分ける（str.split('\n') と同じ区切り）
+  normalize_pdf_lines     PDF: 日本語文字間の不要なスペースを削除する
+  segment                 各行を strip し、行の種類（GOU / TITLE）を1回だけ判定する
+  join_broken_lines       PDF: 文の途中に入った単一の空行を取り除く
+  merge_html_paragraphs   HTML: 号を含む段落全体を1行にまとめる
+  merge_pdf_paragraphs    PDF: 号を直前の段落に結合し、続きの行もまとめる
+  emit_text               段落を改行で連結する
+
+使用例:
+  file_type, pipeline = pipeline_for("芳賀町_Ordinance_PDF.txt")
+  text = emit_text(pipeline(read_lines(path)))
+"""
+
+import re
+from collections import deque
+
+# 整形ルールを変えたら上げる（postprocess_text の manifest.json と text_forming のコーパスストアに記録し、
+# 変わったら全ファイルを処理し直す）
+RULE_VERSION = 1
+
+# 行の種類（ビットフラグ）。「(1)」のように号とタイトル（括弧付き見出し）の両方に当たる行もある
+GOU = 1
+TITLE = 2
+
+# 号: (1), (2), (3) などの数字の号、ア、イ、ウ などのカタカナの号
+GOU_RE = re.compile(r'[(（]\d+[)）]|[ア-ン]')
+
+# タイトル・条・項番号（判定条件は上から順に）
+#   - 条例・規則名（○で始まる）、附則
+#   - ページ番号（-1-、-2-など）
+#   - 単純なページ番号（全角数字のみの行はページ番号とみなす）
+#   - 日付（令和、平成など）- 単独で日付のみの行
+#   - 条例・規則番号 - 単独で番号のみの行
+#   - 条番号（第1条、第2条など）- 単独で条番号のみの行（後に本文が続く場合は除外）
+#   - 項番号（単独の半角数字）- ただし、段落中の数字と区別するため2以上のみ
+#   - 括弧付き見出し（(趣旨)、(定義)など）- 全角半角両方対応、単独で見出しのみの行
+TITLE_RE = re.compile(
+    r'○|附則|附　則'
+    r'|(?:[-－―ー]\s*\d+\s*[-－―ー]'
+    r'|[０-９]+'
+    r'|(?:令和|平成|昭和)[\d０-９]+年.{0,10}'
+    r'|(?:条例|規則|告示)第[\d０-９]+号\s*'
+    r'|第[\d０-９]+条\s*'
+    r'|[2-9]'
+    r'|[（(][^)）]+[）)]\s*'
+    r')$'
+)
+
+
+def line_kind(line):
+    """
+    行の種類を GOU / TITLE のビットフラグで返す（空行は0）
+
+    Args:
+        line: 判定対象の行（前後の空白は無視する）
+
+    Returns:
+        int: GOU | TITLE の組み合わせ
+    """
+    line = line.strip()
+    if not line:
+        return 0
+    kind = 0
+    if GOU_RE.match(line):
+        kind |= GOU
+    if TITLE_RE.match(line):
+        kind |= TITLE
+    return kind
+
+
+def is_gou_marker(line):
+    """
+    行が「号」（(1)、(2)、ア、イ など）で始まるかどうかを判定
+    
+    Args:
+        line: 判定対象の行
+    
+    Returns:
+        bool: 号で始まる場合True
+    """
+    return GOU_RE.match(line.strip()) is not None
+
+
+def is_title_or_section(line):
+    """
+    行がタイトルや条・項番号かどうかを判定
+    
+    Args:
+        line: 判定対象の行
+    
+    Returns:
+        bool: タイトル・条・項番号の場合True
+    """
+    return TITLE_RE.match(line.strip()) is not None
+
+
+# 日本語文字（ひらがな、カタカナ、漢字、全角記号など）。全角スペースも含む
+_JAPANESE_CLASS = r'\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF\u3000-\u303F（）「」『』【】〔〕\uff01-\uff5e'
+# 全角スペースを除く日本語文字
+_JAPANESE_NONSPACE_CLASS = r'\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF\u3001-\u303F（）「」『』【】〔〕\uff01-\uff5e'
+JAPANESE_CHAR_RE = re.compile(f'[{_JAPANESE_CLASS}]')
+# 両隣が日本語文字の空白の連続（連続ごと削除してよい）。改行は含まない
+ENCLOSED_SPACE_RUN_RE = re.compile(f'(?<=[{_JAPANESE_NONSPACE_CLASS}])[ 　\t]+(?=[{_JAPANESE_NONSPACE_CLASS}])')
+# 全角スペースを含む空白の連続。後読みで連続の先頭からだけ試す
+FULLWIDTH_SPACE_RUN_RE = re.compile(r'(?<![ \t])[ \t]*　[ 　\t]*')
+
+
+def _collapse_space_run(m):
+    """
+    空白の連続1つについて、両隣を含めて最初と最後の日本語文字の間にある空白を取り除く
+
+    全角スペースは日本語文字でもあるため、「漢 　 字」は「漢字」になるが、
+    「a　 　b」は全角スペースの間の半角スペースだけが消えて「a　　b」になる。
+    """
+    run = m.group()
+    text = m.string
+    start, end = m.span()
+    # 左隣の文字を位置 -1、右隣の文字を位置 len(run) として数える
+    if start > 0 and JAPANESE_CHAR_RE.match(text, start - 1):
+        first = -1
+    else:
+        first = run.find('　')
+    if end < len(text) and JAPANESE_CHAR_RE.match(text, end):
+        last = len(run)
+    else:
+        last = run.rfind('　')
+    if last - first < 2:
+        return run
+    return run[:first + 1] + run[last:]
+
+
+def remove_japanese_spaces(text):
+    """
+    日本語文字間の不要なスペースを削除（行内のみ、改行は保持）
+
+    「日本語文字 + スペース（改行以外） + 日本語文字」の置換を変化しなくなるまで
+    繰り返した結果と同じものを、空白の連続ごとに1回の判定で求める（行の長さに対して線形）。
+    大半を占める両隣が日本語文字の連続は正規表現だけで削除し、
+    残りのうち全角スペースを含む連続だけを _collapse_space_run() で処理する。
+
+    Args:
+        text: 処理対象のテキスト
+
+    Returns:
+        str: 処理後のテキスト
+    """
+    # 空白の連続の両隣は空白ではないので、1つ目の置換で2つ目の対象の両隣は変わらない
+    text = ENCLOSED_SPACE_RUN_RE.sub('', text)
+    return FULLWIDTH_SPACE_RUN_RE.sub(_collapse_space_run, text)
+
+
+def _ends_with_period(text):
+    return text.endswith('。') or text.endswith('。）') or text.endswith('。」')
+
+
+class Lookahead:
+    """先の要素を消費せずに参照できるイテレーター（要素が無ければ peek() は None）"""
+
+    def __init__(self, iterable):
+        self._it = iter(iterable)
+        self._buffer = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._buffer:
+            return self._buffer.popleft()
+        return next(self._it)
+
+    def peek(self, n=0):
+        while len(self._buffer) <= n:
+            try:
+                self._buffer.append(next(self._it))
+            except StopIteration:
+                return None
+        return self._buffer[n]
+
+
+# --- 読み込み ---
+
+def stream_lines(f):
+    """
+    テキストファイルから改行を除いた行を1行ずつ返す
+
+    str.split('\n') と同じく、末尾が改行で終わる（または空の）ファイルでは最後に空行を1つ返す。
+    """
+    line = ''
+    for line in f:
+        yield line[:-1] if line.endswith('\n') else line
+    if not line or line.endswith('\n'):
+        yield ''
+
+
+def read_lines(path):
+    """ファイルを開いて stream_lines() で1行ずつ返す"""
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from stream_lines(f)
+
+
+def split_lines(text):
+    """文字列を行に分ける"""
+    return iter(text.split('\n'))
+
+
+# --- 正規化・分割 ---
+
+def normalize_pdf_lines(lines):
+    """PDF由来の各行から日本語文字間の不要なスペースを削除する（改行は保持）"""
+    for line in lines:
+        yield remove_japanese_spaces(line)
+
+
+def segment(lines):
+    """各行を (strip した行, 行の種類) にする"""
+    for line in lines:
+        stripped = line.strip()
+        yield stripped, line_kind(stripped)
+
+
+def join_broken_lines(items):
+    """
+    文の途中にある単一の空行を削除する（PDF）
+
+    例: 「...安曇野市」\n\n「条例第3号...」 → 「...安曇野市」\n「条例第3号...」
+    直前に残した行が句点で終わらず、次の行がタイトルや号で始まっていない場合に空行を除く。
+    """
+    items = Lookahead(items)
+    prev = ''  # 直前に残した行
+    for text, kind in items:
+        if not text and prev:
+            nxt = items.peek()
+            if (nxt is not None and nxt[0] and not _ends_with_period(prev)
+                    and not (nxt[1] & (TITLE | GOU))):
+                continue
+        prev = text
+        yield text, kind
+
+
+# --- 号の結合 ---
+
+def _skip_blank_before_gou(items):
+    """
+    次が空行で、その次が号で始まる場合は空行を読み飛ばして True を返す。
+    それ以外の空行なら段落の終わりなので False を返す。
+    """
+    after = items.peek(1)
+    if after is not None and after[1] & GOU:
+        next(items)
+        return True
+    return False
+
+
+def _continue_paragraph(items, paragraph):
+    """段落の続きの行（号を含む）を、タイトルか段落の終わりの空行まで結合する"""
+    while True:
+        nxt = items.peek()
+        if nxt is None or nxt[1] & TITLE:
+            return paragraph
+        text, kind = nxt
+        if not text:
+            if _skip_blank_before_gou(items):
+                continue
+            return paragraph
+        # 号で始まる行の場合、句点がなければ追加
+        if kind & GOU and not _ends_with_period(paragraph):
+            paragraph += '。'
+        paragraph += text
+        next(items)
+
+
+def merge_html_paragraphs(items):
+    """
+    HTMLから取得したテキストの段落を返す
+
+    号（(1)、ア など）を含む段落全体を1行にまとめる。
+    条文と号の間の空行も削除する。
+    """
+    items = Lookahead(items)
+    for text, kind in items:
+        if not text:
+            # 次の行が号で始まる場合は空行をスキップ、それ以外は空行を保持
+            nxt = items.peek()
+            if nxt is None or not nxt[1] & GOU:
+                yield ''
+            continue
+        # タイトル・条・項番号はそのまま
+        if kind & TITLE:
+            yield text
+            continue
+        # 通常の行または号で始まる行から、タイトルが来るまで結合する
+        yield _continue_paragraph(items, text)
+
+
+def merge_pdf_paragraphs(items):
+    """
+    PDFから取得したテキストの段落を返す
+
+    号は直前の段落（タイトル・空行以外）に句点を補って結合し、
+    号に続く行は次の号・タイトル・段落の終わりまで同じ行にまとめる。
+    号が結合されることがあるため、直前の段落は次の段落が決まるまで保留してから返す。
+    """
+    items = Lookahead(items)
+    last = None
+    for text, kind in items:
+        if not text:
+            nxt = items.peek()
+            if nxt is not None and nxt[1] & GOU:
+                continue
+            paragraph = ''
+        elif kind & TITLE:
+            paragraph = text
+        elif kind & GOU:
+            # 直前の段落が存在し、タイトルや空行でない場合は結合
+            # （結合後の行なので、行の種類はここで改めて判定する）
+            if last and not is_title_or_section(last):
+                if not _ends_with_period(last):
+                    last += '。'
+                last += text
+            else:
+                if last is not None:
+                    yield last
+                last = text
+            # 号の後に続く行を、別の号・タイトル・段落の終わりまで結合
+            while True:
+                nxt = items.peek()
+                if nxt is None or nxt[1] & TITLE:
+                    break
+                ntext, nkind = nxt
+                if not ntext:
+                    if _skip_blank_before_gou(items):
+                        continue
+                    break
+                if nkind & GOU:
+                    break
+                last += ntext
+                next(items)
+            continue
+        else:
+            # 通常の行（段落）。号が来たら句点を追加してから結合する
+            paragraph = _continue_paragraph(items, text)
+        if last is not None:
+            yield last
+        last = paragraph
+    if last is not None:
+        yield last
+
+
+# --- 組み立て ---
+
+def html_pipeline(lines):
+    """HTMLから抽出したテキストの行 → 段落"""
+    return merge_html_paragraphs(segment(lines))
+
+
+def pdf_pipeline(lines):
+    """PDFから抽出したテキストの行 → 段落"""
+    return merge_pdf_paragraphs(join_broken_lines(segment(normalize_pdf_lines(lines))))
+
+
+PIPELINES = {
+    '_HTML.txt': ('HTML', html_pipeline),
+    '_PDF.txt': ('PDF', pdf_pipeline),
+}
+
+
+def pipeline_for(filename):
+    """ファイル名の末尾（_HTML.txt / _PDF.txt）から (種別, パイプライン) を返す（対象外は (None, None)）"""
+    for suffix, entry in PIPELINES.items():
+        if filename.endswith(suffix):
+            return entry
+    return None, None
+
+
+def emit_text(paragraphs):
+    """段落を改行で連結して1つのテキストにする"""
+    return '\n'.join(paragraphs)
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, re, csv, json, time, hashlib, mimetypes, subprocess, tempfile, argparse, sys, glob
+import os, re, csv, json, time, hashlib, mimetypes, subprocess, tempfile, argparse, sys, glob, threading, shutil
+import bisect, heapq, itertools
 from pathlib import Path
 from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.ssl_ import create_urllib3_context
+import codecs
 import chardet
-from bs4 import BeautifulSoup
 
 # Optional but recommended: fast main-content extractor
 try:
@@ -17,13 +21,35 @@ try:
 except Exception:
     HAS_TRA = False
 
+from http_cache import HttpCache, conditional_headers
+from blob_store import BlobStore, FILE_MODE
+from reiki_extractors import parse_html, extract_vendor_text
+from host_scheduler import (
+    HostScheduler, HttpStatusError, is_retryable, backoff_delay, parse_retry_after,
+)
+
 # PDF text extractors
 from pdfminer.high_level import extract_text as pdf_extract_text
 import fitz  # PyMuPDF
 
-# デフォルトの出力ディレクトリ（後でmainで年に基づいて更新）
-OUT_DIR = Path("out_2020")
-PDF_DIR = Path("out_pdf_2020")
+# ファイル名から年が分からないURLファイル（urls.csv など）の出力先の年
+DEFAULT_YEAR = "2020"
+
+class YearContext:
+    """
+    urls_YYYY.csv 1つ分の出力先（out_YYYY/、out_pdf_YYYY/、out_YYYY/index.jsonl）。
+    複数年を同じプロセスで並行に処理できるよう、モジュール変数ではなく引数で渡す。
+    """
+    def __init__(self, year):
+        self.year = year
+        self.out_dir = Path(f"out_{year}")
+        self.pdf_dir = Path(f"out_pdf_{year}")
+        self.index_path = self.out_dir / "index.jsonl"
+
+    @classmethod
+    def for_urls_file(cls, urls_path):
+        match = re.search(r'urls_(\d{4})\.csv', str(urls_path))
+        return cls(match.group(1) if match else DEFAULT_YEAR)
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; OrdinanceTextBot/1.0; +https://example.invalid)"
@@ -37,27 +63,162 @@ class SSLAdapter(HTTPAdapter):
         kwargs['ssl_context'] = ctx
         return super().init_poolmanager(*args, **kwargs)
 
+# ホストごとに保持するコネクションプールの大きさ
+POOL_MAXSIZE = 8
+
 def create_session():
     """Create a requests session with custom SSL adapter."""
     s = requests.Session()
-    s.mount('https://', SSLAdapter())
+    s.mount('https://', SSLAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+    s.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
     s.headers.update(HEADERS)
     return s
 
+# ホストごとの長寿命セッション（TCP/TLS接続を使い回す）
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def get_session(url: str):
+    """Return the pooled session for the URL's host, creating it on first use."""
+    host = urlparse(url).netloc.lower()
+    with _SESSIONS_LOCK:
+        s = _SESSIONS.get(host)
+        if s is None:
+            s = create_session()
+            _SESSIONS[host] = s
+        return s
+
+def close_sessions():
+    """Close every pooled session (called at the end of a run)."""
+    with _SESSIONS_LOCK:
+        for s in _SESSIONS.values():
+            s.close()
+        _SESSIONS.clear()
+
+# ホスト別の同時接続数・再試行・サーキットブレーカー（main で設定）
+HOST_SCHEDULER = None
+
+# 接続確立とレスポンス読み取りのタイムアウト（秒）。落ちているホストで読み取り分まで待たない
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+# 接続エラー・タイムアウト・429/5xx の再試行回数とバックオフ（秒）
+RETRIES = 2
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 30.0
+
+# 条件付きGET用の永続HTTPキャッシュ（main で設定）
+HTTP_CACHE = None
+
+# 本文を sha256 で1つだけ保存するブロブストア（main で設定）
+BLOB_STORE = None
+# HTML抽出ロジックを変えたら上げる（ブロブストアの抽出結果キャッシュのキー）
+HTML_EXTRACTOR_VERSION = 3
+
+def host_slot(url: str):
+    return HOST_SCHEDULER.slot(url) if HOST_SCHEDULER is not None else nullcontext()
+
+class StageTimer:
+    """
+    1件の処理の段階別の所要時間（秒）とバイト数を集める。
+    index.jsonl のレコードに timings / stage_bytes として書き出す。
+    """
+    def __init__(self):
+        self.timings = {}
+        self.stage_bytes = {}
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def add_bytes(self, name, n):
+        self.stage_bytes[name] = self.stage_bytes.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_record(self):
+        rec = {"timings": {k: round(v, 6) for k, v in self.timings.items()}}
+        if self.stage_bytes:
+            rec["stage_bytes"] = dict(self.stage_bytes)
+        return rec
+
+@contextmanager
+def timed_host_slot(url: str, timer: StageTimer):
+    """host_slot の空き待ち時間を host_wait として記録する"""
+    start = time.perf_counter()
+    with host_slot(url) as lease:
+        timer.add("host_wait", time.perf_counter() - start)
+        yield lease
+
 def sha256_of_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
-def fetch(url: str, timeout=30):
-    """Fetch with HEAD fallback to GET if HEAD not allowed."""
-    s = create_session()
+def fetch(url: str, timeout=None, headers=None):
+    """
+    Single streamed GET on the pooled session for the URL's host.
+
+    Only the headers have been read when this returns, so the caller can
+    decide PDF vs HTML (or skip) from the same response and then either read
+    ``r.content`` once or close it without downloading the body.
+    ``headers`` carries the conditional-GET validators from the HTTP cache.
+    ``timeout`` defaults to the (CONNECT_TIMEOUT, READ_TIMEOUT) pair.
+    """
+    s = get_session(url)
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return s.get(url, allow_redirects=True, timeout=timeout, stream=True, headers=headers or None)
+
+class BodyTooLarge(Exception):
+    """本文が MAX_BODY_BYTES を超えた"""
+
+# 1件の本文の上限サイズ（--max-body-mb で変更）
+MAX_BODY_BYTES = 200 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+def download_to_tempfile(r, tmp_dir, max_bytes=None):
+    """
+    Stream the response body into a temporary file in ``tmp_dir``.
+
+    The sha256 is computed while writing, so the body is never held in memory.
+    Returns (tmp_path, sha256, size); the caller moves the file into place with
+    an atomic rename. Raises BodyTooLarge (and removes the partial file) when
+    the body exceeds ``max_bytes``.
+    """
+    max_bytes = MAX_BODY_BYTES if max_bytes is None else max_bytes
+    declared = int(r.headers.get("content-length", "0") or 0)
+    if max_bytes and declared > max_bytes:
+        raise BodyTooLarge(f"Content-Length {declared} bytes exceeds limit {max_bytes} bytes")
+    
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    os.fchmod(fd, FILE_MODE)
     try:
-        r = s.head(url, allow_redirects=True, timeout=timeout)
-        if r.status_code >= 400 or ("text/html" in r.headers.get("content-type","").lower() and int(r.headers.get("content-length","0") or 0) == 0):
-            raise Exception("HEAD not usable, try GET")
-        return r, None
-    except Exception:
-        r = s.get(url, allow_redirects=True, timeout=timeout)
-        return r, r.content  # when GET was used, return content too
+        with os.fdopen(fd, "wb") as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise BodyTooLarge(f"body exceeds limit {max_bytes} bytes")
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, h.hexdigest(), size
+
+def write_text_atomic(path, text):
+    """書きかけのファイルが完成品と誤認されないよう、一時ファイル経由で置き換える"""
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def response_content_type(r) -> str:
+    return r.headers.get("content-type", "").split(";")[0].lower()
 
 def guess_filename(url: str) -> str:
     name = os.path.basename(urlparse(url).path) or "index"
@@ -80,52 +241,141 @@ def normalize_text(txt: str) -> str:
     txt = re.sub(r"\n{3,}", "\n\n", txt)
     return txt.strip()
 
-def extract_html_text(html_bytes: bytes, url: str) -> str:
-    # encoding detection
-    enc = chardet.detect(html_bytes).get("encoding") or "utf-8"
-    html = html_bytes.decode(enc, errors="replace")
+# 文字コードの判定に使う範囲（<meta> は先頭付近にあり、chardet は全文を見なくても十分当たる）
+CHARSET_SNIFF_BYTES = 4096
+CHARDET_SAMPLE_BYTES = 64 * 1024
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:\-]+)', re.I)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([\w.:\-]+)', re.I)
+# Shift_JIS を名乗るページの多くは機種依存文字（①、㈱など）を含むため上位互換で読む
+CHARSET_SUPERSETS = {"shift_jis": "cp932"}
+# 汎用フォールバックで本文とみなさない要素
+FALLBACK_TEXT_XPATH = (
+    "//text()[not(ancestor::script or ancestor::style or ancestor::noscript"
+    " or ancestor::header or ancestor::footer or ancestor::nav)]"
+)
+
+def _lookup_charset(name):
+    if isinstance(name, bytes):
+        name = name.decode("ascii", errors="ignore")
+    try:
+        enc = codecs.lookup(name).name
+    except LookupError:
+        return None
+    return CHARSET_SUPERSETS.get(enc, enc)
+
+def detect_html_encoding(html_bytes: bytes, content_type: str = "") -> str:
+    """
+    HTMLの文字コードを BOM → HTTPヘッダーの charset → <meta> → 先頭サンプルの chardet の順で決める。
+    """
+    if html_bytes.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    m = _HEADER_CHARSET_RE.search(content_type or "")
+    if m and _lookup_charset(m.group(1)):
+        return _lookup_charset(m.group(1))
+    m = _META_CHARSET_RE.search(html_bytes[:CHARSET_SNIFF_BYTES])
+    if m and _lookup_charset(m.group(1)):
+        return _lookup_charset(m.group(1))
+    enc = chardet.detect(html_bytes[:CHARDET_SAMPLE_BYTES]).get("encoding")
+    return (enc and _lookup_charset(enc)) or "utf-8"
+
+def tree_fallback_text(tree) -> str:
+    """script/nav などを除いたテキストノードを1行ずつ並べる（ツリーは書き換えない）"""
+    lines = [ln.strip() for part in tree.xpath(FALLBACK_TEXT_XPATH) for ln in part.splitlines()]
+    return "\n".join(ln for ln in lines if ln)
+
+def extract_html_text_with_method(html_bytes: bytes, url: str, content_type: str = "", timer=None):
+    """
+    Extract the ordinance text and return (text, method).
+
+    The page is decoded and parsed once; the same lxml tree is shared by the
+    vendor-template extractors, trafilatura and the plain-text fallback.
+    ``timer`` (a StageTimer) receives the time spent in each step.
+    """
+    timer = timer if timer is not None else StageTimer()
+    with timer.stage("charset"):
+        enc = detect_html_encoding(html_bytes, content_type)
+        html = html_bytes.decode(enc, errors="replace")
+    try:
+        with timer.stage("parse"):
+            tree = parse_html(html)
+    except Exception:
+        # 空の文書など、lxml がツリーを作れない場合
+        return "", "lxml"
+
+    # 例規集サービスのテンプレートが分かっているページはlxmlで条・項・号を直接取り出す
+    try:
+        with timer.stage("vendor"):
+            text, vendor = extract_vendor_text(tree, url)
+        if text:
+            return normalize_text(text), f"vendor:{vendor}"
+    except Exception:
+        pass
 
     if HAS_TRA:
         try:
-            main = trafilatura.extract(html, url=url, include_comments=False, include_links=False)
+            # trafilatura は渡したツリーをコピーしてから加工する
+            with timer.stage("trafilatura"):
+                main = trafilatura.extract(tree, url=url, include_comments=False, include_links=False)
             if main and len(main) > 200:
-                return normalize_text(main)
+                return normalize_text(main), "trafilatura"
         except Exception:
             pass
 
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup(["script","style","noscript","header","footer","nav"]):
-        tag.decompose()
-    text = soup.get_text("\n")
-    # collapse menu-like very short lines heuristic
-    lines = [ln.strip() for ln in text.splitlines()]
-    lines = [ln for ln in lines if ln]
-    text = "\n".join(lines)
-    return normalize_text(text)
+    with timer.stage("fallback"):
+        text = normalize_text(tree_fallback_text(tree))
+    return text, "lxml"
 
-def pdf_text_fast(path: Path) -> str:
-    """Try pdfminer first; if too short, try PyMuPDF blocks with sort."""
+def extract_html_text(html_bytes: bytes, url: str, content_type: str = "") -> str:
+    return extract_html_text_with_method(html_bytes, url, content_type)[0]
+
+def pdf_extract_pages(path: Path, timer=None):
+    """
+    Extract raw text once and keep it split per page.
+
+    Returns (raw_text, page_texts, method). pdfminer separates pages with a
+    form feed, so the per-page view costs nothing extra; PyMuPDF is already
+    page by page. ``timer`` (a StageTimer) receives the time per extractor.
+    """
+    timer = timer if timer is not None else StageTimer()
     try:
-        t = pdf_extract_text(str(path)) or ""
+        with timer.stage("pdfminer"):
+            t = pdf_extract_text(str(path)) or ""
     except Exception:
         t = ""
     if len(t.strip()) >= 200:
-        return normalize_text(t)
+        pages = t.split("\f")
+        if pages and not pages[-1].strip():
+            pages.pop()
+        return t, pages, "pdfminer"
     # try PyMuPDF
     try:
-        doc = fitz.open(path)
-        blocks = []
-        for page in doc:
-            blocks.append(page.get_text("text", sort=True))
-        t2 = "\n".join(blocks)
-        return normalize_text(t2)
+        with timer.stage("pymupdf"):
+            doc = fitz.open(path)
+            blocks = []
+            for page in doc:
+                blocks.append(page.get_text("text", sort=True))
+        return "\n".join(blocks), blocks, "pymupdf"
     except Exception:
-        return normalize_text(t)
+        return t, [t], "pdfminer"
+
+def pdf_text_with_method(path: Path):
+    """Like pdf_text_fast(), but also return which extractor produced the text."""
+    raw, _, method = pdf_extract_pages(path)
+    return normalize_text(raw), method
+
+def pdf_text_fast(path: Path) -> str:
+    """Try pdfminer first; if too short, try PyMuPDF blocks with sort."""
+    return pdf_text_with_method(path)[0]
+
+def scanned_pages(page_texts, char_threshold=50):
+    """1-based numbers of pages whose text layer is (nearly) empty, i.e. scanned pages."""
+    return [i for i, t in enumerate(page_texts, 1) if len(t.strip()) < char_threshold]
 
-def is_scanned_pdf(path: Path, char_threshold=200) -> bool:
-    """Heuristic: extract text and count; scanned PDFs usually yield near zero."""
-    txt = pdf_text_fast(path)
-    return len(txt) < char_threshold
+def is_scanned_pdf(path: Path, char_threshold=200, text=None) -> bool:
+    """Heuristic: scanned PDFs usually yield near zero text. Pass ``text`` to reuse an extraction."""
+    if text is None:
+        text = pdf_text_fast(path)
+    return len(text) < char_threshold
 
 def ocrmypdf_available() -> bool:
     try:
@@ -134,20 +384,47 @@ def ocrmypdf_available() -> bool:
     except Exception:
         return False
 
-def run_ocrmypdf(in_pdf: Path, out_pdf: Path, lang="jpn+eng"):
+def run_ocrmypdf(in_pdf: Path, out_pdf: Path, lang="jpn+eng", jobs=2, pages=None):
+    """OCR ``in_pdf``; ``pages`` (1-based numbers) restricts OCR to those pages."""
     cmd = [
         "ocrmypdf",
         "--skip-text",          # do not OCR pages with embedded text
         "--optimize", "3",      # max optimization
         "--language", lang,
         "--output-type","pdf",
-        "--jobs", "2",
-        str(in_pdf),
-        str(out_pdf),
+        "--jobs", str(jobs),
     ]
-    subprocess.run(cmd, check=True)
+    if pages:
+        cmd += ["--pages", ",".join(str(p) for p in pages)]
+    cmd += [str(in_pdf), str(out_pdf)]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+def cached_skip_record(url: str, meta: dict, method: str, is_pdf: bool, out_path: Path, entry: dict):
+    """304 またはハッシュ一致で保存・抽出を省略した場合のレコード"""
+    rec = {
+        "url": url,
+        "municipality": meta.get("municipality", ""),
+        "prefecture": meta.get("prefecture", ""),
+        "doc_type": meta.get("doc_type", ""),
+        "status": "skipped",
+        "method": method,
+        "bytes_sha256": entry.get("bytes_sha256"),
+    }
+    rec["output_pdf" if is_pdf else "output_txt"] = str(out_path)
+    return rec
+
+def reuse_cached_output(entry: dict, out_path: Path):
+    """キャッシュ済みの出力が別の場所（別の年など）にある場合はコピーする"""
+    cached_output = Path(entry["output_path"])
+    if cached_output != out_path and not out_path.exists():
+        sha256 = entry.get("bytes_sha256")
+        if BLOB_STORE is not None and out_path.suffix == ".pdf" and sha256 and BLOB_STORE.has(sha256):
+            BLOB_STORE.link(sha256, out_path)
+        else:
+            shutil.copyfile(cached_output, out_path)
 
-def process_url(url: str, meta: dict, html_completed: set):
+def output_paths(url: str, meta: dict, ctx: YearContext):
+    """URLとCSVのメタデータから出力先 (out_pdf, out_txt) を決める"""
     # Use metadata for better filename
     if "municipality" in meta and "doc_type" in meta:
         municipality_safe = safe_filename(meta["municipality"])
@@ -155,103 +432,413 @@ def process_url(url: str, meta: dict, html_completed: set):
         fname_base = f"{municipality_safe}_{doc_type_safe}"
     else:
         fname_base = safe_filename(guess_filename(url))
+    return ctx.pdf_dir / f"{fname_base}.pdf", ctx.out_dir / f"{fname_base}.txt"
+
+def html_versions_exist(municipality: str, ctx: YearContext) -> bool:
+    """自治体の条例・規則のHTML版が両方とも抽出済みか（その場合PDFは取得しない）"""
+    if not municipality:
+        return False
+    municipality_safe = safe_filename(municipality)
+    ordinance_html = ctx.out_dir / f"{municipality_safe}_Ordinance_HTML.txt"
+    regulation_html = ctx.out_dir / f"{municipality_safe}_Regulation_HTML.txt"
+    return ordinance_html.exists() and regulation_html.exists()
+
+def html_exists_record(url: str, meta: dict):
+    return {
+        "url": url,
+        "municipality": meta.get("municipality", ""),
+        "prefecture": meta.get("prefecture", ""),
+        "doc_type": meta.get("doc_type", ""),
+        "status": "skipped",
+        "method": "html_exists",
+        "output_pdf": None
+    }
+
+def already_exists_record(url: str, meta: dict, out_path: Path, is_pdf: bool):
+    return {
+        "url": url,
+        "municipality": meta.get("municipality", ""),
+        "prefecture": meta.get("prefecture", ""),
+        "doc_type": meta.get("doc_type", ""),
+        "output_pdf" if is_pdf else "output_txt": str(out_path),
+        "status": "skipped",
+        "method": "already_exists"
+    }
+
+def process_url(url: str, meta: dict, html_completed: set, ctx: YearContext, refresh=False, timer=None):
+    """
+    URLを1件処理する。出力先は ctx（年別のディレクトリ）で決まる。
+
+    refresh=True の場合は既存の出力があってもスキップせず、HTTPキャッシュの
+    ETag / Last-Modified で条件付きGETを行い、304 または本文のハッシュが
+    前回と同じなら保存・抽出を省略する。変更があった場合は amended を記録する。
+
+    timer（StageTimer）には段階別の所要時間とバイト数を記録する:
+      host_wait（ホスト別の同時接続数・間隔の待ち）、headers（接続確立からヘッダー受信まで）、
+      download、store（ブロブストア・PDFの配置）、charset / parse / vendor / trafilatura / fallback
+      （HTML抽出）、write（テキストの書き出し）、http_cache
+    """
+    timer = timer if timer is not None else StageTimer()
+    out_pdf, out_txt = output_paths(url, meta, ctx)
+    
+    # 計画時にPDFと判定したURLは、同じ実行で同じ自治体のHTMLが揃っていればGETせずに済ませる
+    if meta.get("expect_pdf") and html_versions_exist(meta.get("municipality", ""), ctx):
+        print(f"    [SKIP] HTML versions exist for {meta['municipality']}, skipping PDF")
+        return html_exists_record(url, meta)
     
-    # Determine if this is a PDF URL
-    r_test, _ = fetch(url)
-    ct = r_test.headers.get("content-type","").split(";")[0].lower()
-    is_pdf = "pdf" in ct or url.lower().endswith(".pdf")
-    
-    if is_pdf:
-        # Check if HTML versions exist for both Ordinance and Regulation
-        municipality = meta.get("municipality", "")
-        if municipality:
-            municipality_safe = safe_filename(municipality)
-            ordinance_html = OUT_DIR / f"{municipality_safe}_Ordinance_HTML.txt"
-            regulation_html = OUT_DIR / f"{municipality_safe}_Regulation_HTML.txt"
+    # 前回のキャッシュエントリー（出力ファイルが残っている場合のみ条件付きGETに使う）
+    with timer.stage("http_cache"):
+        previous = HTTP_CACHE.get(url) if HTTP_CACHE is not None else None
+    cache_entry = None
+    if refresh and previous and previous.get("output_path") and Path(previous["output_path"]).exists():
+        cache_entry = previous
+    
+    # 1回のGETのヘッダーでPDFかHTMLかを判定し、本文は必要な場合だけ読む
+    with timed_host_slot(url, timer) as lease:
+        started = time.perf_counter()
+        with timer.stage("headers"):
+            r = fetch(url, headers=conditional_headers(cache_entry))
+        if lease is not None:
+            lease.latency = time.perf_counter() - started
+        try:
+            if r.status_code == 304 and cache_entry is not None:
+                ct = cache_entry.get("content_type") or ""
+                is_pdf = "pdf" in ct or url.lower().endswith(".pdf")
+                out_path = out_pdf if is_pdf else out_txt
+                reuse_cached_output(cache_entry, out_path)
+                print(f"    [SKIP] Not modified: {url}")
+                return cached_skip_record(url, meta, "not_modified", is_pdf, out_path, cache_entry)
+            # 条件付きヘッダーを送っていないのに 304 を返すサーバー・プロキシでは、空の本文を保存しない
+            if r.status_code == 304 or r.status_code >= 400:
+                raise HttpStatusError(r.status_code, url, parse_retry_after(r.headers.get("Retry-After")))
             
-            # Skip PDF if both HTML versions exist
-            if ordinance_html.exists() and regulation_html.exists():
-                print(f"    [SKIP] HTML versions exist for {municipality}, skipping PDF")
-                return {
-                    "url": url,
-                    "municipality": municipality,
-                    "prefecture": meta.get("prefecture", ""),
-                    "doc_type": meta.get("doc_type", ""),
-                    "status": "skipped",
-                    "method": "html_exists",
-                    "output_pdf": None
-                }
+            ct = response_content_type(r)
+            content_type = r.headers.get("content-type", "")
+            is_pdf = "pdf" in ct or url.lower().endswith(".pdf")
         
-        # Check if PDF already downloaded
-        out_pdf = PDF_DIR / f"{fname_base}.pdf"
-        if out_pdf.exists():
-            print(f"    [SKIP] Already exists: {out_pdf}")
-            return {
+            # URLから判定できなかったPDFなど、計画時に分からなかったスキップ
+            if is_pdf:
+                # Skip PDF if both HTML versions exist
+                if html_versions_exist(meta.get("municipality", ""), ctx):
+                    print(f"    [SKIP] HTML versions exist for {meta['municipality']}, skipping PDF")
+                    return html_exists_record(url, meta)
+            
+                # Check if PDF already downloaded
+                if out_pdf.exists() and not refresh:
+                    print(f"    [SKIP] Already exists: {out_pdf}")
+                    return already_exists_record(url, meta, out_pdf, True)
+            else:
+                if out_txt.exists() and not refresh:
+                    print(f"    [SKIP] Already exists: {out_txt}")
+                    return already_exists_record(url, meta, out_txt, False)
+        
+            # 本文はメモリに載せずに一時ファイルへストリーミングする
+            out_path = out_pdf if is_pdf else out_txt
+            tmp_dir = BLOB_STORE.tmp if BLOB_STORE is not None else out_path.parent
+            with timer.stage("download"):
+                tmp_path, body_hash, body_size = download_to_tempfile(r, tmp_dir)
+            timer.add_bytes("download", body_size)
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+        finally:
+            r.close()
+    
+    now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    
+    try:
+        # 本文が前回と同じなら保存・抽出を省略（ETag未対応サーバー向け）
+        if cache_entry is not None and cache_entry.get("bytes_sha256") == body_hash:
+            reuse_cached_output(cache_entry, out_path)
+            HTTP_CACHE.put(url, etag=etag, last_modified=last_modified, bytes_sha256=body_hash,
+                           output_path=cache_entry["output_path"], content_type=ct)
+            print(f"    [SKIP] Unchanged: {url}")
+            return cached_skip_record(url, meta, "unchanged", is_pdf, out_path, cache_entry)
+    
+        if is_pdf:
+            # Download PDF（ブロブストア使用時は年別ディレクトリにはハードリンクを置く）
+            with timer.stage("store"):
+                if BLOB_STORE is not None:
+                    BLOB_STORE.put_file(tmp_path, body_hash)
+                    BLOB_STORE.link(body_hash, out_pdf)
+                else:
+                    os.replace(tmp_path, out_pdf)
+            record = {
                 "url": url,
-                "municipality": meta.get("municipality", ""),
-                "prefecture": meta.get("prefecture", ""),
-                "doc_type": meta.get("doc_type", ""),
+                "content_type": ct,
+                "fetched_at": now,
+                "method": "pdf_download",
+                "bytes_sha256": body_hash,
+                "bytes": body_size,
                 "output_pdf": str(out_pdf),
-                "status": "skipped",
-                "method": "already_exists"
             }
-        
-        # Download PDF
-        r, body = fetch(url)
-        if body is None:
-            r_get = create_session().get(url, timeout=30)
-            body = r_get.content
-        
-        pdf_hash = sha256_of_bytes(body)
-        out_pdf.write_bytes(body)
-        
-        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
-        return {
-            "url": url,
-            "content_type": ct,
-            "fetched_at": now,
-            "method": "pdf_download",
-            "bytes_sha256": pdf_hash,
-            "output_pdf": str(out_pdf),
-        }
-    
-    # HTML processing
-    out_txt = OUT_DIR / f"{fname_base}.txt"
-    if out_txt.exists():
-        print(f"    [SKIP] Already exists: {out_txt}")
-        return {
-            "url": url,
-            "municipality": meta.get("municipality", ""),
-            "prefecture": meta.get("prefecture", ""),
-            "doc_type": meta.get("doc_type", ""),
-            "output_txt": str(out_txt),
-            "status": "skipped",
-            "method": "already_exists"
-        }
-    
-    r, body = fetch(url)
-    now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        else:
+            # HTML processing
+            record = {
+                "url": url,
+                "content_type": ct,
+                "fetched_at": now,
+                "method": None,
+                "bytes_sha256": body_hash,
+                "bytes": body_size,
+                "output_txt": None,
+            }
+            # 同じ本文の抽出結果がブロブストアにあれば抽出を省略する
+            cache_kind = f"html.v{HTML_EXTRACTOR_VERSION}.json"
+            cached = None
+            if BLOB_STORE is not None:
+                with timer.stage("store"):
+                    BLOB_STORE.put_file(tmp_path, body_hash)
+                    body_path = BLOB_STORE.blob_path(body_hash)
+                    cached = BLOB_STORE.read_derived(body_hash, cache_kind)
+                record["extract_cached"] = cached is not None
+            else:
+                body_path = tmp_path
+            if cached is not None:
+                cached = json.loads(cached)
+                text, method = cached["text"], cached["method"]
+            else:
+                # HTMLは MAX_BODY_BYTES 以下に制限済みなので抽出時だけメモリに読む
+                body = Path(body_path).read_bytes()
+                text, method = extract_html_text_with_method(body, url, content_type, timer)
+                if BLOB_STORE is not None:
+                    with timer.stage("store"):
+                        BLOB_STORE.write_derived(body_hash, cache_kind, json.dumps(
+                            {"method": method, "text": text}, ensure_ascii=False
+                        ))
+            with timer.stage("write"):
+                write_text_atomic(out_txt, text)
+            timer.add_bytes("write", len(text.encode("utf-8")))
+            record["method"] = method
+            record["output_txt"] = str(out_txt)
     
-    record = {
-        "url": url,
-        "content_type": ct,
-        "fetched_at": now,
-        "method": None,
-        "bytes_sha256": None,
-        "output_txt": None,
-    }
-
-    if body is None:
-        r_get = create_session().get(url, timeout=30)
-        body = r_get.content
-    rec_hash = sha256_of_bytes(body)
-    record["bytes_sha256"] = rec_hash
-    text = extract_html_text(body, url)
-    out_txt.write_text(text, encoding="utf-8")
-    record["method"] = "trafilatura/BeautifulSoup"
-    record["output_txt"] = str(out_txt)
+    finally:
+        # 抽出などで失敗した場合も一時ファイルを残さない（保存済みの場合は移動済み）
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    
+    if HTTP_CACHE is not None:
+        with timer.stage("http_cache"):
+            HTTP_CACHE.put(url, etag=etag, last_modified=last_modified, bytes_sha256=body_hash,
+                           output_path=out_path, content_type=ct)
+    # 前回取得時から本文が変わった（改正された）例規
+    if refresh and previous and previous.get("bytes_sha256") and previous["bytes_sha256"] != body_hash:
+        record["amended"] = True
+        record["previous_sha256"] = previous["bytes_sha256"]
     return record
 
+class IndexWriter:
+    """
+    index.jsonl にレコードを1件ずつ追記する。
+    fsync は fsync_every 件ごと、または fsync_interval 秒ごとにまとめて行う。
+    """
+    def __init__(self, path, append=False, fsync_every=20, fsync_interval=5.0):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._f = open(self.path, "a" if append else "w", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, rec):
+        self._f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._f.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+class OrderedEmitter:
+    """
+    完了順に届くレコードを番号順（CSVの順）に並べ替えて emit に渡す。
+    保持するのは、まだ完了していない最も若い番号より後に完了したレコード。
+    再試行中の1件があるとその後のレコードはすべて溜まるため、run_years は投入済みで
+    未完了のタスクを workers * TASK_WINDOW_PER_WORKER 個までに制限し、取得したレコードの保持を
+    その範囲の自治体グループ分に抑える（計画時のスキップのレコードは計画にある辞書をそのまま保持する）。
+    """
+    def __init__(self, emit, start=1):
+        self._emit = emit
+        self._next = start
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def put(self, idx, rec):
+        with self._lock:
+            self._pending[idx] = rec
+            while self._next in self._pending:
+                self._emit(self._pending.pop(self._next))
+                self._next += 1
+
+# 段階別ヒストグラムの区切り（秒）
+HISTOGRAM_BOUNDS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+# 終了時の集計で段階ごとに表示する遅いURLの件数
+SLOWEST_PER_STAGE = 5
+
+def _format_seconds(sec):
+    return f"{sec * 1000:.0f}ms" if sec < 1 else f"{sec:g}s"
+
+class StageStats:
+    """
+    レコードの timings / stage_bytes を段階別に集計する。
+    保持するのはヒストグラムと段階ごとの遅いURLの上位N件だけなので、URL数に比例してメモリを使わない。
+    """
+    def __init__(self, slowest=SLOWEST_PER_STAGE):
+        self.slowest = slowest
+        self.histograms = {}
+        self.totals = {}
+        self.stage_bytes = {}
+        self._slowest = {}
+
+    def add(self, rec):
+        url = rec.get("url", "")
+        for stage, sec in rec.get("timings", {}).items():
+            buckets = self.histograms.setdefault(stage, [0] * (len(HISTOGRAM_BOUNDS) + 1))
+            buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, sec)] += 1
+            self.totals[stage] = self.totals.get(stage, 0.0) + sec
+            heap = self._slowest.setdefault(stage, [])
+            if len(heap) < self.slowest:
+                heapq.heappush(heap, (sec, url))
+            elif sec > heap[0][0]:
+                heapq.heapreplace(heap, (sec, url))
+        for stage, n in rec.get("stage_bytes", {}).items():
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + n
+
+    def slowest_urls(self, stage):
+        return sorted(self._slowest.get(stage, []), reverse=True)
+
+    def print_summary(self):
+        if not self.histograms:
+            return
+        labels = [f"<={_format_seconds(b)}" for b in HISTOGRAM_BOUNDS] + [f">{_format_seconds(HISTOGRAM_BOUNDS[-1])}"]
+        print("  Stage timings:")
+        print(f"    {'stage':<12}{'count':>7}{'total':>10}{'mean':>9}" + "".join(f"{l:>9}" for l in labels))
+        for stage, buckets in self.histograms.items():
+            count = sum(buckets)
+            total = self.totals[stage]
+            print(f"    {stage:<12}{count:>7}{total:>9.2f}s{total / count * 1000:>7.1f}ms"
+                  + "".join(f"{n:>9}" for n in buckets))
+        if self.stage_bytes:
+            print("  Stage bytes: " + ", ".join(
+                f"{stage} {n / 1024 / 1024:.1f} MB" for stage, n in self.stage_bytes.items()
+            ))
+        print(f"  Slowest URLs per stage (top {self.slowest}):")
+        for stage in self.histograms:
+            print(f"    {stage}:")
+            for sec, url in self.slowest_urls(stage):
+                print(f"      {sec:8.3f}s  {url}")
+
+def entry_key(rec):
+    """index.jsonl のレコードとCSVエントリーを対応付けるキー"""
+    return (rec.get("url"), rec.get("municipality", ""), rec.get("doc_type", ""))
+
+def load_index_records(index_path):
+    """既存の index.jsonl の完了済み（エラー以外）のレコードをキーごとに集める（後の行を優先）"""
+    records = {}
+    if not Path(index_path).exists():
+        return records
+    with open(index_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                # 強制終了時の書きかけの行
+                continue
+            if "error" not in rec:
+                records[entry_key(rec)] = rec
+    return records
+
+def load_finished_keys(index_path):
+    """既存の index.jsonl から完了済み（エラー以外）のエントリーのキーを集める"""
+    return set(load_index_records(index_path))
+
+def looks_like_pdf(url: str, doc_type: str = "") -> bool:
+    return urlparse(url).path.lower().endswith(".pdf") or doc_type.endswith("_PDF")
+
+# スキップのレコードに前回のレコードから引き継ぐ項目
+CARRIED_FIELDS = ("bytes_sha256", "content_type")
+
+def carried_fields(url: str, prev):
+    """
+    スキップのレコードに引き継ぐ値（前回の index.jsonl のレコード、無ければHTTPキャッシュから）。
+    index.jsonl は実行ごとに書き直すので、スキップのレコードにも bytes_sha256 を書いておかないと
+    blob_store.py gc が使用中のブロブ（HTMLの本文と抽出結果、コピーで配置したPDF）を削除してしまう。
+    content_type は次回の計画でPDFかHTMLかを判定するのに使う。
+    """
+    sources = [prev]
+    if HTTP_CACHE is not None:
+        sources.append(HTTP_CACHE.get(url))
+    carry = {}
+    for key in CARRIED_FIELDS:
+        for source in sources:
+            if source and source.get(key):
+                carry[key] = source[key]
+                break
+    return carry
+
+def plan_entries(url_entries, ctx: YearContext, refresh=False):
+    """
+    ネットワークにアクセスせずに、各エントリーを取得するかスキップするかを決める。
+
+    判断材料は出力ファイル（out_pdf / out_txt の両方）、既存の index.jsonl
+    （前回の Content-Type。無ければHTTPキャッシュ）、URL・列名によるPDFの推定。
+    同じ実行で同じ自治体のHTMLを取得するPDFは fetch とし、実行時に process_url が
+    HTML版の有無を再確認する（その時点でHTMLが揃っていればGETしない）。
+
+    Returns: エントリーと同じ順の {"action": "skip"|"fetch", "reason", "expect_pdf", "record", "carry"} のリスト
+             （carry はスキップした場合にレコードに引き継ぐ値）
+    """
+    previous = load_index_records(ctx.index_path)
+    html_fetching = set()  # 今回HTMLを取得する自治体
+    plan = []
+    for entry in url_entries:
+        url = entry["url"]
+        prev = previous.get(entry_key(entry))
+        carry = carried_fields(url, prev)
+        if carry.get("content_type"):
+            expect_pdf = "pdf" in carry["content_type"]
+        else:
+            expect_pdf = looks_like_pdf(url, entry["doc_type"])
+        out_pdf, out_txt = output_paths(url, entry, ctx)
+        item = {"action": "fetch", "reason": "refresh" if refresh else "missing",
+                "expect_pdf": expect_pdf, "record": None, "carry": carry}
+        if expect_pdf and html_versions_exist(entry["municipality"], ctx):
+            item.update(action="skip", reason="html_exists", record=html_exists_record(url, entry))
+        elif not refresh and (out_pdf.exists() or out_txt.exists()):
+            is_pdf = out_pdf.exists()
+            item.update(action="skip", reason="already_exists",
+                        record=already_exists_record(url, entry, out_pdf if is_pdf else out_txt, is_pdf))
+        elif expect_pdf and entry["municipality"] in html_fetching:
+            item["reason"] = "html_pending"
+        elif not expect_pdf:
+            html_fetching.add(entry["municipality"])
+        plan.append(item)
+    return plan
+
+def print_plan(url_entries, plan, verbose=False):
+    """計画の件数（と verbose の場合は各エントリー）を表示する"""
+    counts = {}
+    for idx, (entry, item) in enumerate(zip(url_entries, plan), 1):
+        counts[(item["action"], item["reason"])] = counts.get((item["action"], item["reason"]), 0) + 1
+        if verbose:
+            print(f"[{idx}/{len(plan)}] {item['action'].upper():<5} {item['reason']:<14} "
+                  f"{entry['municipality']} ({entry['doc_type']}) {entry['url']}")
+    fetch = sum(n for (action, _), n in counts.items() if action == "fetch")
+    print(f"Plan: fetch {fetch}, skip {len(plan) - fetch}")
+    for (action, reason), n in sorted(counts.items()):
+        print(f"  {action:<5} {reason:<14} {n}")
+
 def get_available_years():
     """利用可能な年別URLファイルのリストを取得"""
     pattern = "urls_*.csv"
@@ -331,32 +918,8 @@ def get_urls_file_paths(years=None):
     
     return file_paths
 
-def process_single_file(urls_path):
-    """単一のURLファイルを処理"""
-    global OUT_DIR, PDF_DIR
-    
-    # ファイル名から年を抽出して出力ディレクトリを設定
-    match = re.search(r'urls_(\d{4})\.csv', urls_path)
-    if match:
-        detected_year = match.group(1)
-        OUT_DIR = Path(f"out_{detected_year}")
-        PDF_DIR = Path(f"out_pdf_{detected_year}")
-    else:
-        # デフォルトのディレクトリを使用
-        OUT_DIR = Path("out_2020")
-        PDF_DIR = Path("out_pdf_2020")
-    
-    print(f"\n{'='*60}")
-    print(f"Processing: {urls_path}")
-    print(f"Output directory: {OUT_DIR}")
-    print(f"PDF directory: {PDF_DIR}")
-    print(f"{'='*60}")
-    
-    index_path = OUT_DIR / "index.jsonl"
-    os.makedirs(OUT_DIR, exist_ok=True)
-    os.makedirs(PDF_DIR, exist_ok=True)
-    
-    # read URLs from CSV with all URL columns
+def read_url_entries(urls_path):
+    """URLファイル（CSV）の各行の URL 列を (url, 自治体, 都道府県, 列名) のエントリーにする"""
     url_entries = []
     with open(urls_path, newline="", encoding="utf-8") as f:
         # Skip empty lines at the beginning
@@ -397,75 +960,314 @@ def process_single_file(urls_path):
                         "prefecture": prefecture,
                         "doc_type": col_name
                     })
+    return url_entries
 
-    print(f"Total URLs found: {len(url_entries)}")
+class YearRun:
+    """
+    1つのURLファイル（1年分）のクロールの状態: 計画、index.jsonl への書き出し、件数と集計。
+    process_single_file は1つ、--merge-years では複数の YearRun が同じスレッドプールを共有する。
+    """
+    def __init__(self, urls_path, refresh=False, resume=False, slowest=SLOWEST_PER_STAGE,
+                 dry_run=False, show_year=False):
+        self.urls_path = urls_path
+        self.ctx = YearContext.for_urls_file(urls_path)
+        self.refresh = refresh
+        self.resume = resume
+        # 複数年をまとめて処理する場合は進捗表示に年を付ける
+        self.prefix = f"{self.ctx.year} " if show_year else ""
+        
+        print(f"\n{'='*60}")
+        print(f"Processing: {urls_path}")
+        print(f"Output directory: {self.ctx.out_dir}")
+        print(f"PDF directory: {self.ctx.pdf_dir}")
+        print(f"{'='*60}")
+        
+        url_entries = read_url_entries(urls_path)
+        print(f"Total URLs found: {len(url_entries)}")
+        
+        # --resume: 既存の index.jsonl で完了済みのURLは処理しない
+        if resume:
+            finished = load_finished_keys(self.ctx.index_path)
+            before = len(url_entries)
+            url_entries = [e for e in url_entries if entry_key(e) not in finished]
+            print(f"Resume: {before - len(url_entries)} 件は完了済みのためスキップ")
+        
+        self.url_entries = url_entries
+        self.plan = plan_entries(url_entries, self.ctx, refresh=refresh)
+        print_plan(url_entries, self.plan, verbose=dry_run)
+        
+        # Build set of municipalities that have HTML completed
+        self.html_completed = set()
+        self.total = len(url_entries)
+        self.success_count = 0
+        self.skip_count = 0
+        self.error_count = 0
+        self.amended = []
+        self.stage_stats = StageStats(slowest=slowest)
+        self.writer = None
+        self.emitter = None
+    
+    def planned_counts(self):
+        """--dry-run 用: (0, 計画上のスキップ数, 0, URL数)"""
+        skips = sum(1 for item in self.plan if item["action"] == "skip")
+        return 0, skips, 0, self.total
+    
+    def open(self):
+        os.makedirs(self.ctx.out_dir, exist_ok=True)
+        os.makedirs(self.ctx.pdf_dir, exist_ok=True)
+        # レコードは完了次第 index.jsonl に追記する（並行モードではCSV順に並べ替えて書き出す）
+        self.writer = IndexWriter(self.ctx.index_path, append=self.resume)
+        self.emitter = OrderedEmitter(self._emit)
+    
+    def close(self):
+        # 中断時も書き出し済みのレコードは失われない
+        if self.writer is not None:
+            self.writer.close()
     
-    # Build set of municipalities that have HTML completed
-    html_completed = set()
+    def _emit(self, rec):
+        self.writer.write(rec)
+        self.stage_stats.add(rec)
+        if "error" in rec:
+            self.error_count += 1
+        elif rec.get("status") == "skipped":
+            self.skip_count += 1
+        else:
+            self.success_count += 1
+            if rec.get("amended"):
+                self.amended.append(rec)
+    
+    def items(self):
+        """(番号, エントリー, 計画) をCSVの順に返す"""
+        return [(idx, entry, item) for idx, (entry, item) in enumerate(zip(self.url_entries, self.plan), 1)]
+    
+    def fetch_groups(self):
+        """
+        並行モード用: 計画でスキップと決まったエントリーはその場で書き出し、
+        取得するエントリーを自治体ごとにCSVの順（HTML → PDF）でまとめて返す。
+        1つのグループを1つのタスク内で処理し、html_exists の判定が逐次実行と同じ結果になるようにする。
+        """
+        groups = {}
+        for idx, entry, item in self.items():
+            if item["action"] == "skip":
+                self.run_entry(idx, entry, item)
+            else:
+                groups.setdefault(entry["municipality"], []).append((idx, entry, item))
+        return list(groups.values())
+    
+    def run_group(self, group):
+        for idx, entry, item in group:
+            self.run_entry(idx, entry, item)
     
-    meta = {}
-    results = []
-    total = len(url_entries)
-    success_count = 0
-    skip_count = 0
-    error_count = 0
+    def run_entry(self, idx, entry, item):
+        self.emitter.put(idx, self.handle_entry(idx, entry, item))
     
-    for idx, entry in enumerate(url_entries, 1):
+    def handle_entry(self, idx, entry, item):
         url = entry["url"]
+        label = f"[{self.prefix}{idx}/{self.total}]"
+        timer = StageTimer()
+        start = time.perf_counter()
+        attempt = 1
         try:
             # Pass metadata to process_url
             meta_info = {
                 "municipality": entry["municipality"],
                 "prefecture": entry["prefecture"],
-                "doc_type": entry["doc_type"]
+                "doc_type": entry["doc_type"],
+                "expect_pdf": item["expect_pdf"],
             }
-            rec = process_url(url, meta_info, html_completed)
+            if item["action"] == "skip":
+                # 計画時に決まったスキップ（ネットワークにアクセスしない）
+                rec = dict(item["record"], planned=True)
+            else:
+                while True:
+                    try:
+                        rec = process_url(url, meta_info, self.html_completed, self.ctx,
+                                          refresh=self.refresh, timer=timer)
+                        break
+                    except Exception as e:
+                        if attempt > RETRIES or not is_retryable(e):
+                            raise
+                        delay = backoff_delay(attempt, RETRY_BACKOFF, RETRY_BACKOFF_MAX,
+                                              getattr(e, "retry_after", None))
+                        print(f"{label} [RETRY] {entry['municipality']} ({entry['doc_type']}) {url} -> {e}; "
+                              f"{delay:.1f}秒後に再試行 ({attempt}/{RETRIES})")
+                        with timer.stage("retry_wait"):
+                            time.sleep(delay)
+                        attempt += 1
+                timer.add("total", time.perf_counter() - start)
+                rec.update(timer.as_record())
+                if attempt > 1:
+                    rec["attempts"] = attempt
             # Add metadata to record
             rec["municipality"] = entry["municipality"]
             rec["prefecture"] = entry["prefecture"]
             rec["doc_type"] = entry["doc_type"]
-            results.append(rec)
             
             if rec.get("status") == "skipped":
-                skip_count += 1
+                for key, value in item["carry"].items():
+                    if not rec.get(key):
+                        rec[key] = value
                 skip_reason = rec.get("method", "already_exists")
                 if skip_reason == "html_exists":
-                    print(f"[{idx}/{total}] [SKIP] {entry['municipality']} ({entry['doc_type']}) -> HTML versions exist")
+                    print(f"{label} [SKIP] {entry['municipality']} ({entry['doc_type']}) -> HTML versions exist")
+                elif skip_reason in ("not_modified", "unchanged"):
+                    print(f"{label} [SKIP] {entry['municipality']} ({entry['doc_type']}) -> Not changed ({skip_reason})")
                 else:
-                    print(f"[{idx}/{total}] [SKIP] {entry['municipality']} ({entry['doc_type']}) -> Already exists")
+                    print(f"{label} [SKIP] {entry['municipality']} ({entry['doc_type']}) -> Already exists")
             else:
-                success_count += 1
                 output_file = rec.get('output_pdf') or rec.get('output_txt', 'N/A')
-                print(f"[{idx}/{total}] [OK] {entry['municipality']} ({entry['doc_type']}) -> {output_file} ({rec['method']})")
+                print(f"{label} [OK] {entry['municipality']} ({entry['doc_type']}) -> {output_file} ({rec['method']})")
+            return rec
         except Exception as e:
-            error_count += 1
-            print(f"[{idx}/{total}] [ERR] {entry['municipality']} ({entry['doc_type']}) {url} -> {e}")
-            results.append({
+            print(f"{label} [ERR] {entry['municipality']} ({entry['doc_type']}) {url} -> {e}")
+            # 失敗までに掛かった時間も集計に含める
+            timer.add("total", time.perf_counter() - start)
+            return {
                 "url": url,
                 "municipality": entry["municipality"],
                 "prefecture": entry["prefecture"],
                 "doc_type": entry["doc_type"],
-                "error": str(e)
-            })
-
-    with open(index_path, "w", encoding="utf-8") as w:
-        for rec in results:
-            w.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                "error": str(e),
+                "attempts": attempt,
+                **timer.as_record(),
+            }
     
-    print(f"\nCompleted processing {urls_path}")
-    print(f"  Success: {success_count}")
-    print(f"  Skipped: {skip_count}")
-    print(f"  Errors:  {error_count}")
-    print(f"  Results saved to: {index_path}")
+    def counts(self):
+        return (self.success_count, self.skip_count, self.error_count,
+                self.success_count + self.skip_count + self.error_count)
     
-    return success_count, skip_count, error_count, len(results)
+    def print_summary(self):
+        print(f"\nCompleted processing {self.urls_path}")
+        print(f"  Success: {self.success_count}")
+        print(f"  Skipped: {self.skip_count}")
+        print(f"  Errors:  {self.error_count}")
+        if self.refresh:
+            print(f"  Amended: {len(self.amended)}")
+            for rec in self.amended:
+                print(f"    - {rec['municipality']} ({rec['doc_type']}) {rec['url']}")
+        self.stage_stats.print_summary()
+        print(f"  Results saved to: {self.ctx.index_path}")
+
+def print_host_summary():
+    """失敗のあったホストの統計を表示する"""
+    if HOST_SCHEDULER is None:
+        return
+    troubled = [h for h in HOST_SCHEDULER.summary() if h["failures"]]
+    if troubled:
+        print("  Hosts with failures:")
+        for h in troubled[:10]:
+            latency = f"{h['latency_ewma']:.2f}s" if h["latency_ewma"] is not None else "-"
+            print(f"    {h['host']}: {h['failures']}/{h['requests']} failed, "
+                  f"limit {h['limit']}, latency {latency}, breaker opened {h['breaker_opens']}x ({h['state']})")
+
+# 並行モードで投入済み・未完了にしておく自治体グループ数（workers あたり）
+TASK_WINDOW_PER_WORKER = 4
+
+def run_years(runs, workers=1):
+    """
+    YearRun のエントリーを処理する。workers > 1 の場合は全ての年で1つのスレッドプールを共有し、
+    各年の自治体グループを交互に投入する（同じホストへのリクエストが1つの年に偏らないように）。
+    未完了のグループは workers * TASK_WINDOW_PER_WORKER 個までとし、並べ替え待ちのレコードを抑える。
+    """
+    for run in runs:
+        run.open()
+    try:
+        if workers > 1:
+            per_year = [[(run, group) for group in run.fetch_groups()] for run in runs]
+            tasks = [task for batch in itertools.zip_longest(*per_year) for task in batch if task is not None]
+            pool = ThreadPoolExecutor(max_workers=workers)
+            window = workers * TASK_WINDOW_PER_WORKER
+            futures = deque()
+            try:
+                # 投入順に完了を待ち、未完了のタスクが window 個を超えないようにする
+                for run, group in tasks:
+                    if len(futures) >= window:
+                        futures.popleft().result()
+                    futures.append(pool.submit(run.run_group, group))
+                while futures:
+                    futures.popleft().result()
+            finally:
+                # Ctrl-C などで中断された場合は未着手のタスクを取り消す
+                pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            for run in runs:
+                for idx, entry, item in run.items():
+                    run.run_entry(idx, entry, item)
+    finally:
+        for run in runs:
+            run.close()
+
+def process_single_file(urls_path, workers=1, refresh=False, resume=False, slowest=SLOWEST_PER_STAGE,
+                        dry_run=False):
+    """
+    単一のURLファイルを処理
+
+    workers > 1 の場合はスレッドプールで並行に取得する。
+    index.jsonl のレコード順は workers に関わらずCSVの順になる。
+    refresh=True の場合は既存の出力を条件付きGETで再検証する（process_url 参照）。
+    resume=True の場合は既存の index.jsonl に追記し、完了済みのURLを処理しない。
+    終了時に段階別の所要時間のヒストグラムと、段階ごとに遅いURLを slowest 件表示する。
+
+    取得の前に plan_entries でネットワークを使わずにスキップできるエントリーを決め、
+    ネットワークにアクセスするのは残りのエントリーだけにする。
+    dry_run=True の場合は計画を表示するだけで、取得もファイルの書き込みもしない。
+    """
+    run = YearRun(urls_path, refresh=refresh, resume=resume, slowest=slowest, dry_run=dry_run)
+    if dry_run:
+        return run.planned_counts()
+    run_years([run], workers=workers)
+    run.print_summary()
+    print_host_summary()
+    return run.counts()
 
+def process_files_merged(urls_paths, workers=1, refresh=False, resume=False, slowest=SLOWEST_PER_STAGE,
+                         dry_run=False):
+    """
+    複数年のURLファイルを1つの作業キューにまとめて処理する（--merge-years）。
+    出力と index.jsonl は年ごとに別々に書き出す。所要時間は年の合計ではなく、
+    おおよそ最も大きい年（またはホストごとの制限）で決まる。
 
+    Returns: URLファイルごとの (success, skip, error, total) のリスト
+    """
+    runs = [YearRun(path, refresh=refresh, resume=resume, slowest=slowest, dry_run=dry_run, show_year=True)
+            for path in urls_paths]
+    if dry_run:
+        return [run.planned_counts() for run in runs]
+    run_years(runs, workers=workers)
+    for run in runs:
+        run.print_summary()
+    print_host_summary()
+    return [run.counts() for run in runs]
 
-def main(urls_path=None, year_input=None):
+
+
+def main(urls_path=None, year_input=None, workers=1, per_host=4, host_delay=0.5,
+         refresh=False, http_cache_path="http_cache.sqlite", resume=False, blob_root="blobs",
+         slowest=SLOWEST_PER_STAGE, breaker_threshold=5, breaker_cooldown=60.0, dry_run=False,
+         merge_years=False):
     """メイン処理関数"""
+    global HOST_SCHEDULER, HTTP_CACHE, BLOB_STORE
     print(f"Starting web_fetch.py...")
     
+    # --dry-run ではブロブストアやHTTPキャッシュのファイルも作らない
+    if blob_root and not dry_run:
+        BLOB_STORE = BlobStore(blob_root)
+    
+    if http_cache_path:
+        if not dry_run:
+            HTTP_CACHE = HttpCache(http_cache_path)
+    elif refresh:
+        print("エラー: --refresh にはHTTPキャッシュが必要です（--no-http-cache と併用できません）。")
+        sys.exit(1)
+    
+    # 逐次モードでもサーキットブレーカーは使う（リクエスト間隔は並行モードのみ）
+    HOST_SCHEDULER = HostScheduler(
+        max_per_host=per_host, delay=host_delay if workers > 1 else 0.0,
+        failure_threshold=breaker_threshold, cooldown=breaker_cooldown,
+    )
+    if workers > 1:
+        print(f"並行モード: workers={workers}, per-host={per_host}, host-delay={host_delay}s")
+    
     if urls_path:
         # 手動でファイルが指定された場合
         file_paths = [urls_path]
@@ -481,12 +1283,25 @@ def main(urls_path=None, year_input=None):
     total_error = 0
     total_urls = 0
     
-    for file_path in file_paths:
-        success, skip, error, urls = process_single_file(file_path)
-        total_success += success
-        total_skip += skip
-        total_error += error
-        total_urls += urls
+    try:
+        if merge_years and len(file_paths) > 1:
+            results = process_files_merged(file_paths, workers=workers, refresh=refresh, resume=resume,
+                                           slowest=slowest, dry_run=dry_run)
+        else:
+            results = [
+                process_single_file(file_path, workers=workers, refresh=refresh, resume=resume,
+                                    slowest=slowest, dry_run=dry_run)
+                for file_path in file_paths
+            ]
+        for success, skip, error, urls in results:
+            total_success += success
+            total_skip += skip
+            total_error += error
+            total_urls += urls
+    finally:
+        close_sessions()
+        if HTTP_CACHE is not None:
+            HTTP_CACHE.close()
     
     # 最終的な統計情報を表示
     print(f"\n{'='*60}")
@@ -511,13 +1326,44 @@ if __name__ == "__main__":
   python web_fetch.py -y 2016-2017       # 2016年と2017年を処理
   python web_fetch.py --list-years       # 利用可能な年のリストを表示
   python web_fetch.py --urls-file custom.csv  # カスタムファイルを指定
+  python web_fetch.py -y 2020 --workers 16 --per-host 2 --host-delay 1.0  # 並行取得
+  python web_fetch.py -y 2020 --refresh  # 条件付きGETで既存の出力を再検証し、改正を検出
+  python web_fetch.py -y 2020 --resume   # 中断したクロールを index.jsonl の続きから再開
+  python web_fetch.py -y 2020 --max-body-mb 50  # 50MBを超える本文はエラーにする
+  python web_fetch.py -y 2020 -w 16 --retries 3 --connect-timeout 3  # 不安定なサーバー向け
+  python web_fetch.py -y 2020 --dry-run  # 取得・スキップの計画だけを表示（ネットワークにアクセスしない）
+  python web_fetch.py -y 2014-2021 -w 16 --merge-years  # 全ての年を1つの作業キューで並行に処理
         """
     )
     parser.add_argument("--year", "-y", type=str, help="処理対象の年（例: 2014, 2015, 2014-2018）")
     parser.add_argument("--list-years", "-l", action="store_true", help="利用可能な年のリストを表示")
     parser.add_argument("--urls-file", type=str, help="URLファイルのパス（手動指定）")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="同時に処理するURL数の上限（デフォルト: 1 = 逐次処理）")
+    parser.add_argument("--per-host", type=int, default=4, help="並行モードでの同一ホストへの同時接続数の上限（1から応答に応じて増減、デフォルト: 4）")
+    parser.add_argument("--host-delay", type=float, default=0.5, help="並行モードでの同一ホストへのリクエスト間隔（秒、デフォルト: 0.5）")
+    parser.add_argument("--refresh", action="store_true", help="既存の出力もETag/Last-Modified/ハッシュで再検証し、変更があれば更新する")
+    parser.add_argument("--http-cache", type=str, default="http_cache.sqlite", help="HTTPキャッシュのパス（デフォルト: http_cache.sqlite）")
+    parser.add_argument("--no-http-cache", action="store_true", help="HTTPキャッシュを使用しない")
+    parser.add_argument("--resume", action="store_true", help="既存の index.jsonl で完了済みのURLをスキップし、続きから追記する")
+    parser.add_argument("--blob-store", type=str, default="blobs", help="本文を sha256 で保存するブロブストアのディレクトリ（デフォルト: blobs）")
+    parser.add_argument("--no-blob-store", action="store_true", help="ブロブストアを使用せず、年別ディレクトリに直接保存する")
+    parser.add_argument("--max-body-mb", type=float, default=MAX_BODY_BYTES / 1024 / 1024, help="1件の本文の上限サイズ（MB、0で無制限、デフォルト: 200）")
+    parser.add_argument("--slowest", type=int, default=SLOWEST_PER_STAGE, help=f"終了時に段階ごとに表示する遅いURLの件数（デフォルト: {SLOWEST_PER_STAGE}）")
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT, help=f"接続確立のタイムアウト（秒、デフォルト: {CONNECT_TIMEOUT:g}）")
+    parser.add_argument("--read-timeout", type=float, default=READ_TIMEOUT, help=f"レスポンス読み取りのタイムアウト（秒、デフォルト: {READ_TIMEOUT:g}）")
+    parser.add_argument("--retries", type=int, default=RETRIES, help=f"接続エラー・タイムアウト・429/5xx の再試行回数（デフォルト: {RETRIES}）")
+    parser.add_argument("--retry-backoff", type=float, default=RETRY_BACKOFF, help=f"再試行の待ち時間の基準（秒、ジッター付きで倍々に増える、デフォルト: {RETRY_BACKOFF:g}）")
+    parser.add_argument("--breaker-threshold", type=int, default=5, help="連続して失敗したらそのホストを一時停止する回数（デフォルト: 5）")
+    parser.add_argument("--merge-years", action="store_true", help="複数年を順番にではなく1つの作業キューにまとめて処理する（出力・index.jsonl は年ごと）")
+    parser.add_argument("--dry-run", action="store_true", help="各URLを取得するかスキップするかの計画を表示して終了する")
+    parser.add_argument("--breaker-cooldown", type=float, default=60.0, help="ホストを一時停止する時間（秒、開くたびに倍、デフォルト: 60）")
     
     args = parser.parse_args()
+    MAX_BODY_BYTES = int(args.max_body_mb * 1024 * 1024)
+    CONNECT_TIMEOUT = args.connect_timeout
+    READ_TIMEOUT = args.read_timeout
+    RETRIES = args.retries
+    RETRY_BACKOFF = args.retry_backoff
     
     if args.list_years:
         available_years = get_available_years()
@@ -529,4 +1375,10 @@ if __name__ == "__main__":
             print("年別URLファイルが見つかりません。")
         sys.exit(0)
     
-    main(urls_path=args.urls_file, year_input=args.year)
+    main(urls_path=args.urls_file, year_input=args.year,
+         workers=args.workers, per_host=args.per_host, host_delay=args.host_delay,
+         refresh=args.refresh, http_cache_path=None if args.no_http_cache else args.http_cache,
+         resume=args.resume, blob_root=None if args.no_blob_store else args.blob_store,
+         slowest=args.slowest, breaker_threshold=args.breaker_threshold,
+         breaker_cooldown=args.breaker_cooldown, dry_run=args.dry_run,
+         merge_years=args.merge_years)